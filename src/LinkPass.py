@@ -4,17 +4,32 @@ LinkPass — менеджер паролей
 Автор: Савин Евгений Олегович
 Сайт: www.linkpass.ru
 """
-import sys, os, json, shutil, base64, hashlib, secrets, zipfile, sqlite3, csv, math, io, traceback, subprocess, ctypes, tempfile, signal
+import sys, os, json, shutil, base64, hashlib, secrets, zipfile, sqlite3, csv, math, io, traceback, subprocess, ctypes, tempfile, signal, struct, threading, hmac, time, functools, bisect, heapq, mimetypes
+from array import array
+from abc import ABC, abstractmethod
 APP_TITLE = "LinkPass — менеджер паролей"
 CURRENT_VERSION = 1
+VAULT_FORMAT = 3
+AUTH_SCHEME = "hkdf1"
 SHARE_TEMP_TTL_SEC = 60
 from datetime import datetime, timedelta
 import importlib
 import re
 from urllib.parse import quote
-MAX_CARDS = 300
+from collections import OrderedDict
 CARD_FIELDS_LIMIT = 12
 SEARCH_DEBOUNCE_MS = 250
+JOURNAL_COMPACT_BYTES = 2 * 1024 * 1024
+PLAIN_CACHE_ITEMS = 20000
+TRIGRAM_MIN_BLOCKS = 20000
+INDEX_SYNC_BLOCKS = 2000
+SEARCH_RECENCY_SEC = 30 * 86400
+SEARCH_RECENCY_BOOST = 0.9
+INDEX_MAX_DELTAS = 8
+INDEX_DELTA_MIN_IDS = 4096
+PLAIN_CACHE_BYTES = 16 * 1024 * 1024
+ATTACH_SEGMENT = 1024 * 1024
+ATTACH_PREVIEW_MAX = 20 * 1024 * 1024
 TREE_RENDER_DELAY_MS = 60
 DEFAULT_EXPAND_DEPTH = -1
 ARGON2_TIME_COST = 4
@@ -26,6 +41,9 @@ KDF_DEFAULTS = {
     "m": ARGON2_MEMORY_COST,
     "p": ARGON2_PARALLELISM,
 }
+KDF_FLOOR = {"t": 2, "m": 64 * 1024, "p": 1}
+KDF_TARGET_MS = 500
+KDF_MEMORY_CEILING = 1024 * 1024
 def _mix_master_with_pepper(master: str) -> str:
     try:
         pep_b64 = os.environ.get("LINKPASS_PEPPER_B64", "").strip()
@@ -76,16 +94,16 @@ def ensure_dependencies():
 ensure_dependencies()
 import pandas as pd
 from PySide6 import QtCore
-from PySide6.QtCore import Qt, QTimer, QObject, QEvent, Signal, QCoreApplication, QUrl, QLocale, QUrlQuery, QSize
-from PySide6.QtGui import QAction, QIcon, QDrag, QDesktopServices, QColor, QPixmap, QCursor, QImageReader, QPainter, QPen, QFont
+from PySide6.QtCore import Qt, QTimer, QObject, QEvent, Signal, QCoreApplication, QUrl, QLocale, QUrlQuery, QSize, QAbstractListModel, QModelIndex
+from PySide6.QtGui import QAction, QIcon, QDrag, QDesktopServices, QColor, QPixmap, QCursor, QImageReader, QPainter, QPen, QFont, QFontMetrics
 from PySide6.QtWidgets import (
     QApplication, QWidget, QTreeWidget, QTreeWidgetItem, QHBoxLayout, QVBoxLayout,
     QPushButton, QMenu, QInputDialog, QMessageBox, QLabel, QLineEdit, QScrollArea,
     QFileDialog, QMainWindow, QFrame, QGridLayout, QSplitter, QDialog, QComboBox,
-    QTableWidget, QTableWidgetItem, QAbstractItemView, QListWidget, QTextEdit,
+    QTableWidget, QTableWidgetItem, QAbstractItemView, QListWidget, QListWidgetItem, QTextEdit,
     QSystemTrayIcon, QTabWidget, QDateTimeEdit, QColorDialog, QSpinBox, QDialogButtonBox,
     QCheckBox, QPlainTextEdit, QStackedWidget, QProgressDialog, QLayout,
-    QToolButton, QProgressBar, QWidgetItem, QSizePolicy, QHeaderView
+    QToolButton, QProgressBar, QWidgetItem, QSizePolicy, QHeaderView, QListView, QStyledItemDelegate, QStyle, QToolTip
 )
 def tr(s: str, *args, **kwargs):
     try:   
@@ -94,7 +112,7 @@ def tr(s: str, *args, **kwargs):
         return s
 def translate_widget_tree(*_args, **_kwargs):
     return
-from typing import Optional, Callable, Any, List, Tuple
+from typing import Optional, Callable, Any, List, Tuple, Iterable
 try:
     import pyotp
     HAS_TOTP = True
@@ -106,7 +124,12 @@ except Exception:
     _argon_hash_secret = None
     _Argon2Type = None
 HAS_ARGON2: bool = _argon_hash_secret is not None and _Argon2Type is not None
-from cryptography.fernet import Fernet, InvalidToken
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from cryptography.hazmat.primitives.keywrap import aes_key_wrap, aes_key_unwrap, InvalidUnwrap
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.exceptions import InvalidTag
 class WrongMasterPasswordError(Exception):
     pass
 def brand_icon(name: str) -> QIcon:
@@ -133,13 +156,18 @@ os.makedirs(DATA_DIR, exist_ok=True)
 ICON_PATH = resource_path('favicon.ico')
 TREE_FILE   = os.path.join(DATA_DIR, "tree.json")
 BLOCKS_FILE = os.path.join(DATA_DIR, "blocks.json")
+CATALOG_FILE = os.path.join(DATA_DIR, "catalog.json")
+RECORDS_DIR = os.path.join(DATA_DIR, "records")
+JOURNAL_FILE = os.path.join(DATA_DIR, "journal.lpj")
+REKEY_FILE = os.path.join(DATA_DIR, "rekey.json")
 TRASH_FILE  = os.path.join(DATA_DIR, "trash.json")
 META_FILE   = os.path.join(DATA_DIR, "meta.json")
 MASTER_FILE = os.path.join(DATA_DIR, "auth.json")
 SNAP_DIR    = os.path.join(DATA_DIR, "snapshots")
 INDEX_DB    = os.path.join(DATA_DIR, "index.db")
 ATTACH_DIR  = os.path.join(DATA_DIR, "attachments")
-for d in (SNAP_DIR, ATTACH_DIR):
+ATTACH_CATALOG_FILE = os.path.join(DATA_DIR, "attachments.json")
+for d in (SNAP_DIR, ATTACH_DIR, RECORDS_DIR):
     os.makedirs(d, exist_ok=True)
 PROGRAM_INFO = (
     "LinkPass — менеджер паролей\n"
@@ -169,8 +197,8 @@ LinkPass — Руководство пользователя
 11. Перемещение, сортировка и удаление
 12. Защита разделов паролем, разблокировка цепочки
 13. Импорт данных (XLSX/CSV/JSON/TXT)
-14. Экспорт данных: обычный и шифрованный (LPX1)
-15. Бэкап и восстановление (LPX1/LPBK/LPEX/ZIP)
+14. Экспорт данных: обычный и шифрованный (LPX2)
+15. Бэкап и восстановление (LPX2/LPX1/LPBK/LPEX/ZIP)
 16. Смена мастер‑пароля
 17. Параметры KDF (Argon2id): производительность и миграция
 18. Поделиться данными: Telegram / WhatsApp / Email
@@ -228,9 +256,12 @@ LinkPass — менеджер персональных данных/пароле
   • Поля (до N видимых строк на карточке), кнопки «↗» (перейти по URL/mailto), «🗐» (скопировать).
   • Кнопки внизу: «🔍 Открыть», «↔️ Переместить», «📁 Вложения», «📝 Заметки», «🗑️ Удалить».
   • «🔗» — меню «Поделиться» (см. 18), «QR» — показать QR‑код с данными.
+  • Двойной щелчок по карточке открывает блок. Показываются все блоки раздела: карточки рисуются только
+    в видимой области, поэтому даже разделы с сотнями тысяч блоков прокручиваются без задержек.
 
 Перетаскивание:
-  • Перетащите карточку мышью на нужный раздел слева — блок переместится.
+  • Перетащите карточку мышью на нужный раздел слева — блок переместится. Выделите несколько карточек
+    (Ctrl/Shift + щелчок), чтобы перенести их разом.
 
 ────────────────────────────────────────────────────────
 5) Разделы и подразделы (дерево слева)
@@ -290,6 +321,12 @@ LinkPass — менеджер персональных данных/пароле
   – «Сохранить как…» — расшифровать и сохранить файл на диск.
   – «Удалить вложение» — удаляет файл из хранилища.
   – Предпросмотр: изображения и мелкие тексты отображаются; большие/неподдерживаемые — без предпросмотра.
+• Файлы шифруются потоково, блоками по 1 МБ (каждый блок со своей меткой подлинности), в фоне
+  с индикатором прогресса — объём вложения не ограничен оперативной памятью. Вложения старого
+  формата читаются как прежде и переводятся в новый при полной перешифровке.
+• Список вложений (имена, размеры, тип, контрольная сумма, дата добавления) хранится в зашифрованном
+  каталоге attachments.json: счётчик 📎 на карточках, фильтр «только с вложениями» и бэкап не
+  просматривают папку attachments/. При каждом входе каталог в фоне сверяется с диском и исправляется.
 • «Поделиться» (меню: Telegram, WhatsApp, Email) готовит временную расшифрованную копию в отдельной
   папке. Временная папка удаляется автоматически через 60 секунд (по умолчанию).
 
@@ -303,8 +340,20 @@ LinkPass — менеджер персональных данных/пароле
 ────────────────────────────────────────────────────────
 Поиск:
   • Введите запрос в поле «Поиск…».
-  • Режим «Блоки» — ищет по заголовку/категории/содержимому (индексу) блока.
-  • Режим «Поля» — ищет по именам полей и их значениям (включая заметки).
+  • Режим «Блоки» — ищет по заголовку/категории/содержимому (индексу) блока. Запрос ищется как подстрока
+    (например, «банк» найдёт «Сбербанк»), регистр и «ё/е» не различаются. В больших хранилищах поиск
+    ускоряется триграммным индексом, результат от этого не меняется.
+  • Если SQLite поддерживает FTS5, индекс строится в памяти и хранится в index.db в зашифрованном виде;
+    результаты упорядочены по релевантности (совпадения в заголовке выше). Можно ограничить поиск
+    колонкой: «заголовок:сбер», «категория:банки», «поле:логин», «заметки:"пин код"»
+    (также title:, category:, field:, notes:). Звёздочка в конце слова допускается («банк*»).
+    Без FTS5 используется встроенный индекс, фильтры колонок тогда не действуют.
+  • Режим «Поля» — ищет по именам полей и их значениям (подстрока, регистр и «ё/е» не различаются); ответ
+    берётся из индекса, значения при поиске не расшифровываются. Запрос вида «Логин=ivan» ищет только в поле
+    «Логин» (имя с пробелами — в кавычках: «"Номер карты"=1234»), а «Логин=» находит все блоки с таким полем.
+  • Результаты поиска упорядочены по релевантности: совпадение в заголовке выше, чем в имени поля, в значении
+    поле и в заметках; точное совпадение и недавно изменённые блоки поднимаются выше. Показываются все
+    найденные блоки: карточки рисуются по мере прокрутки, поэтому даже очень большие разделы не обрезаются.
 
 Умные папки:
   • «Настройки → 🧠 Умные папки»: создайте правило (имя, запрос, область — весь корень или конкретный раздел,
@@ -312,7 +361,7 @@ LinkPass — менеджер персональных данных/пароле
   • В дереве слева появится ветка «🧠 Умные папки», внутри — виртуальные подборки.
 
 Примечания:
-  • При большом числе карточек показываются первые 300, остальные скрыты — уточните запрос.
+  • Показываются все подходящие блоки, упорядоченные по релевантности запроса.
 
 ────────────────────────────────────────────────────────
 11) Перемещение, сортировка и удаление
@@ -351,22 +400,24 @@ LinkPass — менеджер персональных данных/пароле
 • Остальные столбцы импортируются как поля блока. Пустые значения игнорируются.
 
 ────────────────────────────────────────────────────────
-14) Экспорт данных: обычный и шифрованный (LPX1)
+14) Экспорт данных: обычный и шифрованный (LPX2)
 ────────────────────────────────────────────────────────
 Обычный экспорт: «Файл → 📤 Экспорт (обычный)» → выберите формат (XLSX/CSV/JSON/TXT/HTML).  
-Шифрованный экспорт (LPX1): «Файл → 🔐 Экспорт (шифр.)» → задайте пароль. Получится зашифрованный контейнер.
+Шифрованный экспорт (LPX2): «Файл → 🔐 Экспорт (шифр.)» → задайте пароль. Получится зашифрованный контейнер.
 Экспорт раздела: ПКМ по разделу → «📤 Экспортировать раздел…».
 
 Важно:
-• Шифрованный экспорт (LPX1) — отдельный файл с паролем, пригоден для безопасной передачи.
+• Шифрованный экспорт (LPX2) — отдельный файл с паролем, пригоден для безопасной передачи.
+• Файлы .lpx записываются в двоичном формате LPX2 (AES‑GCM, без base64) — на треть компактнее
+  прежнего LPX1. Файлы LPX1 и старые бэкапы по‑прежнему открываются.
 • «Импорт (шифр.)» предназначен для совместимых экспортов той же установки. Для «универсальных»
   бэкапов используйте раздел 15.
 
 ────────────────────────────────────────────────────────
-15) Бэкап и восстановление (LPX1/LPBK/LPEX/ZIP)
+15) Бэкап и восстановление (LPX2/LPX1/LPBK/LPEX/ZIP)
 ────────────────────────────────────────────────────────
 Бэкап (зашифрованный):
-• «Файл → 🗄️ Бэкап → 🗄️ Создать бэкап (шифр.)» → задайте пароль → получите .lpx (LPX1).
+• «Файл → 🗄️ Бэкап → 🗄️ Создать бэкап (шифр.)» → задайте пароль → получите .lpx (LPX2).
 • Внутри — zip‑контейнер с полным снимком папки данных (включая вложения).
 
 Восстановление:
@@ -383,8 +434,12 @@ LinkPass — менеджер персональных данных/пароле
 ────────────────────────────────────────────────────────
 Меню: «Настройки → 🗝️ Смена мастер‑пароля».
 • Введите новый пароль и подтвердите.
-• Все поля и вложения будут пере‑зашифрованы под новым ключом.
-• На время операции может потребоваться подождать (особенно при больших данных).
+• Данные зашифрованы случайным ключом хранилища; при смене пароля перешифровывается только этот ключ,
+  поэтому операция выполняется мгновенно независимо от объёма данных и вложений.
+• Хранилища старых версий при первом запуске один раз переводятся на случайный ключ в фоне.
+• «Настройки → 🔁 Полная перешифровка» создаёт новый ключ хранилища и перешифровывает все данные
+  и вложения (параллельно, с прогрессом). Прерванная операция продолжается с места остановки;
+  старый ключ удаляется только после проверки всех объектов под новым ключом.
 
 ────────────────────────────────────────────────────────
 17) Параметры KDF (Argon2id): производительность и миграция
@@ -392,8 +447,12 @@ LinkPass — менеджер персональных данных/пароле
 • Ключ шифрования получается из мастер‑пароля через KDF Argon2id (по умолчанию с параметрами,
   указанными разработчиком сборки).
 • При старте программа может предложить «Обновить параметры KDF…» до рекомендуемых. Согласитесь —
-  данные будут пере‑зашифрованы с новым KDF.
+  ключ хранилища будет перешифрован с новым KDF.
 • Рекомендованные параметры для баланса безопасности/скорости: t=4, m=128MiB, p=2.
+• «Настройки → Калибровка KDF» измеряет скорость Argon2id на этом устройстве и подбирает t/m/p
+  под заданное время разблокировки (по умолчанию 500 мс), используя все ядра процессора.
+• Предложение обновить KDF при старте появляется, только если параметры ниже минимальных
+  (t=2, m=64MiB, p=1).
 • Смена KDF выполняется безопасно через «миграцию»: старые данные расшифровываются и шифруются заново.
 
 ────────────────────────────────────────────────────────
@@ -426,8 +485,15 @@ LinkPass — менеджер персональных данных/пароле
 • macOS:  ~/Library/Application Support/LinkPass
 • Linux:  ~/.local/share/LinkPass
 
-Внутри находятся: tree.json, blocks.json, trash.json, meta.json, auth.json, index.db, папка attachments/
-(всё, кроме auth.json и index.db, хранится в зашифрованном виде).
+Внутри находятся: tree.json, catalog.json, journal.lpj, trash.json, meta.json, auth.json, index.db, attachments.json, папки records/ и attachments/
+(всё, кроме auth.json, хранится в зашифрованном виде). Каждый блок лежит в records/ отдельной
+записью, а значения всех его полей и заметки запечатаны одним шифротекстом — блок читается за одну расшифровку.
+Поисковый индекс хранится как базовый сегмент index.db и небольшие дельта-сегменты index.db.*.lpd с изменениями;
+они периодически сливаются в фоне. Если индекс соответствует содержимому хранилища, при входе он не перестраивается,
+а при расхождении заново индексируются только изменённые блоки. Полную перестройку можно запустить вручную:
+«Настройки → 🔎 Перестроить поисковый индекс». Большие объёмы (первый запуск, восстановление бэкапа, импорт
+тысяч строк) индексируются в фоне: ход виден в строке состояния, программой можно пользоваться сразу,
+а поиск до завершения работает медленнее (прямым просмотром блоков).
 Перенос:
 • Закройте программу на исходном компьютере.
 • Скопируйте всю папку данных целиком на новый компьютер в соответствующее место.
@@ -470,7 +536,7 @@ C) Нет бэкапа и мастер‑пароль забыт:
 ────────────────────────────────────────────────────────
 • Используйте длинный мастер‑пароль и не используйте его нигде больше.
 • Включите регулярный зашифрованный бэкап:
-  – «Настройки → ⏱️ Экспорт по расписанию» — задайте папку и пароль для LPX1‑контейнера.
+  – «Настройки → ⏱️ Экспорт по расписанию» — задайте папку и пароль для LPX2‑контейнера.
 • Защищайте чувствительные ветки дерева отдельными паролями разделов.
 • Храните бэкапы и «pepper» отдельно от рабочего ПК.
 • При шаринге файлов помните, что временная расшифрованная копия существует короткое время в
@@ -618,6 +684,25 @@ def derive_key(master: str, key_salt: bytes,
         )
     m = _mix_master_with_pepper(master)
     return pbkdf2_key(m, key_salt, length=32)
+def kdf_below_floor(params: dict | None) -> bool:
+    p = params or KDF_DEFAULTS
+    return any(int(p.get(k, 0) or 0) < v for k, v in KDF_FLOOR.items())
+def calibrate_kdf_params(target_ms: int = KDF_TARGET_MS,
+                         max_memory_kib: int = KDF_MEMORY_CEILING,
+                         parallelism: int | None = None) -> dict:
+    p = max(1, min(int(parallelism or os.cpu_count() or 1), 64))
+    salt = rand_bytes(SALT_LEN)
+    def bench(t: int, m: int) -> float:
+        t0 = time.perf_counter()
+        argon2id_key("linkpass-calibration", salt, t=t, m=m, p=p)
+        return (time.perf_counter() - t0) * 1000.0
+    m = max(KDF_FLOOR["m"], 8 * p)
+    ms = bench(1, m)
+    while m * 2 <= max_memory_kib and ms * 2 <= target_ms / KDF_FLOOR["t"]:
+        m *= 2
+        ms = bench(1, m)
+    t = max(KDF_FLOOR["t"], int(target_ms // max(ms, 1.0)))
+    return {"t": t, "m": m, "p": p, "ms": round(bench(t, m))}
 def make_fernet(master: str, key_salt: bytes,
                 *, kdf_name: str = "argon2id",
                 params: dict | None = None) -> Fernet:
@@ -640,20 +725,337 @@ def hash_for_auth(master: str, auth_salt: bytes,
         m = _mix_master_with_pepper(master)
         raw = pbkdf2_key(m, auth_salt, length=32)
     return base64.b64encode(raw).decode("utf-8")
+def hkdf_subkey(secret: bytes, info: bytes, salt: bytes | None = None, length: int = 32) -> bytes:
+    return HKDF(algorithm=hashes.SHA256(), length=length, salt=salt, info=info).derive(secret)
+def auth_verifier(secret: bytes, auth_salt: bytes) -> str:
+    return base64.b64encode(hkdf_subkey(secret, b"LinkPass auth verifier", auth_salt)).decode("utf-8")
+def kek_from_secret(secret: bytes) -> bytes:
+    return hkdf_subkey(secret, b"LinkPass key wrap")
+SEAL_MAGIC = b"LPS"
+SEAL_VERSION = 1
+SEAL_AESGCM = 1
+SEAL_HEAD = struct.Struct(">3sBB4s")
+SEAL_NONCE = 12
+@functools.lru_cache(maxsize=16)
+def _seal_aead(key: bytes) -> AESGCM:
+    return AESGCM(hkdf_subkey(key, b"LinkPass envelope"))
+def is_sealed(blob: bytes) -> bool:
+    return blob[:4] == SEAL_MAGIC + bytes([SEAL_VERSION])
+def seal_bytes(key: bytes, data: bytes, aad: bytes = b"") -> bytes:
+    head = SEAL_HEAD.pack(SEAL_MAGIC, SEAL_VERSION, SEAL_AESGCM, VaultKeyring.key_id(key))
+    nonce = rand_bytes(SEAL_NONCE)
+    return head + nonce + _seal_aead(key).encrypt(nonce, data, head + aad)
+def unseal_bytes(key_for: Callable[[bytes], bytes | None], blob: bytes, aad: bytes = b"") -> bytes:
+    if len(blob) < SEAL_HEAD.size + SEAL_NONCE + 16 or not is_sealed(blob):
+        raise InvalidToken()
+    magic, ver, alg, kid = SEAL_HEAD.unpack(blob[:SEAL_HEAD.size])
+    key = key_for(kid) if alg == SEAL_AESGCM else None
+    if key is None:
+        raise InvalidToken()
+    nonce = blob[SEAL_HEAD.size:SEAL_HEAD.size + SEAL_NONCE]
+    try:
+        return _seal_aead(key).decrypt(nonce, bytes(blob[SEAL_HEAD.size + SEAL_NONCE:]), bytes(blob[:SEAL_HEAD.size]) + aad)
+    except InvalidTag as e:
+        raise InvalidToken() from e
+class VaultKeyring:
+    def __init__(self, dek: bytes, dek_next: bytes | None = None, origin: str = "random", kek: bytes | None = None):
+        self.dek = dek
+        self.dek_next = dek_next
+        self.origin = origin
+        self.kek = kek
+        keys = [k for k in (dek_next, dek) if k]
+        self._mf = MultiFernet([Fernet(base64.urlsafe_b64encode(k)) for k in keys])
+    @property
+    def rekey_pending(self) -> bool:
+        return self.dek_next is not None or self.origin != "random"
+    def encrypt(self, data: bytes) -> bytes:
+        return self._mf.encrypt(data)
+    def decrypt(self, token, ttl: int | None = None) -> bytes:
+        return self._mf.decrypt(token, ttl)
+    def rotate(self, token) -> bytes:
+        return self._mf.rotate(token)
+    @staticmethod
+    def key_id(key: bytes) -> bytes:
+        return hashlib.blake2b(key, digest_size=4).digest()
+    def primary_key(self) -> bytes:
+        return self.dek_next or self.dek
+    def key_for(self, kid: bytes) -> bytes | None:
+        for k in (self.dek_next, self.dek):
+            if k and hmac.compare_digest(self.key_id(k), kid):
+                return k
+        return None
+    def seal(self, data: bytes, aad: bytes = b"") -> bytes:
+        return seal_bytes(self.primary_key(), data, aad)
+    def unseal(self, blob: bytes, aad: bytes = b"") -> bytes:
+        return unseal_bytes(self.key_for, blob, aad)
+    def with_kek(self, kek: bytes) -> "VaultKeyring":
+        return VaultKeyring(self.dek, self.dek_next, self.origin, kek)
+    def wrap(self) -> dict:
+        if not self.kek:
+            raise RuntimeError("key-encryption key is not available")
+        rec = {"dek": base64.b64encode(aes_key_wrap(self.kek, self.dek)).decode("utf-8"),
+               "dek_origin": self.origin}
+        if self.dek_next:
+            rec["dek_next"] = base64.b64encode(aes_key_wrap(self.kek, self.dek_next)).decode("utf-8")
+        return rec
+    @classmethod
+    def unwrap(cls, kek: bytes, j: dict) -> "VaultKeyring":
+        try:
+            dek = aes_key_unwrap(kek, base64.b64decode(j["dek"]))
+            nxt = aes_key_unwrap(kek, base64.b64decode(j["dek_next"])) if j.get("dek_next") else None
+        except InvalidUnwrap as e:
+            raise WrongMasterPasswordError("invalid master password") from e
+        return cls(dek, nxt, j.get("dek_origin", "random"), kek)
 def write_auth_file(key_salt: bytes, auth_salt: bytes, verifier_b64: str,
                     kdf_name: str | None = None,
-                    kdf_params: dict | None = None):
+                    kdf_params: dict | None = None,
+                    vault_format: int = VAULT_FORMAT,
+                    keyring: VaultKeyring | None = None):
     rec = {
         "key_salt": base64.b64encode(key_salt).decode("utf-8"),
         "auth_salt": base64.b64encode(auth_salt).decode("utf-8"),
         "verifier": verifier_b64,
+        "scheme": AUTH_SCHEME,
         "kdf": kdf_name or ("argon2id" if HAS_ARGON2 else "pbkdf2"),
         "kdf_params": kdf_params or KDF_DEFAULTS,
         "ver": CURRENT_VERSION,
+        "vault_format": vault_format,
     }
+    if keyring is not None:
+        rec.update(keyring.wrap())
     atomic_write_json(MASTER_FILE, rec)
+def commit_keyring(keyring: VaultKeyring) -> None:
+    with open(MASTER_FILE, "r", encoding="utf-8") as f:
+        j = json.load(f)
+    j.pop("dek_next", None)
+    j.pop("data_key", None)
+    j.update(keyring.wrap())
+    atomic_write_json(MASTER_FILE, j)
+def create_auth_file(master: str) -> VaultKeyring:
+    key_salt = rand_bytes(SALT_LEN)
+    auth_salt = rand_bytes(SALT_LEN)
+    kdf_name = "argon2id" if HAS_ARGON2 else "pbkdf2"
+    secret = derive_key(master, key_salt, prefer_argon=(kdf_name == "argon2id"), params=KDF_DEFAULTS)
+    ring = VaultKeyring(rand_bytes(32), kek=kek_from_secret(secret))
+    write_auth_file(key_salt, auth_salt, auth_verifier(secret, auth_salt), kdf_name, KDF_DEFAULTS, keyring=ring)
+    return ring
+def unlock_master(master: str, upgrade: bool = True) -> VaultKeyring:
+    with open(MASTER_FILE, "r", encoding="utf-8") as f:
+        j = json.load(f)
+    key_salt = base64.b64decode(j.get("key_salt", "") or b"")
+    auth_salt = base64.b64decode(j.get("auth_salt", "") or b"")
+    kdf_name = j.get("kdf", "argon2id" if HAS_ARGON2 else "pbkdf2")
+    params = j.get("kdf_params") or KDF_DEFAULTS
+    secret = derive_key(master, key_salt, prefer_argon=(kdf_name == "argon2id"), params=params)
+    verifier = str(j.get("verifier") or "")
+    dirty = False
+    if j.get("scheme") == AUTH_SCHEME:
+        ok = hmac.compare_digest(auth_verifier(secret, auth_salt), verifier)
+    else:
+        calc = hash_for_auth(master, auth_salt, prefer_argon=(kdf_name == "argon2id"), params=params)
+        ok = bool(verifier) and hmac.compare_digest(calc, verifier)
+        if ok:
+            j.update({"scheme": AUTH_SCHEME, "verifier": auth_verifier(secret, auth_salt), "kdf_params": params})
+            dirty = True
+    if not ok:
+        raise WrongMasterPasswordError("invalid master password")
+    kek = kek_from_secret(secret)
+    if j.get("dek"):
+        return VaultKeyring.unwrap(kek, j)
+    data_key = secret if j.get("data_key", "master") == "master" else hkdf_subkey(secret, b"LinkPass data key")
+    ring = VaultKeyring(data_key, origin="derived", kek=kek)
+    if upgrade:
+        j.pop("data_key", None)
+        j.update(ring.wrap())
+        dirty = True
+    if dirty and upgrade:
+        atomic_write_json(MASTER_FILE, j)
+    return ring
+def mark_auth_vault_format(vault_format: int) -> None:
+    try:
+        with open(MASTER_FILE, "r", encoding="utf-8") as f:
+            j = json.load(f)
+        if j.get("vault_format") != vault_format:
+            j["vault_format"] = vault_format
+            atomic_write_json(MASTER_FILE, j)
+    except Exception:
+        pass
+class PlainCache:
+    def __init__(self, max_items: int, max_bytes: int):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._d: OrderedDict[Any, tuple[Any, int]] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+    def __len__(self) -> int:
+        return len(self._d)
+    def get(self, key) -> Any:
+        with self._lock:
+            rec = self._d.get(key)
+            if rec is None:
+                self.misses += 1
+                return None
+            self._d.move_to_end(key)
+            self.hits += 1
+            return rec[0]
+    def put(self, key, value, size: int = 0) -> None:
+        with self._lock:
+            old = self._d.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._d[key] = (value, size)
+            self._bytes += size
+            while self._d and (len(self._d) > self.max_items or self._bytes > self.max_bytes):
+                _, (_, n) = self._d.popitem(last=False)
+                self._bytes -= n
+    def clear(self) -> None:
+        with self._lock:
+            self._d.clear()
+            self._bytes = 0
+            self.hits = 0
+            self.misses = 0
+    def stats(self) -> dict:
+        with self._lock:
+            return {"items": len(self._d), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+SEALED_VALUE_PREFIX = "lpb1:"
+SEALED_CACHE_MAX = 4096
+_sealed_plain = PlainCache(SEALED_CACHE_MAX, PLAIN_CACHE_BYTES)
+def _open_sealed_blob(blob: str, fernet: Fernet) -> dict:
+    plain = _sealed_plain.get(blob)
+    if plain is not None:
+        return plain
+    if not isinstance(fernet, VaultKeyring):
+        raise InvalidToken()
+    try:
+        raw = fernet.unseal(base64.urlsafe_b64decode(blob), SEALED_VALUE_PREFIX.encode("ascii"))
+    except (ValueError, TypeError) as e:
+        raise InvalidToken() from e
+    plain = json.loads(raw.decode("utf-8"))
+    _remember_sealed(blob, plain)
+    return plain
+def _remember_sealed(blob: str, plain: dict) -> None:
+    size = sum(len(str(v)) for v in plain.get("f", [])) + len(str(plain.get("n", "")))
+    _sealed_plain.put(blob, plain, size)
+def _split_sealed_value(val: str, blob: str | None = None) -> tuple[str, str] | None:
+    if not isinstance(val, str) or not val.startswith(SEALED_VALUE_PREFIX):
+        return None
+    slot, sep, own = val[len(SEALED_VALUE_PREFIX):].partition(":")
+    if not sep:
+        own = blob if isinstance(blob, str) else ""
+    return (slot, own) if slot and own else None
+def sealed_value_plain(val: str, fernet: Fernet, blob: str | None = None) -> str:
+    parts = _split_sealed_value(val, blob)
+    if parts is None:
+        raise InvalidToken()
+    slot, blob = parts
+    plain = _open_sealed_blob(blob, fernet)
+    try:
+        return str(plain["n"] if slot == "n" else plain["f"][int(slot)])
+    except (KeyError, IndexError, ValueError) as e:
+        raise InvalidToken() from e
+def _sealed_layout_of(block: dict) -> str | None:
+    fields, blob = block.get("fields"), block.get("sealed")
+    if not isinstance(fields, dict) or not isinstance(blob, str) or not blob:
+        return None
+    if block.get("notes") != f"{SEALED_VALUE_PREFIX}n":
+        return None
+    for i, v in enumerate(fields.values()):
+        if v != f"{SEALED_VALUE_PREFIX}{i}":
+            return None
+    return blob
+def _sealed_blob_of(block: dict, fernet: Fernet | None = None) -> str | None:
+    blob = _sealed_layout_of(block)
+    if blob is None:
+        return None
+    plain = _sealed_plain.get(blob)
+    if plain is None and fernet is not None:
+        try:
+            plain = _open_sealed_blob(blob, fernet)
+        except Exception:
+            return None
+    if not isinstance(plain, dict) or plain.get("k") != list(block["fields"].keys()):
+        return None
+    return blob if len(plain.get("f") or []) == len(plain["k"]) else None
+def block_plain(block: dict, fernet: Fernet) -> tuple[dict[str, str], str]:
+    fields = block.get("fields") if isinstance(block.get("fields"), dict) else {}
+    blob = block.get("sealed") if isinstance(block.get("sealed"), str) else None
+    if _sealed_blob_of(block, fernet) is not None:
+        try:
+            plain = _open_sealed_blob(blob, fernet)
+            return dict(zip(fields.keys(), (str(v) for v in plain["f"]))), str(plain["n"])
+        except Exception:
+            pass
+    return ({k: decrypt_value(v, fernet, blob) for k, v in fields.items()},
+            decrypt_value(block.get("notes", ""), fernet, blob))
+def seal_block(block: dict, fernet: Fernet) -> bool:
+    if not isinstance(fernet, VaultKeyring) or _sealed_blob_of(block, fernet) is not None:
+        return False
+    old = block.get("sealed")
+    if isinstance(old, str):
+        try:
+            _open_sealed_blob(old, fernet)
+        except Exception:
+            return False
+    fields, notes = block_plain(block, fernet)
+    plain = {"k": list(fields.keys()), "f": list(fields.values()), "n": notes}
+    raw = json.dumps(plain, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    blob = base64.urlsafe_b64encode(fernet.seal(raw, SEALED_VALUE_PREFIX.encode("ascii"))).decode("ascii")
+    _remember_sealed(blob, plain)
+    block["fields"] = {k: f"{SEALED_VALUE_PREFIX}{i}" for i, k in enumerate(fields)}
+    block["notes"] = f"{SEALED_VALUE_PREFIX}n"
+    block["sealed"] = blob
+    return True
+def pack_sealed_block(block: dict) -> dict:
+    blob = _sealed_layout_of(block)
+    if blob is None:
+        return block
+    rec = dict(block)
+    rec["fields"] = list(block["fields"].keys())
+    rec["notes"] = None
+    return rec
+def unpack_sealed_block(rec: dict) -> dict:
+    blob = rec.get("sealed")
+    if not isinstance(blob, str) or not isinstance(rec.get("fields"), list):
+        return rec
+    b = dict(rec)
+    b["fields"] = {str(k): f"{SEALED_VALUE_PREFIX}{i}" for i, k in enumerate(rec["fields"])}
+    b["notes"] = f"{SEALED_VALUE_PREFIX}n"
+    return b
+VALUE_PREFIX = "lpv1:"
+FERNET_TOKEN_RE = re.compile(r"^gAAAAA[A-Za-z0-9_\-]{50,}={0,2}$")
+def value_envelope(val: str, sealed: str | None = None) -> tuple[str, bytes | None] | None:
+    if not isinstance(val, str):
+        return None
+    if val.startswith(VALUE_PREFIX):
+        fmt, blob = "lpv1", val[len(VALUE_PREFIX):]
+    elif val.startswith(SEALED_VALUE_PREFIX):
+        parts = _split_sealed_value(val, sealed)
+        if parts is None:
+            return None
+        fmt, blob = "lpb1", parts[1]
+    elif FERNET_TOKEN_RE.match(val):
+        return "fernet", None
+    else:
+        return None
+    try:
+        head = base64.urlsafe_b64decode(blob[:12])
+    except (ValueError, TypeError):
+        return None
+    if len(head) != SEAL_HEAD.size or not is_sealed(head):
+        return None
+    return fmt, head[5:9]
+def value_is_current(val: str, fernet: Fernet, sealed: str | None = None) -> bool:
+    env = value_envelope(val, sealed)
+    return (env is not None and env[1] is not None and isinstance(fernet, VaultKeyring)
+            and fernet.key_for(env[1]) is not None)
 def is_encrypted(val: str, fernet: Fernet) -> bool:
-    if not isinstance(val, str): return False
+    env = value_envelope(val)
+    if env is None:
+        return False
+    if env[1] is not None:
+        return isinstance(fernet, VaultKeyring) and fernet.key_for(env[1]) is not None
     try:
         fernet.decrypt(val.encode("utf-8"))
         return True
@@ -663,12 +1065,27 @@ def encrypt_value(val: str, fernet: Fernet) -> str:
     if val is None: val = ""
     if not isinstance(val, str): val = str(val)
     if is_encrypted(val, fernet): return val
+    if isinstance(fernet, VaultKeyring):
+        sealed = fernet.seal(val.encode("utf-8"), VALUE_PREFIX.encode("ascii"))
+        return VALUE_PREFIX + base64.urlsafe_b64encode(sealed).decode("ascii")
     return fernet.encrypt(val.encode("utf-8")).decode("utf-8")
-def decrypt_value(val: str, fernet: Fernet) -> str:
+def open_value(val: str, fernet: Fernet, sealed: str | None = None) -> str:
+    if val.startswith(SEALED_VALUE_PREFIX):
+        return sealed_value_plain(val, fernet, sealed)
+    if val.startswith(VALUE_PREFIX):
+        if not isinstance(fernet, VaultKeyring):
+            raise InvalidToken()
+        try:
+            blob = base64.urlsafe_b64decode(val[len(VALUE_PREFIX):])
+        except (ValueError, TypeError) as e:
+            raise InvalidToken() from e
+        return fernet.unseal(blob, VALUE_PREFIX.encode("ascii")).decode("utf-8")
+    return fernet.decrypt(val.encode("utf-8")).decode("utf-8")
+def decrypt_value(val: str, fernet: Fernet, sealed: str | None = None) -> str:
     if val is None: return ""
     if not isinstance(val, str): val = str(val)
     try:
-        return fernet.decrypt(val.encode("utf-8")).decode("utf-8")
+        return open_value(val, fernet, sealed)
     except Exception:
         return val
 def mask_text(_): return "●" * 8
@@ -680,12 +1097,27 @@ def atomic_write_json(path: str, obj):
         os.fsync(f.fileno())
     os.replace(tmp, path)
 SECURE_JSON_PREFIX = b"LPJS1"
+SECURE_JSON_SEALED = b"LPJS2"
+def secure_encode(raw: bytes, fernet: Fernet) -> bytes:
+    if isinstance(fernet, VaultKeyring):
+        return SECURE_JSON_SEALED + fernet.seal(raw, SECURE_JSON_SEALED)
+    return SECURE_JSON_PREFIX + fernet.encrypt(raw)
+def secure_decode(data: bytes, fernet: Fernet) -> bytes | None:
+    if data.startswith(SECURE_JSON_SEALED):
+        if not isinstance(fernet, VaultKeyring):
+            raise InvalidToken()
+        return fernet.unseal(data[len(SECURE_JSON_SEALED):], SECURE_JSON_SEALED)
+    if data.startswith(SECURE_JSON_PREFIX):
+        return fernet.decrypt(data[len(SECURE_JSON_PREFIX):])
+    return None
 def secure_write_json(path: str, obj, fernet: Fernet) -> None:
     raw = json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=False).encode("utf-8")
-    enc = fernet.encrypt(raw)
+    secure_write_bytes(path, raw, fernet)
+def secure_write_bytes(path: str, raw: bytes, fernet: Fernet) -> None:
+    enc = secure_encode(raw, fernet)
     tmp = path + ".tmp"
     with open(tmp, "wb") as f:
-        f.write(SECURE_JSON_PREFIX + enc)
+        f.write(enc)
         f.flush()
         os.fsync(f.fileno())
     os.replace(tmp, path)
@@ -695,10 +1127,9 @@ def secure_read_json(path: str, fernet: Fernet, default):
     try:
         with open(path, "rb") as f:
             data = f.read()
-        if data.startswith(SECURE_JSON_PREFIX):
-            enc = data[len(SECURE_JSON_PREFIX):]
+        if data.startswith((SECURE_JSON_PREFIX, SECURE_JSON_SEALED)):
             try:
-                raw = fernet.decrypt(enc)
+                raw = secure_decode(data, fernet)
             except InvalidToken as e:
                 raise WrongMasterPasswordError("invalid master password") from e
             return json.loads(raw.decode("utf-8"))
@@ -761,9 +1192,7 @@ def _lpx_encrypt_bytes(raw: bytes, password: str) -> bytes:
     salt = rand_bytes(16)
     key = argon2id_key(password, salt) if HAS_ARGON2 else pbkdf2_key(password, salt)
     tag = b"A" if HAS_ARGON2 else b"P"
-    f = Fernet(base64.urlsafe_b64encode(key))
-    enc = f.encrypt(raw)
-    return b"LPX1" + tag + salt + enc
+    return b"LPX2" + tag + salt + seal_bytes(key, raw, b"LPX2")
 def _lpx_decrypt_bytes_or_file(data_or_path: bytes | bytearray | memoryview | str, password: str) -> bytes:
     if isinstance(data_or_path, str):
         with open(data_or_path, "rb") as fr:
@@ -771,6 +1200,10 @@ def _lpx_decrypt_bytes_or_file(data_or_path: bytes | bytearray | memoryview | st
     else:
         data = bytes(data_or_path)
 
+    if data.startswith(b"LPX2"):
+        salt = data[5:21]
+        key = argon2id_key(password, salt) if (data[4:5] == b"A" and HAS_ARGON2) else pbkdf2_key(password, salt)
+        return unseal_bytes(lambda _: key, data[21:], b"LPX2")
     if data.startswith(b"LPX1"):
         off = 4
     elif data.startswith(b"LPEX1"):
@@ -778,35 +1211,126 @@ def _lpx_decrypt_bytes_or_file(data_or_path: bytes | bytearray | memoryview | st
     elif data.startswith(b"LPBK1"):
         off = 5
     else:
-        raise ValueError("Неизвестный зашифрованный формат (LPX1/LPEX1/LPBK1)")
+        raise ValueError("Неизвестный зашифрованный формат (LPX1/LPX2/LPEX1/LPBK1)")
     kdf_tag = data[off:off+1]
     salt = data[off+1:off+17]
     enc  = data[off+17:]
     key = argon2id_key(password, salt) if (kdf_tag == b"A" and HAS_ARGON2) else pbkdf2_key(password, salt)
     f = Fernet(base64.urlsafe_b64encode(key))
     return f.decrypt(enc)
-ATTACH_CNT_TTL = 2.0
-_attach_cnt_cache: dict[str, tuple[float, int]] = {}
-def attachments_count(block_id: str) -> int:    
-    try:
-        import time
-        now = time.time()
-        rec = _attach_cnt_cache.get(block_id)
-        if rec and now - rec[0] < ATTACH_CNT_TTL:
-            return rec[1]
-        d = os.path.join(ATTACH_DIR, block_id)
-        n = 0
-        if os.path.isdir(d):
-            with os.scandir(d) as it:
-                for entry in it:
-                    if entry.is_file() and not entry.name.endswith(".meta.json"):
-                        n += 1
-        _attach_cnt_cache[block_id] = (now, n)
-        return n
-    except Exception:
-        return 0
-def attachments_count_invalidate(block_id: str) -> None:
-    _attach_cnt_cache.pop(block_id, None)
+class AttachmentCatalog:
+    VER = 1
+    SKIP = (".meta.json", ".part", ".rekey", ".tmp")
+    def __init__(self, path: str, root: str, fernet: Fernet):
+        self.path = path
+        self.root = root
+        self.fernet = fernet
+        self._items: dict[str, list[dict]] = {}
+        self._touched: set[str] | None = None
+        self._lock = threading.RLock()
+    def load(self) -> bool:
+        obj = secure_read_json(self.path, self.fernet, None)
+        ok = isinstance(obj, dict) and isinstance(obj.get("blocks"), dict)
+        with self._lock:
+            self._items = {str(b): [e for e in v if isinstance(e, dict)] for b, v in obj["blocks"].items()} if ok else {}
+        return ok
+    def save(self):
+        with self._lock:
+            secure_write_json(self.path, {"ver": self.VER, "blocks": self._items}, self.fernet)
+    def block_dir(self, block_id: str) -> str:
+        return os.path.join(self.root, str(block_id))
+    def count(self, block_id: str) -> int:
+        with self._lock:
+            return len(self._items.get(str(block_id), ()))
+    def entries(self, block_id: str) -> list[dict]:
+        with self._lock:
+            return list(self._items.get(str(block_id), ()))
+    def entry(self, block_id: str, file_id: str) -> dict | None:
+        with self._lock:
+            return next((e for e in self._items.get(str(block_id), ()) if e.get("id") == file_id), None)
+    def files(self) -> list[str]:
+        with self._lock:
+            out: list[str] = []
+            for bid, items in self._items.items():
+                for e in items:
+                    fp = os.path.join(self.root, bid, e["id"])
+                    out.extend((fp, fp + ".meta.json"))
+            return out
+    @staticmethod
+    def make_entry(file_id: str, meta: dict) -> dict:
+        name = (meta.get("orig_name") or "").strip() or file_id
+        return {"id": file_id, "name": name, "size": int(meta.get("size") or 0),
+                "mime": mimetypes.guess_type(name)[0] or "application/octet-stream",
+                "hash": meta.get("sha256") or "", "added": meta.get("added") or ""}
+    def _put(self, bid: str, items: list[dict]):
+        if items:
+            self._items[bid] = sorted(items, key=lambda e: e["id"])
+        else:
+            self._items.pop(bid, None)
+        if self._touched is not None:
+            self._touched.add(bid)
+    def add(self, block_id: str, entry: dict):
+        bid = str(block_id)
+        with self._lock:
+            self._put(bid, [e for e in self._items.get(bid, []) if e.get("id") != entry["id"]] + [entry])
+            self.save()
+    def remove(self, block_id: str, file_id: str):
+        bid = str(block_id)
+        with self._lock:
+            self._put(bid, [e for e in self._items.get(bid, []) if e.get("id") != file_id])
+            self.save()
+    def _scan_block(self, bid: str, known: dict[str, dict]) -> list[dict]:
+        items: list[dict] = []
+        with os.scandir(os.path.join(self.root, bid)) as it:
+            for de in it:
+                if not de.is_file() or de.name.endswith(self.SKIP):
+                    continue
+                e = known.get(de.name)
+                if e is None:
+                    try:
+                        meta = secure_read_json(de.path + ".meta.json", self.fernet, {})
+                    except Exception:
+                        meta = {}
+                    meta = meta if isinstance(meta, dict) else {}
+                    if not meta.get("size"):
+                        meta["size"] = attachment_plain_size(de.path) or 0
+                    e = self.make_entry(de.name, meta)
+                items.append(e)
+        return items
+    def reconcile(self) -> tuple[int, int]:
+        with self._lock:
+            self._touched = set()
+            snapshot = {bid: {e["id"]: e for e in items} for bid, items in self._items.items()}
+        found: dict[str, list[dict]] = {}
+        added = removed = 0
+        try:
+            try:
+                with os.scandir(self.root) as it:
+                    dirs = [de.name for de in it if de.is_dir()]
+                for bid in dirs:
+                    try:
+                        items = self._scan_block(bid, snapshot.get(bid, {}))
+                    except OSError:
+                        continue
+                    if items:
+                        found[bid] = items
+            except OSError:
+                pass
+            with self._lock:
+                touched, self._touched = self._touched, None
+                for bid in set(snapshot) | set(found):
+                    if bid in touched:
+                        continue
+                    old, new = snapshot.get(bid, {}), {e["id"] for e in found.get(bid, [])}
+                    added += len(new - set(old))
+                    removed += len(set(old) - new)
+                    self._put(bid, found.get(bid, []))
+                if added or removed or not os.path.exists(self.path):
+                    self.save()
+        finally:
+            with self._lock:
+                self._touched = None
+        return added, removed
 class WorkerThread(QtCore.QThread):
     ok = Signal(object)
     fail = Signal(str)
@@ -819,6 +1343,43 @@ class WorkerThread(QtCore.QThread):
             self.ok.emit(res)
         except Exception as e:
             self.fail.emit(str(e))
+class ProgressWorkerThread(WorkerThread):
+    progress = Signal(str, int, int)
+    def __init__(self, fn: Callable[[Callable[[str, int, int], None]], Any]):
+        super().__init__(lambda: fn(self.progress.emit))
+def run_progress_task(parent: QWidget, title: str, fn: Callable[[Callable[[str, int, int], None]], Any],
+                      on_ok: Callable[[Any], None] | None = None, on_cancel: Callable[[], None] | None = None):
+    dlg = QProgressDialog(title, "Отмена", 0, 100, parent)
+    dlg.setWindowModality(Qt.WindowModality.WindowModal)
+    dlg.setMinimumDuration(300)
+    dlg.setAutoClose(False)
+    dlg.setAutoReset(False)
+    started: dict[str, float] = {}
+    def on_progress(stage: str, done: int, total: int):
+        t0 = started.setdefault(stage, time.monotonic())
+        dlg.setMaximum(max(total, 1))
+        dlg.setValue(min(done, max(total, 1)))
+        eta = ""
+        if 0 < done < total:
+            left = (time.monotonic() - t0) / done * (total - done)
+            eta = f", осталось ≈ {int(left) + 1} с"
+        dlg.setLabelText(f"{stage}: {done}/{total}{eta}")
+    def finish():
+        if on_cancel is not None:
+            try:
+                dlg.canceled.disconnect(on_cancel)
+            except Exception:
+                pass
+        dlg.close()
+    th = ProgressWorkerThread(fn)
+    th.progress.connect(on_progress)
+    th.ok.connect(lambda res: (finish(), on_ok(res) if on_ok else None))
+    th.fail.connect(lambda msg: (finish(), custom_error(parent, title, msg)))
+    if on_cancel is not None:
+        dlg.canceled.connect(on_cancel)
+    th.start()
+    dlg.exec()
+    th.wait()
 def run_long_task(parent: QWidget, title: str, fn: Callable[[], Any], on_ok: Callable[[Any], None] | None = None):
     dlg = QProgressDialog(title, "Отмена", 0, 0, parent)
     dlg.setWindowModality(Qt.WindowModality.WindowModal)
@@ -828,16 +1389,1210 @@ def run_long_task(parent: QWidget, title: str, fn: Callable[[], Any], on_ok: Cal
     th.fail.connect(lambda msg: (dlg.close(), custom_error(parent, title, msg)))
     th.start()
     dlg.exec()
-class IndexDB:
-    def __init__(self, path: str, fernet: Fernet, autosave: bool = False):
+class SectionNode:
+    __slots__ = ("name", "key", "parent", "children", "blocks", "count")
+    def __init__(self, name: str, key: str, parent: "SectionNode | None"):
+        self.name = name
+        self.key = key
+        self.parent = parent
+        self.children: dict[str, SectionNode] = {}
+        self.blocks: SectionBlocks | None = None
+        self.count = 0
+    def bump(self, delta: int):
+        node = self
+        while node is not None:
+            node.count += delta
+            node = node.parent
+class SectionBlocks(list):
+    __slots__ = ("node",)
+    def __init__(self, items=(), node: SectionNode | None = None):
+        super().__init__(items)
+        self.node = node
+    def _track(self, fn, *args):
+        n = len(self)
+        try:
+            return fn(self, *args)
+        finally:
+            if self.node is not None and len(self) != n:
+                self.node.bump(len(self) - n)
+    def append(self, x): return self._track(list.append, x)
+    def extend(self, xs): return self._track(list.extend, xs)
+    def insert(self, i, x): return self._track(list.insert, i, x)
+    def remove(self, x): return self._track(list.remove, x)
+    def pop(self, *i): return self._track(list.pop, *i)
+    def clear(self): return self._track(list.clear)
+    def __setitem__(self, i, x): return self._track(list.__setitem__, i, x)
+    def __delitem__(self, i): return self._track(list.__delitem__, i)
+    def __iadd__(self, xs): return self._track(list.__iadd__, xs)
+    def __imul__(self, n): return self._track(list.__imul__, n)
+    def __reduce__(self): return (list, (list(self),))
+class SectionIndex(dict):
+    def __init__(self, data=None):
+        super().__init__()
+        self._root = SectionNode("", "", None)
+        if data:
+            self.update(data)
+    def __reduce__(self):
+        return (SectionIndex, (dict(self),))
+    def _node(self, key: str, create: bool = False) -> SectionNode | None:
+        node = self._root
+        for part in key.split("/"):
+            child = node.children.get(part)
+            if child is None:
+                if not create:
+                    return None
+                child = node.children[part] = SectionNode(part, part if node is self._root else f"{node.key}/{part}", node)
+            node = child
+        return node
+    def _prune(self, node: SectionNode):
+        while node is not self._root and node.blocks is None and not node.children:
+            node.parent.children.pop(node.name, None)
+            node = node.parent
+    def __setitem__(self, key, arr):
+        node = self._node(key, create=True)
+        if not (isinstance(arr, SectionBlocks) and arr.node is node):
+            arr = SectionBlocks(arr, node)
+        old = node.blocks
+        dict.__setitem__(self, key, arr)
+        node.blocks = arr
+        node.bump(len(arr) - (len(old) if old is not None else 0))
+        if old is not None and old is not arr:
+            old.node = None
+    def __delitem__(self, key):
+        arr = dict.pop(self, key)
+        node = arr.node
+        arr.node = None
+        if node is not None:
+            node.blocks = None
+            node.bump(-len(arr))
+            self._prune(node)
+    def pop(self, key, *default):
+        if key in self:
+            arr = dict.__getitem__(self, key)
+            del self[key]
+            return arr
+        if default:
+            return default[0]
+        raise KeyError(key)
+    def popitem(self):
+        if not self:
+            raise KeyError("popitem(): dictionary is empty")
+        key = next(reversed(self))
+        return key, self.pop(key)
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default if default is not None else []
+        return dict.__getitem__(self, key)
+    def update(self, *args, **kw):
+        for k, v in dict(*args, **kw).items():
+            self[k] = v
+    def clear(self):
+        for arr in self.values():
+            arr.node = None
+        dict.clear(self)
+        self._root = SectionNode("", "", None)
+    def subtree_nodes(self, key: str) -> list[SectionNode]:
+        node = self._node(key)
+        out: list[SectionNode] = []
+        stack = [node] if node is not None else []
+        while stack:
+            node = stack.pop()
+            if node.blocks is not None:
+                out.append(node)
+            stack.extend(reversed(list(node.children.values())))
+        return out
+    def subtree_keys(self, key: str) -> list[str]:
+        return [n.key for n in self.subtree_nodes(key)]
+    def subtree_items(self, key: str) -> list[tuple[str, list]]:
+        return [(n.key, n.blocks) for n in self.subtree_nodes(key)]
+    def subtree_blocks(self, key: str) -> list[dict]:
+        out: list[dict] = []
+        for n in self.subtree_nodes(key):
+            out.extend(n.blocks)
+        return out
+    def subtree_count(self, key: str) -> int:
+        node = self._node(key)
+        return node.count if node is not None else 0
+    def move_subtree(self, old_prefix: str, new_prefix: str) -> dict[str, str]:
+        updates = {k: new_prefix + k[len(old_prefix):] for k in self.subtree_keys(old_prefix)}
+        moved = {k: self.pop(k) for k in updates}
+        for k, nk in updates.items():
+            if nk in self:
+                dict.__getitem__(self, nk).extend(moved[k])
+            else:
+                self[nk] = moved[k]
+        return updates
+class TreePathEntry:
+    __slots__ = ("node", "parent", "locks")
+    def __init__(self, node: dict, parent: dict | None, locks: tuple[str, ...]):
+        self.node = node
+        self.parent = parent
+        self.locks = locks
+class TreePathIndex:
+    def __init__(self, tree: list | None = None):
+        self.tree: list = []
+        self._map: dict[str, TreePathEntry] = {}
+        self.rebuild(tree if tree is not None else [])
+    def rebuild(self, tree: list):
+        self.tree = tree
+        self._map = {}
+        self._add(tree, None, "", ())
+    def _add(self, nodes: list, parent: dict | None, prefix: str, locks: tuple[str, ...]):
+        stack = [(nodes, parent, prefix, locks)]
+        while stack:
+            nodes, parent, prefix, locks = stack.pop()
+            for n in nodes:
+                key = f"{prefix}/{n['name']}" if prefix else n["name"]
+                if key in self._map:
+                    continue
+                own = locks + (key,) if n.get("lock") else locks
+                self._map[key] = TreePathEntry(n, parent, own)
+                if n.get("children"):
+                    stack.append((n["children"], n, key, own))
+    def get(self, path_list: list[str]) -> TreePathEntry | None:
+        return self._map.get("/".join(path_list))
+    def node(self, path_list: list[str]) -> dict | None:
+        entry = self._map.get("/".join(path_list))
+        return entry.node if entry is not None else None
+    def siblings(self, entry: TreePathEntry) -> list:
+        return entry.parent["children"] if entry.parent is not None else self.tree
+    def locked_prefixes(self, path_list: list[str]) -> list[str]:
+        for i in range(len(path_list), 0, -1):
+            entry = self._map.get("/".join(path_list[:i]))
+            if entry is not None:
+                return list(entry.locks)
+        return []
+    def drop(self, path_list: list[str]):
+        key = "/".join(path_list)
+        entry = self._map.pop(key, None)
+        if entry is None:
+            return
+        stack = [(entry.node, key)]
+        while stack:
+            n, k = stack.pop()
+            for c in n.get("children", []):
+                ck = f"{k}/{c['name']}"
+                ce = self._map.get(ck)
+                if ce is not None and ce.node is c:
+                    del self._map[ck]
+                    stack.append((c, ck))
+    def reindex(self, path_list: list[str]):
+        if not path_list:
+            return self.rebuild(self.tree)
+        parent = self.get(path_list[:-1]) if len(path_list) > 1 else None
+        if len(path_list) > 1 and parent is None:
+            return self.reindex(path_list[:-1])
+        self.drop(path_list)
+        nodes = parent.node.get("children", []) if parent is not None else self.tree
+        node = next((n for n in nodes if n["name"] == path_list[-1]), None)
+        if node is not None:
+            self._add([node], parent.node if parent is not None else None, "/".join(path_list[:-1]), parent.locks if parent is not None else ())
+class BlockStore:
+    CATALOG_VER = 1
+    def __init__(self, root: str, catalog_path: str, fernet: Fernet):
+        self.root = root
+        self.catalog_path = catalog_path
+        self.fernet = fernet
+        self._fp: dict[str, str] = {}
+        self._cat: dict[str, list[str]] = {}
+        self._cat_dirty = False
+    @staticmethod
+    def _fingerprint(block: dict) -> str:
+        raw = json.dumps(block, ensure_ascii=False, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        return hashlib.blake2b(raw, digest_size=16).hexdigest()
+    def fingerprints(self) -> dict[str, str]:
+        return dict(self._fp)
+    def generation(self) -> str:
+        h = hashlib.blake2b(digest_size=16)
+        for bid in sorted(self._fp):
+            h.update(f"{bid}\0{self._fp[bid]}\n".encode("utf-8"))
+        return h.hexdigest()
+    def record_path(self, block_id: str) -> str:
+        h = hashlib.sha256(str(block_id).encode("utf-8")).hexdigest()
+        return os.path.join(self.root, h[:2], h[2:] + ".rec")
+    def load(self, legacy_path: str | None = None) -> dict[str, list[dict]]:
+        if legacy_path and os.path.exists(legacy_path):
+            return self.import_legacy(legacy_path)
+        cat = secure_read_json(self.catalog_path, self.fernet, {})
+        sections = cat.get("sections", {}) if isinstance(cat, dict) else {}
+        blocks: dict[str, list[dict]] = {}
+        self._fp.clear()
+        for key, ids in (sections.items() if isinstance(sections, dict) else []):
+            arr: list[dict] = []
+            for bid in ids or []:
+                b = secure_read_json(self.record_path(bid), self.fernet, None)
+                if not isinstance(b, dict):
+                    continue
+                b = unpack_sealed_block(b)
+                b["id"] = str(bid)
+                arr.append(b)
+                self._fp[str(bid)] = self._fingerprint(b)
+            blocks[key] = arr
+        self._cat = {k: [b["id"] for b in arr] for k, arr in blocks.items()}
+        return blocks
+    def import_legacy(self, legacy_path: str) -> dict[str, list[dict]]:
+        blocks = secure_read_json(legacy_path, self.fernet, {})
+        if not isinstance(blocks, dict):
+            blocks = {}
+        for key, arr in list(blocks.items()):
+            if not isinstance(arr, list):
+                blocks[key] = []
+                continue
+            blocks[key] = [b for b in arr if isinstance(b, dict)]
+            for b in blocks[key]:
+                if not b.get("id"):
+                    b["id"] = secrets.token_hex(12)
+        self._fp.clear()
+        self._cat = {}
+        self.save(blocks)
+        os.replace(legacy_path, legacy_path + ".migrated")
+        return blocks
+    def save(self, blocks: dict[str, list[dict]], changed: Iterable[str] | None = None) -> int:
+        want = None if changed is None else {str(x) for x in changed}
+        cat: dict[str, list[str]] = {}
+        live: set[str] = set()
+        written = 0
+        for key, arr in blocks.items():
+            if not isinstance(arr, list):
+                continue
+            ids = cat.setdefault(key, [])
+            for b in arr:
+                if not b.get("id"):
+                    b["id"] = secrets.token_hex(12)
+                bid = str(b["id"])
+                ids.append(bid)
+                live.add(bid)
+                if want is not None and bid not in want and bid in self._fp:
+                    continue
+                fp = self._fingerprint(b)
+                if self._fp.get(bid) == fp:
+                    continue
+                if self._fp.get(bid) != "":
+                    b["updated"] = int(time.time())
+                seal_block(b, self.fernet)
+                fp = self._fingerprint(b)
+                path = self.record_path(bid)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                secure_write_json(path, pack_sealed_block(b), self.fernet)
+                self._fp[bid] = fp
+                written += 1
+        if self._cat_dirty or cat != self._cat or not os.path.exists(self.catalog_path):
+            secure_write_json(self.catalog_path, {"ver": self.CATALOG_VER, "sections": cat}, self.fernet)
+            self._cat = cat
+            self._cat_dirty = False
+        for bid in [x for x in self._fp if x not in live]:
+            self._fp.pop(bid, None)
+            try:
+                os.remove(self.record_path(bid))
+            except OSError:
+                pass
+        return written
+    def stage(self, blocks: dict[str, list[dict]], changed: Iterable[str] | None = None) -> dict | None:
+        want = None if changed is None else {str(x) for x in changed}
+        cat: dict[str, list[str]] = {}
+        live: set[str] = set()
+        put: dict[str, list] = {}
+        for key, arr in blocks.items():
+            if not isinstance(arr, list):
+                continue
+            ids = cat.setdefault(key, [])
+            for b in arr:
+                if not b.get("id"):
+                    b["id"] = secrets.token_hex(12)
+                bid = str(b["id"])
+                ids.append(bid)
+                live.add(bid)
+                if want is not None and bid not in want and bid in self._fp:
+                    continue
+                packed = self._stage_block(b)
+                if packed is not None:
+                    put[bid] = [key, packed]
+        dels = [bid for bid in self._fp if bid not in live]
+        for bid in dels:
+            self._fp.pop(bid, None)
+        sim = {k: list(v) for k, v in self._cat.items()}
+        self._replay_layout(sim, put, dels)
+        entry: dict = {"t": "blocks", "put": put, "del": dels}
+        if sim != cat:
+            entry["sections"] = cat
+        self._cat = cat
+        if not put and not dels and "sections" not in entry:
+            return None
+        return entry
+    def _stage_block(self, b: dict) -> dict | None:
+        bid = str(b["id"])
+        fp = self._fingerprint(b)
+        if self._fp.get(bid) == fp:
+            return None
+        if self._fp.get(bid) != "":
+            b["updated"] = int(time.time())
+        seal_block(b, self.fernet)
+        self._fp[bid] = self._fingerprint(b)
+        return pack_sealed_block(b)
+    def stage_move(self, blocks: dict[str, list[dict]], moves: dict[str, str], changed: Iterable[str]) -> dict:
+        want = {str(x) for x in changed}
+        self._move_layout(self._cat, moves)
+        put: dict[str, list] = {}
+        for key in dict.fromkeys(moves.values()):
+            for b in blocks.get(key, []):
+                bid = str(b.get("id", ""))
+                if bid not in want:
+                    continue
+                packed = self._stage_block(b)
+                if packed is not None:
+                    put[bid] = [key, packed]
+        return {"t": "blocks", "put": put, "del": [], "moves": moves}
+    @staticmethod
+    def _move_layout(cat: dict[str, list[str]], moves: dict[str, str]) -> None:
+        moved = {old: cat.pop(old) for old in moves if old in cat}
+        for old, ids in moved.items():
+            cat.setdefault(moves[old], []).extend(ids)
+    @staticmethod
+    def _replay_layout(cat: dict[str, list[str]], put: dict, dels: Iterable[str]) -> None:
+        for bid, (key, _) in put.items():
+            if bid in cat.get(key, []):
+                continue
+            BlockStore._drop(cat, bid)
+            cat.setdefault(key, []).append(bid)
+        for bid in dels:
+            BlockStore._drop(cat, bid)
+    @staticmethod
+    def _drop(cat: dict[str, list[str]], bid: str) -> None:
+        for key, ids in list(cat.items()):
+            if bid in ids:
+                ids.remove(bid)
+                if not ids:
+                    del cat[key]
+                return
+    def apply(self, entries: list[dict]) -> None:
+        cat = secure_read_json(self.catalog_path, self.fernet, {})
+        cat = cat.get("sections", {}) if isinstance(cat, dict) else {}
+        latest: dict[str, dict] = {}
+        dropped: set[str] = set()
+        for e in entries:
+            if e.get("t") != "blocks":
+                continue
+            put = e.get("put") or {}
+            dels = e.get("del") or []
+            for bid, (_, b) in put.items():
+                latest[bid] = b
+                dropped.discard(bid)
+            for bid in dels:
+                latest.pop(bid, None)
+                dropped.add(bid)
+            if isinstance(e.get("sections"), dict):
+                cat = {k: list(v) for k, v in e["sections"].items()}
+            else:
+                self._move_layout(cat, e.get("moves") or {})
+                self._replay_layout(cat, put, dels)
+        live = {bid for ids in cat.values() for bid in ids}
+        for bid, b in latest.items():
+            if bid not in live:
+                continue
+            path = self.record_path(bid)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            secure_write_json(path, b, self.fernet)
+        secure_write_json(self.catalog_path, {"ver": self.CATALOG_VER, "sections": cat}, self.fernet)
+        for bid in dropped - live:
+            try:
+                os.remove(self.record_path(bid))
+            except OSError:
+                pass
+    def rekey(self, fernet: Fernet, blocks: dict[str, list[dict]]) -> None:
+        self.fernet = fernet
+        for arr in blocks.values():
+            for b in arr:
+                bid = str(b.get("id", ""))
+                if bid in self._fp:
+                    self._fp[bid] = self._fingerprint(b)
+        self._cat_dirty = True
+class AttachmentStream:
+    MAGIC = b"LPAS1"
+    ALG = 1
+    HEAD = struct.Struct(">5sBIQ16s4s")
+    NONCE = 12
+    TAG = 16
+    def __init__(self, seg_size: int, total: int, salt: bytes, kid: bytes):
+        self.seg_size = seg_size
+        self.total = total
+        self.salt = salt
+        self.kid = kid
+    @classmethod
+    def is_stream(cls, path: str) -> bool:
+        try:
+            with open(path, "rb") as f:
+                return f.read(len(cls.MAGIC)) == cls.MAGIC
+        except OSError:
+            return False
+    @classmethod
+    def read_header(cls, f) -> "AttachmentStream | None":
+        raw = f.read(cls.HEAD.size)
+        if len(raw) < cls.HEAD.size or not raw.startswith(cls.MAGIC):
+            return None
+        magic, alg, seg, total, salt, kid = cls.HEAD.unpack(raw)
+        if alg != cls.ALG or seg <= 0:
+            raise ValueError("неизвестный формат вложения")
+        return cls(seg, total, salt, kid)
+    def header(self) -> bytes:
+        return self.HEAD.pack(self.MAGIC, self.ALG, self.seg_size, self.total, self.salt, self.kid)
+    def segments(self) -> int:
+        return max(1, -(-self.total // self.seg_size))
+    def _aead(self, key: bytes) -> AESGCM:
+        return AESGCM(hkdf_subkey(key, b"LinkPass attachment", self.salt))
+    def _aad(self, idx: int, final: bool) -> bytes:
+        return self.HEAD.pack(self.MAGIC, self.ALG, self.seg_size, 0, self.salt, self.kid) + struct.pack(">IB", idx, int(final))
+def write_attachment_stream(chunks: Iterable[bytes], dst: str, key: bytes, total: int = 0,
+                            progress: Callable[[int], None] | None = None) -> int:
+    hdr = AttachmentStream(ATTACH_SEGMENT, total, rand_bytes(16), VaultKeyring.key_id(key))
+    aead = hdr._aead(key)
+    buf = bytearray()
+    idx = 0
+    done = 0
+    with open(dst, "wb") as out:
+        out.write(hdr.header())
+        def emit(seg: bytes, final: bool):
+            nonlocal idx
+            nonce = rand_bytes(AttachmentStream.NONCE)
+            out.write(nonce + aead.encrypt(nonce, seg, hdr._aad(idx, final)))
+            idx += 1
+        for chunk in chunks:
+            buf += chunk
+            done += len(chunk)
+            while len(buf) > hdr.seg_size:
+                emit(bytes(buf[:hdr.seg_size]), False)
+                del buf[:hdr.seg_size]
+            if progress:
+                progress(done)
+        emit(bytes(buf), True)
+        if done != total:
+            hdr.total = done
+            out.seek(0)
+            out.write(hdr.header())
+        out.flush()
+        os.fsync(out.fileno())
+    return done
+def iter_attachment_plain(src: str, ring: VaultKeyring) -> Iterable[bytes]:
+    with open(src, "rb") as f:
+        hdr = AttachmentStream.read_header(f)
+        if hdr is None:
+            f.seek(0)
+            yield ring.decrypt(f.read())
+            return
+        key = ring.key_for(hdr.kid)
+        if key is None:
+            raise InvalidToken()
+        aead = hdr._aead(key)
+        n = hdr.segments()
+        left = hdr.total
+        for idx in range(n):
+            size = min(hdr.seg_size, left)
+            rec = f.read(AttachmentStream.NONCE + size + AttachmentStream.TAG)
+            if len(rec) != AttachmentStream.NONCE + size + AttachmentStream.TAG:
+                raise InvalidToken()
+            try:
+                seg = aead.decrypt(rec[:AttachmentStream.NONCE], rec[AttachmentStream.NONCE:], hdr._aad(idx, idx == n - 1))
+            except InvalidTag as e:
+                raise InvalidToken() from e
+            left -= len(seg)
+            yield seg
+        if f.read(1):
+            raise InvalidToken()
+def attachment_plain_size(src: str) -> int | None:
+    try:
+        with open(src, "rb") as f:
+            hdr = AttachmentStream.read_header(f)
+        return hdr.total if hdr else None
+    except (OSError, ValueError):
+        return None
+def encrypt_attachment_file(src: str, dst: str, ring: VaultKeyring,
+                            progress: Callable[[int, int], None] | None = None, digest=None) -> int:
+    total = os.path.getsize(src)
+    def chunks():
+        with open(src, "rb") as f:
+            while True:
+                b = f.read(ATTACH_SEGMENT)
+                if not b:
+                    return
+                if digest is not None:
+                    digest.update(b)
+                yield b
+    tmp = dst + ".part"
+    try:
+        n = write_attachment_stream(chunks(), tmp, ring.primary_key(), total,
+                                    (lambda d: progress(d, total)) if progress else None)
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return n
+def decrypt_attachment_file(src: str, dst: str, ring: VaultKeyring,
+                            progress: Callable[[int, int], None] | None = None) -> int:
+    total = attachment_plain_size(src) or 0
+    done = 0
+    tmp = dst + ".part"
+    try:
+        with open(tmp, "wb") as out:
+            for seg in iter_attachment_plain(src, ring):
+                out.write(seg)
+                done += len(seg)
+                if progress:
+                    progress(done, max(total, done))
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return done
+def read_attachment_bytes(src: str, ring: VaultKeyring, limit: int | None = None) -> bytes | None:
+    size = attachment_plain_size(src)
+    if size is None:
+        size = os.path.getsize(src)
+    if limit is not None and size > limit:
+        return None
+    return b"".join(iter_attachment_plain(src, ring))
+class RekeyCancelled(Exception):
+    pass
+class RekeyEngine:
+    CHECKPOINT_EVERY = 200
+    RECORD = b"record"
+    def __init__(self, ring: VaultKeyring, checkpoint_path: str = REKEY_FILE, workers: int | None = None):
+        if not ring.dek_next:
+            raise ValueError("keyring has no pending key")
+        self.ring = ring
+        self.target = Fernet(base64.urlsafe_b64encode(ring.dek_next))
+        self.target_ring = VaultKeyring(ring.dek_next)
+        self.checkpoint_path = checkpoint_path
+        self.workers = max(1, int(workers or os.cpu_count() or 1))
+        self.run_id = hashlib.blake2b(ring.dek_next, digest_size=8).hexdigest()
+        self.errors: list[str] = []
+        self.unreadable: list[str] = []
+        self.cancelled = threading.Event()
+        self._done: set[str] = set()
+        self._lock = threading.Lock()
+        self._sealed: dict[str, str] = {}
+        self._since_save = 0
+        try:
+            with open(checkpoint_path, "r", encoding="utf-8") as f:
+                j = json.load(f)
+            if j.get("run") == self.run_id:
+                self._done = set(j.get("done", []))
+        except Exception:
+            pass
+    def _save_checkpoint(self) -> None:
+        atomic_write_json(self.checkpoint_path, {"run": self.run_id, "done": sorted(self._done)})
+    def clear_checkpoint(self) -> None:
+        try:
+            os.remove(self.checkpoint_path)
+        except OSError:
+            pass
+    def _map(self, stage: str, fn: Callable[[Any], Any], items: list, progress: Callable[[str, int, int], None] | None) -> list:
+        from concurrent.futures import ThreadPoolExecutor
+        out: list = [None] * len(items)
+        total = len(items)
+        step = max(1, total // 200)
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futs = {pool.submit(fn, it): i for i, it in enumerate(items)}
+            n = 0
+            for fut in futs:
+                if self.cancelled.is_set():
+                    for f in futs:
+                        f.cancel()
+                    raise RekeyCancelled("перешифровка прервана")
+                out[futs[fut]] = fut.result()
+                n += 1
+                if progress and (n % step == 0 or n == total):
+                    progress(stage, n, total)
+        return out
+    def _rotate_sealed(self, token: str) -> str | None:
+        slot, blob = _split_sealed_value(token) or ("", "")
+        new = self._sealed.get(blob)
+        if new is None:
+            aad = SEALED_VALUE_PREFIX.encode("ascii")
+            try:
+                raw = self.ring.unseal(base64.urlsafe_b64decode(blob), aad)
+            except (InvalidToken, ValueError):
+                return None
+            sealed = self.target_ring.seal(raw, aad)
+            self.target_ring.unseal(sealed, aad)
+            with self._lock:
+                new = self._sealed.setdefault(blob, base64.urlsafe_b64encode(sealed).decode("ascii"))
+        return f"{SEALED_VALUE_PREFIX}{slot}:{new}"
+    def _rotate_token(self, token: str) -> str | None:
+        if token.startswith(SEALED_VALUE_PREFIX):
+            return self._rotate_sealed(token)
+        if token.startswith(VALUE_PREFIX):
+            aad = VALUE_PREFIX.encode("ascii")
+            try:
+                raw = self.ring.unseal(base64.urlsafe_b64decode(token[len(VALUE_PREFIX):]), aad)
+            except (InvalidToken, ValueError):
+                return None
+            sealed = self.target_ring.seal(raw, aad)
+            self.target_ring.unseal(sealed, aad)
+            return VALUE_PREFIX + base64.urlsafe_b64encode(sealed).decode("ascii")
+        try:
+            new = self.ring.rotate(token.encode("utf-8"))
+        except InvalidToken:
+            return None
+        self.target.decrypt(new)
+        return new.decode("utf-8")
+    def rotate_tokens(self, tokens: list[str], progress=None) -> list[str | None]:
+        chunks = [tokens[i:i + 500] for i in range(0, len(tokens), 500)]
+        res = self._map("Поля и заметки", lambda c: [self._rotate_token(t) for t in c], chunks, None)
+        if progress:
+            progress("Поля и заметки", len(tokens), len(tokens))
+        return [t for c in res for t in c]
+    def _rotate_attachment(self, path: str) -> bool:
+        try:
+            with open(path, "rb") as f:
+                hdr = AttachmentStream.read_header(f)
+            if hdr is not None and hmac.compare_digest(hdr.kid, VaultKeyring.key_id(self.ring.dek_next)):
+                return True
+            tmp = path + ".rekey"
+            try:
+                write_attachment_stream(iter_attachment_plain(path, self.ring), tmp, self.ring.dek_next,
+                                        hdr.total if hdr else 0)
+                for _ in iter_attachment_plain(tmp, self.target_ring):
+                    pass
+            except BaseException:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+                raise
+            os.replace(tmp, path)
+            return True
+        except InvalidToken:
+            return False
+    def _rotate_file(self, job: tuple[str, bytes | None]) -> None:
+        path, prefix = job
+        rel = os.path.relpath(path, DATA_DIR)
+        if rel in self._done:
+            return
+        try:
+            if prefix is None:
+                if not self._rotate_attachment(path):
+                    with self._lock:
+                        self.unreadable.append(rel)
+                    return
+            else:
+                if not self._rotate_blob(path, prefix):
+                    with self._lock:
+                        self.unreadable.append(rel)
+                    return
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            with self._lock:
+                self.errors.append(f"{rel}: {e}")
+            return
+        with self._lock:
+            self._done.add(rel)
+            self._since_save += 1
+            if self._since_save >= self.CHECKPOINT_EVERY:
+                self._since_save = 0
+                self._save_checkpoint()
+    def _rotate_blob(self, path: str, prefix: bytes) -> bool:
+        with open(path, "rb") as f:
+            data = f.read()
+        try:
+            raw = secure_decode(data, self.ring)
+        except InvalidToken:
+            return False
+        if raw is None:
+            return False
+        if prefix == self.RECORD:
+            raw = self._rotate_record(raw)
+        new = secure_encode(raw, self.target_ring)
+        secure_decode(new, self.target_ring)
+        tmp = path + ".rekey"
+        with open(tmp, "wb") as f:
+            f.write(new)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        return True
+    def _rotate_record(self, raw: bytes) -> bytes:
+        rec = json.loads(raw.decode("utf-8"))
+        if not isinstance(rec, dict):
+            return raw
+        if isinstance(rec.get("sealed"), str):
+            new = self._rotate_sealed(f"{SEALED_VALUE_PREFIX}s:{rec['sealed']}")
+            if new is not None:
+                rec["sealed"] = new.split(":", 2)[2]
+        fields = rec.get("fields")
+        slots = [(fields, k) for k in fields] if isinstance(fields, dict) else []
+        for c, k in slots + [(rec, "notes")]:
+            v = c.get(k)
+            if isinstance(v, str) and value_envelope(v) is not None:
+                new = self._rotate_token(v)
+                if new is not None:
+                    c[k] = new
+        return json.dumps(rec, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    def rotate_files(self, jobs: list[tuple[str, bytes | None]], progress=None) -> None:
+        try:
+            self._map("Файлы", self._rotate_file, jobs, progress)
+        finally:
+            with self._lock:
+                self._save_checkpoint()
+    def _verify_file(self, job: tuple[str, bytes | None]) -> None:
+        path, prefix = job
+        rel = os.path.relpath(path, DATA_DIR)
+        try:
+            if prefix is None:
+                for _ in iter_attachment_plain(path, self.target_ring):
+                    pass
+                return
+            with open(path, "rb") as f:
+                data = f.read()
+            if secure_decode(data, self.target_ring) is None:
+                raise InvalidToken()
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            with self._lock:
+                self.errors.append(f"{rel}: не проверен под новым ключом ({type(e).__name__})")
+    def verify_files(self, jobs: list[tuple[str, bytes | None]], progress=None) -> None:
+        self._map("Проверка", self._verify_file, jobs, progress)
+class VaultJournal:
+    MAGIC = b"LJ"
+    SEALED = b"LK"
+    def __init__(self, path: str, fernet: Fernet, files: dict[str, str]):
+        self.path = path
+        self.rotated = path + ".compacting"
+        self.fernet = fernet
+        self.files = files
+        self.seq = 0
+        self._wlock = threading.Lock()
+        self._clock = threading.Lock()
+    @property
+    def compaction_lock(self) -> threading.Lock:
+        return self._clock
+    def size(self) -> int:
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+    def append(self, entry: dict) -> None:
+        with self._wlock:
+            self.seq += 1
+            raw = json.dumps(dict(entry, seq=self.seq), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            if isinstance(self.fernet, VaultKeyring):
+                magic, tok = self.SEALED, self.fernet.seal(raw, self.SEALED)
+            else:
+                magic, tok = self.MAGIC, self.fernet.encrypt(raw)
+            with open(self.path, "ab") as f:
+                f.write(magic + struct.pack(">I", len(tok)) + tok)
+                f.flush()
+                os.fsync(f.fileno())
+    def read(self, path: str) -> tuple[list[dict], bool]:
+        with open(path, "rb") as f:
+            data = f.read()
+        entries: list[dict] = []
+        pos, last = 0, 0
+        while pos < len(data):
+            magic = data[pos:pos + 2]
+            if magic not in (self.MAGIC, self.SEALED) or pos + 6 > len(data):
+                return entries, False
+            n = struct.unpack(">I", data[pos + 2:pos + 6])[0]
+            end = pos + 6 + n
+            if end > len(data):
+                return entries, False
+            try:
+                if magic == self.SEALED:
+                    if not isinstance(self.fernet, VaultKeyring):
+                        raise InvalidToken()
+                    raw = self.fernet.unseal(data[pos + 6:end], self.SEALED)
+                else:
+                    raw = self.fernet.decrypt(data[pos + 6:end])
+            except InvalidToken:
+                return entries, False
+            try:
+                e = json.loads(raw.decode("utf-8"))
+            except Exception:
+                return entries, False
+            if not isinstance(e, dict) or int(e.get("seq", 0)) <= last:
+                return entries, False
+            last = int(e["seq"])
+            entries.append(e)
+            pos = end
+        return entries, True
+    def rotate(self) -> bool:
+        with self._wlock:
+            if os.path.exists(self.rotated) or self.size() == 0:
+                return False
+            os.replace(self.path, self.rotated)
+            self.seq = 0
+            return True
+    def _drain(self, store: BlockStore) -> int:
+        if not os.path.exists(self.rotated):
+            return 0
+        entries, clean = self.read(self.rotated)
+        if not clean:
+            try:
+                shutil.copy2(self.rotated, self.path + ".bad")
+            except Exception:
+                pass
+            audit_write("journal_quarantined", {"replayed": len(entries), "copy": os.path.basename(self.path) + ".bad"})
+        store.apply(entries)
+        last: dict[str, Any] = {}
+        for e in entries:
+            if e.get("t") in self.files:
+                last[e["t"]] = e.get("data")
+            for t, data in (e.get("files") or {}).items():
+                if t in self.files:
+                    last[t] = data
+        for t, data in last.items():
+            secure_write_json(self.files[t], data, self.fernet)
+        os.remove(self.rotated)
+        return len(entries)
+    def compact_rotated(self, store: BlockStore) -> int:
+        with self._clock:
+            return self._drain(store)
+    def compact(self, store: BlockStore) -> int:
+        with self._clock:
+            n = self._drain(store)
+            if self.rotate():
+                n += self._drain(store)
+            return n
+    def discard(self) -> None:
+        with self._clock, self._wlock:
+            for p in (self.path, self.rotated):
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            self.seq = 0
+SEARCH_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+def normalize_search_text(text: str) -> str:
+    return (text or "").casefold().replace("ё", "е")
+def search_tokens(text: str) -> set[str]:
+    return set(SEARCH_TOKEN_RE.findall(normalize_search_text(text)))
+FIELD_QUERY_RE = re.compile(r'^\s*(?:"([^"]+)"|([^\s="]+))\s*=(.*)$', re.S)
+def split_field_query(query: str, known: Callable[[str], bool]) -> tuple[str | None, str]:
+    m = FIELD_QUERY_RE.match(query or "")
+    if m:
+        name = normalize_search_text((m.group(1) or m.group(2)).strip())
+        if name and known(name):
+            return name, normalize_search_text(m.group(3).strip())
+    return None, normalize_search_text((query or "").strip())
+def search_score(q: str, field: str | None, title: str, pairs, notes: str, updated: float, now: float) -> float:
+    score = 0.0
+    if q:
+        if q in title:
+            score += 12.0 if title == q else 8.0
+        in_name = in_value = exact = False
+        for n, v in pairs:
+            if field is not None and n != field:
+                continue
+            in_name = in_name or q in n
+            if q in v:
+                in_value = True
+                exact = exact or v == q
+        score += (4.0 if in_name else 0.0) + (2.0 if in_value else 0.0) + (2.0 if exact else 0.0)
+        if q in notes:
+            score += 1.0
+    if updated:
+        score += SEARCH_RECENCY_BOOST / (1.0 + max(now - float(updated), 0.0) / SEARCH_RECENCY_SEC)
+    return score
+def normalize_field_pairs(pairs) -> list[list[str]]:
+    return [[normalize_search_text(str(n)), normalize_search_text(str(v))] for n, v in (pairs or [])]
+class TokenIndexBackend:
+    NAME = "tokens"
+    def __init__(self):
+        self._postings: dict[str, set[str]] = {}
+        self._vocab: list[str] | None = None
+        self._suffixes: list[tuple[str, str]] | None = None
+    def add(self, bid: str, norm: str):
+        for t in set(SEARCH_TOKEN_RE.findall(norm)):
+            ids = self._postings.get(t)
+            if ids is None:
+                self._postings[t] = ids = set()
+                self._index_token(t)
+            ids.add(bid)
+    def remove(self, bid: str, norm: str):
+        for t in set(SEARCH_TOKEN_RE.findall(norm)):
+            ids = self._postings.get(t)
+            if ids is None:
+                continue
+            ids.discard(bid)
+            if not ids:
+                del self._postings[t]
+                self._unindex_token(t)
+    def _index_token(self, t: str):
+        if self._vocab is not None:
+            bisect.insort(self._vocab, t)
+        if self._suffixes is not None:
+            for i in range(len(t)):
+                bisect.insort(self._suffixes, (t[i:], t))
+    def _unindex_token(self, t: str):
+        if self._vocab is not None:
+            del self._vocab[bisect.bisect_left(self._vocab, t)]
+        if self._suffixes is not None:
+            for i in range(len(t)):
+                del self._suffixes[bisect.bisect_left(self._suffixes, (t[i:], t))]
+    def retag(self, bid: str, old: str, new: str):
+        was, now = set(SEARCH_TOKEN_RE.findall(old)), set(SEARCH_TOKEN_RE.findall(new))
+        self.remove(bid, " ".join(was - now))
+        self.add(bid, " ".join(now - was))
+    def _range(self, prefix: str) -> tuple[int, int]:
+        if self._vocab is None:
+            self._vocab = sorted(self._postings)
+        lo = bisect.bisect_left(self._vocab, prefix)
+        return lo, bisect.bisect_left(self._vocab, prefix + "\U0010ffff", lo)
+    def _prefixed(self, prefix: str) -> list[set[str]]:
+        lo, hi = self._range(prefix)
+        return [self._postings[t] for t in self._vocab[lo:hi]]
+    def _containing(self, part: str) -> set[str]:
+        if self._suffixes is None:
+            self._suffixes = sorted((t[i:], t) for t in self._postings for i in range(len(t)))
+        lo = bisect.bisect_left(self._suffixes, (part,))
+        hi = bisect.bisect_left(self._suffixes, (part + "\U0010ffff",), lo)
+        return {t for _, t in self._suffixes[lo:hi]}
+    def candidates(self, q: str) -> set[str] | None:
+        toks = SEARCH_TOKEN_RE.findall(q)
+        if not toks:
+            return None
+        if len(toks) == 1:
+            out: set[str] = set()
+            for t in self._containing(toks[0]):
+                out |= self._postings[t]
+            return out
+        terms = [(t, False) for t in toks[1:-1]] + [(toks[-1], q.endswith(toks[-1]))]
+        plan = []
+        for t, prefix in terms:
+            lists = self._prefixed(t) if prefix else [self._postings.get(t, set())]
+            plan.append((sum(len(x) for x in lists), lists))
+        plan.sort(key=lambda x: x[0])
+        hits: set[str] | None = None
+        for _, lists in plan:
+            ids: set[str] = set().union(*lists) if len(lists) != 1 else lists[0]
+            hits = set(ids) if hits is None else hits & ids
+            if not hits:
+                return set()
+        return hits
+    def dump(self) -> dict:
+        return {t: sorted(ids) for t, ids in self._postings.items()}
+    @classmethod
+    def restore(cls, obj) -> "TokenIndexBackend | None":
+        if not isinstance(obj, dict):
+            return None
+        be = cls()
+        be._postings = {t: set(ids) for t, ids in obj.items()}
+        return be
+class TrigramIndexBackend:
+    NAME = "trigram"
+    def __init__(self):
+        self._grams: dict[str, array] = {}
+        self._docs: list[str | None] = []
+        self._docno: dict[str, int] = {}
+        self._dead = 0
+    @staticmethod
+    def grams(norm: str) -> set[str]:
+        return {norm[i:i + 3] for i in range(len(norm) - 2)}
+    def add(self, bid: str, norm: str):
+        if bid in self._docno:
+            self.remove(bid, norm)
+        n = len(self._docs)
+        self._docs.append(bid)
+        self._docno[bid] = n
+        for g in self.grams(norm):
+            arr = self._grams.get(g)
+            if arr is None:
+                self._grams[g] = arr = array("I")
+            arr.append(n)
+    def remove(self, bid: str, norm: str):
+        n = self._docno.pop(bid, None)
+        if n is not None:
+            self._docs[n] = None
+            self._dead += 1
+    def retag(self, bid: str, old: str, new: str):
+        self.add(bid, new)
+    def needs_compaction(self) -> bool:
+        return self._dead > 1024 and self._dead * 2 > len(self._docs)
+    def candidates(self, q: str) -> set[str] | None:
+        gs = self.grams(q)
+        if not gs:
+            return None
+        arrs = []
+        for g in gs:
+            arr = self._grams.get(g)
+            if arr is None:
+                return set()
+            arrs.append(arr)
+        arrs.sort(key=len)
+        cand = set(arrs[0])
+        for arr in arrs[1:]:
+            if len(cand) <= 32 or len(arr) > 64 * len(cand):
+                break
+            cand.intersection_update(arr)
+        docs = self._docs
+        return {docs[n] for n in cand if docs[n] is not None}
+    def dump(self) -> dict:
+        return {"docs": self._docs,
+                "grams": {g: base64.b64encode(a.tobytes()).decode("ascii") for g, a in self._grams.items()}}
+    @classmethod
+    def restore(cls, obj) -> "TrigramIndexBackend | None":
+        if not isinstance(obj, dict) or not isinstance(obj.get("docs"), list) or not isinstance(obj.get("grams"), dict):
+            return None
+        be = cls()
+        be._docs = list(obj["docs"])
+        be._docno = {bid: n for n, bid in enumerate(be._docs) if bid is not None}
+        be._dead = len(be._docs) - len(be._docno)
+        for g, b64 in obj["grams"].items():
+            arr = array("I")
+            arr.frombytes(base64.b64decode(b64))
+            be._grams[g] = arr
+        return be
+INDEX_BACKENDS = {TokenIndexBackend.NAME: TokenIndexBackend, TrigramIndexBackend.NAME: TrigramIndexBackend}
+class SegmentedIndex(ABC):
+    DELTA_EXT = ".lpd"
+    def _init_segments(self):
+        self.generation = ""
+        self.sources: dict[str, str] = {}
+        self._base_id = ""
+        self._seq = 0
+        self._pending: dict[str, list | None] = {}
+        self._lock = threading.RLock()
+        self._io_lock = threading.Lock()
+    def _delta_path(self, seq: int) -> str:
+        return f"{self.path}.{self._base_id}.{seq:06d}{self.DELTA_EXT}"
+    def segment_paths(self) -> list[str]:
+        folder, name = os.path.split(self.path)
+        try:
+            files = os.listdir(folder or ".")
+        except OSError:
+            return []
+        return sorted(os.path.join(folder, fn) for fn in files
+                      if fn.startswith(name + ".") and fn.endswith(self.DELTA_EXT))
+    def _apply_deltas(self):
+        while self._base_id:
+            path = self._delta_path(self._seq + 1)
+            try:
+                obj = secure_read_json(path, self.fernet, None)
+            except Exception:
+                obj = None
+            if not isinstance(obj, dict) or obj.get("base") != self._base_id:
+                break
+            for bid, rec in (obj.get("put") or {}).items():
+                self._apply_put(str(bid), rec[0], rec[1])
+            for bid in obj.get("del") or []:
+                self._apply_del(str(bid))
+            self.sources.update(obj.get("src") or {})
+            for bid in obj.get("src_del") or []:
+                self.sources.pop(bid, None)
+            self._seq += 1
+            self.generation = obj.get("gen") or ""
+        self._drop_stale_segments()
+    def _drop_stale_segments(self):
+        keep = {self._delta_path(i) for i in range(1, self._seq + 1)} if self._base_id else set()
+        for p in self.segment_paths():
+            if p not in keep:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+    def _mark(self, bid: str, rec: list | None):
+        self._pending[bid] = rec
+        if self.autosave:
+            self.save()
+    @abstractmethod
+    def _apply_put(self, bid: str, text: str, columns: dict | None = None) -> bool: ...
+    @abstractmethod
+    def _apply_del(self, bid: str) -> bool: ...
+    @abstractmethod
+    def _count(self) -> int: ...
+    @abstractmethod
+    def _dump_base(self) -> bytes: ...
+    def needs_merge(self) -> bool:
+        return self._seq >= INDEX_MAX_DELTAS
+    def save(self, generation: str | None = None, sources: dict[str, str] | None = None, full: bool = False):
+        with self._io_lock:
+            with self._lock:
+                prev = (self.generation, self.sources, self._base_id, self._seq)
+                changed = generation is not None and generation != self.generation
+                if generation is not None:
+                    self.generation = generation
+                src_put, src_del = {}, []
+                if sources is not None:
+                    src_put = {b: fp for b, fp in sources.items() if self.sources.get(b) != fp}
+                    src_del = [b for b in self.sources if b not in sources]
+                    self.sources = dict(sources)
+                changed = changed or bool(src_put) or bool(src_del)
+                if not full and not self._pending and not changed and self._base_id:
+                    return
+                written = dict(self._pending)
+                full = full or not self._base_id or len(written) * 2 > max(self._count(), INDEX_DELTA_MIN_IDS)
+                if full:
+                    self._base_id = secrets.token_hex(6)
+                    self._seq = 0
+                    raw = self._dump_base()
+                else:
+                    self._seq += 1
+                    path = self._delta_path(self._seq)
+                    obj = {"base": self._base_id, "seq": self._seq, "gen": self.generation,
+                           "put": {b: r for b, r in written.items() if r is not None},
+                           "del": [b for b, r in written.items() if r is None],
+                           "src": src_put, "src_del": src_del}
+            try:
+                if full:
+                    secure_write_bytes(self.path, raw, self.fernet)
+                else:
+                    secure_write_json(path, obj, self.fernet)
+            except Exception as e:
+                with self._lock:
+                    self.generation, self.sources, self._base_id, self._seq = prev
+                audit_write("index_save_failed", {"full": full, "pending": len(written), "error": str(e)})
+                raise
+            with self._lock:
+                for b, r in written.items():
+                    if b in self._pending and self._pending[b] is r:
+                        del self._pending[b]
+            if full:
+                self._drop_stale_segments()
+    def merge(self):
+        self.save(full=True)
+    @abstractmethod
+    def _profiles(self, ids: list[str]): ...
+    def top_k(self, query: str, ids: Iterable[str], k: int, fields: bool = False) -> list[str]:
+        if fields:
+            name, q = split_field_query(query, self.has_field)
+        else:
+            plain, filters = parse_search_query(query)
+            name, q = None, plain or (filters[0][1] if filters else "")
+        now = time.time()
+        with self._lock:
+            scored = [(search_score(q, name, *prof, now), -i, bid)
+                      for i, (bid, prof) in enumerate(self._profiles(list(ids)))]
+        return [bid for _, _, bid in heapq.nlargest(k, scored)]
+class IndexDB(SegmentedIndex):
+    FORMAT = 5
+    def __init__(self, path: str, fernet: Fernet, autosave: bool = False, load: bool = True):
         self.path = path
         self.fernet = fernet
         self.autosave = autosave
         self._data: dict[str, str] = {}
+        self._norm: dict[str, str] = {}
+        self._pairs: dict[str, list[list[str]]] = {}
+        self._names: dict[str, set[str]] = {}
+        self._rank: dict[str, list] = {}
+        self._backend: TokenIndexBackend | TrigramIndexBackend = TokenIndexBackend()
+        self._init_segments()
         class _DummyConn:
             def close(self): pass
         self.conn = _DummyConn()
-        self._load()
+        if load:
+            self._load()
+    @staticmethod
+    def backend_for(count: int) -> str:
+        return TrigramIndexBackend.NAME if count >= TRIGRAM_MIN_BLOCKS else TokenIndexBackend.NAME
+    @property
+    def backend_name(self) -> str:
+        return self._backend.NAME
     def _load(self):
         try:
             if not os.path.exists(self.path):
@@ -845,9 +2600,25 @@ class IndexDB:
                 return
             with open(self.path, "rb") as f:
                 head = f.read(16)
-            if head.startswith(SECURE_JSON_PREFIX):
+            if head.startswith((SECURE_JSON_PREFIX, SECURE_JSON_SEALED)):
                 obj = secure_read_json(self.path, self.fernet, {"index": {}})
                 self._data = dict(obj.get("index", {})) if isinstance(obj, dict) else {}
+                self._norm = {bid: normalize_search_text(t) for bid, t in self._data.items()}
+                be = None
+                if isinstance(obj, dict) and obj.get("v") == self.FORMAT:
+                    cls = INDEX_BACKENDS.get(obj.get("backend"))
+                    be = cls.restore(obj.get("postings")) if cls else None
+                    self._base_id = str(obj.get("base") or "")
+                    self.generation = str(obj.get("gen") or "")
+                    self.sources = dict(obj.get("src") or {})
+                    for bid, pairs in (obj.get("pairs") or {}).items():
+                        self._set_pairs(bid, pairs)
+                    self._rank = dict(obj.get("rank") or {})
+                if be is None or be.NAME != self.backend_for(len(self._data)):
+                    self._reindex()
+                else:
+                    self._backend = be
+                self._apply_deltas()
                 return
             if head.startswith(b"SQLite format 3"):
                 try:
@@ -861,41 +2632,425 @@ class IndexDB:
                     self._data = {str(b): str(t) for (b, t) in rows}
                 except Exception:
                     self._data = {}
+                self._reindex()
                 self.save()
                 return
             try:
                 with open(self.path, "r", encoding="utf-8") as fr:
                     obj = json.load(fr)
                 self._data = dict(obj.get("index", obj)) if isinstance(obj, dict) else {}
+                self._reindex()
                 self.save()
             except Exception:
                 self._data = {}
         except Exception:
             self._data = {}
-
-    def save(self):
+    def _reindex(self, name: str | None = None):
+        self._norm = {bid: normalize_search_text(t) for bid, t in self._data.items()}
+        self._backend = INDEX_BACKENDS[name or self.backend_for(len(self._data))]()
+        for bid, norm in self._norm.items():
+            self._backend.add(bid, norm)
+    def _count(self) -> int:
+        return len(self._data)
+    def ids(self) -> list[str]:
+        return list(self._data.keys())
+    def _dump_base(self) -> bytes:
+        if isinstance(self._backend, TrigramIndexBackend) and self._backend.needs_compaction():
+            self._reindex(TrigramIndexBackend.NAME)
+        obj = {"v": self.FORMAT, "base": self._base_id, "gen": self.generation, "src": self.sources,
+               "index": self._data, "pairs": self._pairs, "rank": self._rank,
+               "backend": self._backend.NAME, "postings": self._backend.dump()}
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._norm.clear()
+            self._pairs.clear()
+            self._names.clear()
+            self._rank.clear()
+            self._backend = TokenIndexBackend()
+            self._pending.clear()
+            self._base_id = ""
+            self.generation = ""
+            self.sources = {}
+        if self.autosave:
+            self.save()
+    def _set_pairs(self, bid: str, pairs: list[list[str]] | None):
+        for n, _ in self._pairs.pop(bid, []):
+            ids = self._names.get(n)
+            if ids is not None:
+                ids.discard(bid)
+                if not ids:
+                    del self._names[n]
+        if pairs:
+            self._pairs[bid] = pairs
+            for n, _ in pairs:
+                self._names.setdefault(n, set()).add(bid)
+    def has_field(self, name: str) -> bool:
+        return name in self._names
+    def _apply_put(self, bid: str, text: str, columns: dict | None = None) -> bool:
+        columns = columns or {}
+        pairs = normalize_field_pairs(columns.get("pairs"))
+        rank = [normalize_search_text(columns.get("title") or ""), normalize_search_text(columns.get("notes") or ""),
+                columns.get("updated") or 0]
+        if self._data.get(bid) == text and self._pairs.get(bid, []) == pairs and self._rank.get(bid) == rank:
+            return False
+        self._set_pairs(bid, pairs)
+        self._rank[bid] = rank
+        if self._data.get(bid) == text:
+            return True
+        old = self._norm.get(bid)
+        if old is not None:
+            self._backend.remove(bid, old)
+        norm = normalize_search_text(text)
+        self._data[bid] = text
+        self._norm[bid] = norm
+        if self._backend.NAME == TokenIndexBackend.NAME and len(self._data) >= TRIGRAM_MIN_BLOCKS:
+            self._reindex(TrigramIndexBackend.NAME)
+        else:
+            self._backend.add(bid, norm)
+        return True
+    def _apply_del(self, bid: str) -> bool:
+        if bid not in self._data:
+            return False
+        del self._data[bid]
+        self._backend.remove(bid, self._norm.pop(bid, ""))
+        self._set_pairs(bid, None)
+        self._rank.pop(bid, None)
+        return True
+    def upsert(self, block_id: str, text: str, columns: dict | None = None):
+        bid = str(block_id)
+        text = text or ""
+        with self._lock:
+            if not self._apply_put(bid, text, columns):
+                return
+            self._mark(bid, [text, columns])
+    def delete(self, block_id: str):
+        bid = str(block_id)
+        with self._lock:
+            if not self._apply_del(bid):
+                return
+            self._mark(bid, None)
+    def recategorize(self, block_id: str, title: str, old: str, new: str) -> bool:
+        bid = str(block_id)
+        head = f"{title}\n{old}"
+        with self._lock:
+            text = self._data.get(bid)
+            if text is None or not (text == head or text.startswith(head + "\n")):
+                return False
+            if old == new:
+                return True
+            text = f"{title}\n{new}" + text[len(head):]
+            norm = normalize_search_text(text)
+            self._backend.retag(bid, self._norm.get(bid, ""), norm)
+            self._data[bid] = text
+            self._norm[bid] = norm
+            rank_title, rank_notes, updated = self._rank.get(bid) or ("", "", 0)
+            self._mark(bid, [text, {"title": rank_title, "category": new, "notes": rank_notes, "updated": updated,
+                                    "pairs": self._pairs.get(bid, [])}])
+            return True
+    def search(self, query: str) -> list[str]:
+        q = normalize_search_text((query or "").strip())
+        if not q:
+            return list(self._data.keys())
+        cand = self._backend.candidates(q)
+        norm = self._norm
+        if cand is None:
+            return [bid for bid, txt in norm.items() if q in txt]
+        return [bid for bid in cand if q in norm.get(bid, "")]
+    def _profiles(self, ids: list[str]):
+        for bid in ids:
+            title, notes, updated = self._rank.get(bid) or ("", "", 0)
+            yield bid, (title, self._pairs.get(bid, ()), notes, updated)
+    def search_fields(self, query: str) -> list[str]:
+        name, q = split_field_query(query, self.has_field)
+        if name is not None:
+            return [bid for bid in self._names.get(name, ()) if any(n == name and q in v for n, v in self._pairs[bid])]
+        if not q:
+            return list(self._data.keys())
+        cand = self._backend.candidates(q)
+        pairs = self._pairs
+        src = pairs.items() if cand is None else ((bid, pairs.get(bid, ())) for bid in cand)
+        return [bid for bid, ps in src if any(q in n or q in v for n, v in ps)]
+FTS_COLUMNS = ("title", "category", "fields", "notes")
+FTS_COLUMN_ALIASES = {
+    "title": "title", "заголовок": "title", "название": "title",
+    "category": "category", "категория": "category",
+    "field": "fields", "fields": "fields", "поле": "fields", "поля": "fields",
+    "notes": "notes", "заметки": "notes",
+}
+FTS_QUERY_RE = re.compile(r'(?:(\w+):)?(?:"([^"]*)"|(\S+))')
+@functools.lru_cache(maxsize=None)
+def fts5_sqlite():
+    for name in ("sqlite3", "pysqlite3.dbapi2"):
+        try:
+            mod = importlib.import_module(name)
+            conn = mod.connect(":memory:")
+            try:
+                conn.execute("CREATE VIRTUAL TABLE t USING fts5(a, tokenize='trigram')")
+                ok = hasattr(conn, "serialize") and hasattr(conn, "deserialize")
+            finally:
+                conn.close()
+        except Exception:
+            continue
+        if ok:
+            return mod
+    return None
+def parse_search_query(query: str) -> tuple[str, list[tuple[str, str]]]:
+    q = (query or "").strip()
+    filters, rest = [], []
+    for m in FTS_QUERY_RE.finditer(q):
+        col = FTS_COLUMN_ALIASES.get((m.group(1) or "").casefold())
+        term = m.group(2) if m.group(2) is not None else m.group(3)
+        if col is None:
+            rest.append(m.group(0))
+            continue
+        term = normalize_search_text(term.rstrip("*").strip())
+        if term:
+            filters.append((col, term))
+    if not filters:
+        return normalize_search_text(q.rstrip("*")), []
+    return normalize_search_text(" ".join(rest).rstrip("*")), filters
+class FtsIndexDB(SegmentedIndex):
+    NAME = "fts5"
+    SCHEMA = 4
+    IMAGE_MAGIC = b"SQLite format 3"
+    WEIGHTS = (0.0, 10.0, 4.0, 1.0, 1.0, 0.0)
+    def __init__(self, path: str, fernet: Fernet, autosave: bool = False, load: bool = True, sqlite=None):
+        self.path = path
+        self.fernet = fernet
+        self.autosave = autosave
+        self.sqlite = sqlite or fts5_sqlite()
+        if self.sqlite is None:
+            raise RuntimeError("FTS5 недоступен")
+        self._rowid: dict[str, int] = {}
+        self._sig: dict[str, int] = {}
+        self._init_segments()
+        self.conn = self._open(None)
+        if load:
+            self._load()
+    @property
+    def backend_name(self) -> str:
+        return self.NAME
+    def _open(self, image: bytes | None):
+        conn = self.sqlite.connect(":memory:", check_same_thread=False)
+        if image:
+            conn.deserialize(image)
+            if conn.execute("PRAGMA user_version").fetchone()[0] != self.SCHEMA:
+                conn.close()
+                return self._open(None)
+        conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS fts USING fts5(bid UNINDEXED, "
+                     + ", ".join(FTS_COLUMNS) + ", updated UNINDEXED, tokenize='trigram')")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta(k TEXT PRIMARY KEY, v TEXT)")
+        conn.execute("CREATE TABLE IF NOT EXISTS fv(bid TEXT, name TEXT, value TEXT)")
+        conn.execute("CREATE INDEX IF NOT EXISTS fv_bid ON fv(bid)")
+        conn.execute("CREATE INDEX IF NOT EXISTS fv_name ON fv(name)")
+        conn.execute(f"PRAGMA user_version = {self.SCHEMA}")
+        return conn
+    def _load(self):
+        try:
+            if not os.path.exists(self.path):
+                return
+            with open(self.path, "rb") as f:
+                data = f.read()
+            raw = None
+            try:
+                raw = secure_decode(data, self.fernet)
+            except Exception:
+                raw = None
+            if raw and raw.startswith(self.IMAGE_MAGIC):
+                self.conn.close()
+                self.conn = self._open(raw)
+                self._rowid = {str(b): int(r) for (r, b) in self.conn.execute("SELECT rowid, bid FROM fts")}
+                meta = dict(self.conn.execute("SELECT k, v FROM meta"))
+                self._base_id = meta.get("base") or ""
+                self.generation = meta.get("gen") or ""
+                self.sources = json.loads(meta.get("src") or "{}")
+                self._apply_deltas()
+                return
+            legacy = IndexDB(self.path, self.fernet)
+            for bid, txt in legacy._data.items():
+                self._apply_put(bid, txt, None)
+        except Exception:
+            self.clear()
+    def _count(self) -> int:
+        return len(self._rowid)
+    def ids(self) -> list[str]:
+        return list(self._rowid.keys())
+    def _dump_base(self) -> bytes:
+        self.conn.executemany("INSERT OR REPLACE INTO meta(k, v) VALUES (?, ?)",
+                              [("base", self._base_id), ("gen", self.generation),
+                               ("src", json.dumps(self.sources, separators=(",", ":")))])
+        self.conn.commit()
+        return bytes(self.conn.serialize())
+    def clear(self):
+        with self._lock:
+            self.conn.execute("DELETE FROM fts")
+            self.conn.execute("DELETE FROM fv")
+            self._rowid.clear()
+            self._sig.clear()
+            self._pending.clear()
+            self._base_id = ""
+            self.generation = ""
+            self.sources = {}
+        if self.autosave:
+            self.save()
+    def _apply_put(self, bid: str, text: str, columns: dict | None = None) -> bool:
+        sig = hash((text, json.dumps(columns, ensure_ascii=False, sort_keys=True) if columns else None))
+        if self._sig.get(bid) == sig:
+            return False
+        columns = columns or {"fields": text}
+        vals = [normalize_search_text(columns.get(c) or "") for c in FTS_COLUMNS] + [columns.get("updated") or 0]
+        rowid = self._rowid.get(bid)
+        if rowid is None:
+            cur = self.conn.execute("INSERT INTO fts(bid, " + ", ".join(FTS_COLUMNS) + ", updated) VALUES (?, ?, ?, ?, ?, ?)",
+                                    [bid] + vals)
+            self._rowid[bid] = cur.lastrowid
+        else:
+            self.conn.execute("UPDATE fts SET " + ", ".join(f"{c} = ?" for c in FTS_COLUMNS) + ", updated = ? WHERE rowid = ?",
+                              vals + [rowid])
+            self.conn.execute("DELETE FROM fv WHERE bid = ?", (bid,))
+        self.conn.executemany("INSERT INTO fv(bid, name, value) VALUES (?, ?, ?)",
+                              [(bid, n, v) for n, v in normalize_field_pairs(columns.get("pairs"))])
+        self._sig[bid] = sig
+        return True
+    def _apply_del(self, bid: str) -> bool:
+        rowid = self._rowid.pop(bid, None)
+        self._sig.pop(bid, None)
+        if rowid is None:
+            return False
+        self.conn.execute("DELETE FROM fts WHERE rowid = ?", (rowid,))
+        self.conn.execute("DELETE FROM fv WHERE bid = ?", (bid,))
+        return True
+    def upsert(self, block_id: str, text: str, columns: dict | None = None):
+        bid = str(block_id)
+        text = text or ""
+        with self._lock:
+            if not self._apply_put(bid, text, columns):
+                return
+            self._mark(bid, [text, columns])
+    def delete(self, block_id: str):
+        bid = str(block_id)
+        with self._lock:
+            if not self._apply_del(bid):
+                return
+            self._mark(bid, None)
+    def recategorize(self, block_id: str, title: str, old: str, new: str) -> bool:
+        bid = str(block_id)
+        with self._lock:
+            rowid = self._rowid.get(bid)
+            row = None if rowid is None else self.conn.execute(
+                "SELECT " + ", ".join(FTS_COLUMNS) + ", updated FROM fts WHERE rowid = ?", (rowid,)).fetchone()
+            if row is None or row[0] != normalize_search_text(title) or row[1] != normalize_search_text(old):
+                return False
+            if old == new:
+                return True
+            self.conn.execute("UPDATE fts SET category = ? WHERE rowid = ?", (normalize_search_text(new), rowid))
+            columns = dict(zip(FTS_COLUMNS, row), updated=row[-1], category=new,
+                           pairs=[[n, v] for n, v in self.conn.execute("SELECT name, value FROM fv WHERE bid = ?", (bid,))])
+            text = "\n".join(columns[c] or "" for c in FTS_COLUMNS)
+            self._sig[bid] = hash((text, json.dumps(columns, ensure_ascii=False, sort_keys=True)))
+            self._mark(bid, [text, columns])
+            return True
+    @staticmethod
+    def _phrase(term: str) -> str:
+        return '"' + term.replace('"', '""') + '"'
+    def search(self, query: str) -> list[str]:
+        plain, filters = parse_search_query(query)
+        if not plain and not filters:
+            return list(self._rowid.keys())
+        match, where, args = [], [], []
+        for col, term in ([(None, plain)] if plain else []) + filters:
+            if len(term) >= 3:
+                match.append(f"{col} : {self._phrase(term)}" if col else self._phrase(term))
+            else:
+                where.append(f"instr({col or '(' + ' || char(10) || '.join(FTS_COLUMNS) + ')'}, ?) > 0")
+                args.append(term)
+        if match:
+            sql = "SELECT bid FROM fts WHERE fts MATCH ?" + "".join(f" AND {w}" for w in where)
+            sql += " ORDER BY bm25(fts, " + ", ".join(str(w) for w in self.WEIGHTS) + ")"
+            args.insert(0, " AND ".join(match))
+        else:
+            sql = "SELECT bid FROM fts WHERE " + " AND ".join(where)
+        try:
+            with self._lock:
+                return [str(b) for (b,) in self.conn.execute(sql, args)]
+        except Exception:
+            return []
+    def has_field(self, name: str) -> bool:
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM fv WHERE name = ? LIMIT 1", (name,)).fetchone() is not None
+    def _profiles(self, ids: list[str]):
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            marks = ", ".join("?" * len(chunk))
+            rowids = [self._rowid.get(bid, -1) for bid in chunk]
+            rows = {str(b): (t, n, u) for b, t, n, u in self.conn.execute(
+                f"SELECT bid, title, notes, updated FROM fts WHERE rowid IN ({marks})", rowids)}
+            pairs: dict[str, list] = {}
+            for b, n, v in self.conn.execute(f"SELECT bid, name, value FROM fv WHERE bid IN ({marks})", chunk):
+                pairs.setdefault(str(b), []).append((n, v))
+            for bid in chunk:
+                title, notes, updated = rows.get(bid) or ("", "", 0)
+                yield bid, (title or "", pairs.get(bid, ()), notes or "", updated or 0)
+    def search_fields(self, query: str) -> list[str]:
+        name, q = split_field_query(query, self.has_field)
+        if name is not None:
+            sql, args = "SELECT DISTINCT bid FROM fv WHERE name = ?", [name]
+            if q:
+                sql += " AND instr(value, ?) > 0"
+                args.append(q)
+        elif not q:
+            return list(self._rowid.keys())
+        elif len(q) >= 3:
+            sql, args = "SELECT bid FROM fts WHERE fts MATCH ?", [f"fields : {self._phrase(q)}"]
+        else:
+            sql, args = "SELECT bid FROM fts WHERE instr(fields, ?) > 0", [q]
         try:
-            secure_write_json(self.path, {"index": self._data}, self.fernet)
+            with self._lock:
+                return [str(b) for (b,) in self.conn.execute(sql, args)]
+        except Exception:
+            return []
+def open_index_db(path: str, fernet: Fernet, autosave: bool = False, load: bool = True):
+    if fts5_sqlite() is not None:
+        try:
+            return FtsIndexDB(path, fernet, autosave=autosave, load=load)
         except Exception:
             pass
-    def _maybe_save(self):
-        if self.autosave:
-            self.save()
-    def clear(self):
-        self._data.clear()
-        self._maybe_save()
-    def upsert(self, block_id: str, text: str):
-        self._data[str(block_id)] = text or ""
-        self._maybe_save()
-    def delete(self, block_id: str):
-        if str(block_id) in self._data:
-            del self._data[str(block_id)]
-            self._maybe_save()
-    def search(self, query: str) -> list[str]:
-        q = (query or "").strip().lower()
-        if not q:
-            return list(self._data.keys())
-        return [bid for bid, txt in self._data.items() if q in (txt or "").lower()]
+    return IndexDB(path, fernet, autosave=autosave, load=load)
+class IndexBuilder:
+    BATCH = 256
+    def __init__(self, blocks: list[dict], text_of: Callable[[dict], tuple[str, dict]], target=None):
+        self.blocks = blocks
+        self.text_of = text_of
+        self.target = target
+        self.results: list[tuple[str, str, dict]] = []
+        self.dirty: set[str] = set()
+        self.cancelled = threading.Event()
+        self.done = 0
+    @property
+    def total(self) -> int:
+        return len(self.blocks)
+    def percent(self) -> int:
+        return int(self.done * 100 / max(self.total, 1))
+    def run(self, progress=None):
+        for i in range(0, len(self.blocks), self.BATCH):
+            if self.cancelled.is_set():
+                return None
+            for b in self.blocks[i:i + self.BATCH]:
+                bid = str(b.get("id", ""))
+                try:
+                    txt, cols = self.text_of(b)
+                    if self.target is None:
+                        self.results.append((bid, txt, cols))
+                    else:
+                        self.target.upsert(bid, txt, cols)
+                except Exception:
+                    self.dirty.add(bid)
+                self.done += 1
+            if progress:
+                progress("Индексация", self.done, self.total)
+        return self
 class PasswordDialog(QDialog):
     def __init__(self, title, label, echo_password=True):
         super().__init__()
@@ -1084,6 +3239,15 @@ class SectionTree(QTreeWidget):
         self.setAcceptDrops(True)
         self.setDragDropMode(QAbstractItemView.DragDropMode.DropOnly)
         self.setUniformRowHeights(True)
+        self.count_for = None
+    def viewportEvent(self, e):
+        if e.type() == QEvent.Type.ToolTip and self.count_for is not None:
+            item = self.itemAt(e.pos())
+            data = item.data(0, Qt.ItemDataRole.UserRole) if item is not None else None
+            if isinstance(data, tuple) and data[0] == "section":
+                QToolTip.showText(e.globalPos(), f"Блоков: {self.count_for(data[1])}", self.viewport())
+                return True
+        return super().viewportEvent(e)
     def dragEnterEvent(self, e):
         if e.mimeData().hasFormat("application/x-linkpass-block-id"): e.acceptProposedAction()
         else: super().dragEnterEvent(e)
@@ -1203,6 +3367,250 @@ def merge_theme(t):
         for k, v in t.items(): base[k] = v
     return base
 ALPHANUM = "ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz23456789!@#$%^&*()-_=+[]{};:,.?/|"
+class BlockCardModel(QAbstractListModel):
+    BlockRole = Qt.ItemDataRole.UserRole + 1
+    MIME = "application/x-linkpass-block-id"
+    def __init__(self, parent=None, size_for: Callable[[dict], QSize] | None = None):
+        super().__init__(parent)
+        self._blocks: list[dict] = []
+        self._sizes: list[QSize] = []
+        self.size_for = size_for
+        self.fallback_key = ""
+    def set_blocks(self, blocks: list[dict], fallback_key: str = ""):
+        self.beginResetModel()
+        self._blocks = list(blocks)
+        self._sizes = [self.size_for(b) for b in self._blocks] if self.size_for else []
+        self.fallback_key = fallback_key
+        self.endResetModel()
+    def block(self, row: int) -> dict | None:
+        return self._blocks[row] if 0 <= row < len(self._blocks) else None
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._blocks)
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.SizeHintRole:
+            return self._sizes[index.row()] if self._sizes and index.isValid() else None
+        b = self.block(index.row()) if index.isValid() else None
+        if b is None:
+            return None
+        if role == self.BlockRole:
+            return b
+        if role == Qt.ItemDataRole.DisplayRole:
+            return b.get("title", "")
+        return None
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        return Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable | Qt.ItemFlag.ItemIsDragEnabled
+    def mimeTypes(self) -> list[str]:
+        return [self.MIME]
+    def mimeData(self, indexes):
+        ids = [str(b["id"]) for b in (self.block(i.row()) for i in indexes) if b and b.get("id")]
+        mime = QtCore.QMimeData()
+        mime.setData(self.MIME, ",".join(dict.fromkeys(ids)).encode("utf-8"))
+        return mime
+    def supportedDragActions(self):
+        return Qt.DropAction.MoveAction
+class BlockCardDelegate(QStyledItemDelegate):
+    WIDTH = 300
+    PAD = 12
+    GAP = 8
+    HEAD = 26
+    ROW = 30
+    MORE = 18
+    BTN = 30
+    HEAD_BTN = (28, 24)
+    BOTTOM = (("open", "🔍", "Открыть блок"), ("move", "↔️", "Переместить блок"),
+              ("files", "📁", "Открыть вложения"), ("notes", "📝", "Открыть заметки"))
+    def __init__(self, win, view: QListView):
+        super().__init__(view)
+        self.win = win
+        self.view = view
+        self._hover: tuple[int, QtCore.QPoint] | None = None
+        self._sizes: dict[int, QSize] = {}
+        self._icons = {}
+        for name in ("share", "qr"):
+            p = resource_path(f"icons/{name}.png")
+            self._icons[name] = QIcon(p) if os.path.exists(p) else None
+    @staticmethod
+    def _font(px: int, bold: bool = False) -> QFont:
+        f = QFont()
+        f.setPixelSize(px)
+        f.setBold(bold)
+        return f
+    def _rows(self, block: dict) -> tuple[int, int]:
+        n = len(block.get("fields") or {})
+        limit = CARD_FIELDS_LIMIT if isinstance(CARD_FIELDS_LIMIT, int) and CARD_FIELDS_LIMIT > 0 else 6
+        return min(n, limit), max(0, n - limit)
+    def card_size(self, block: dict) -> QSize:
+        n = len(block.get("fields") or ())
+        size = self._sizes.get(n)
+        if size is None:
+            shown, rest = self._rows(block)
+            h = self.PAD * 2 + self.HEAD + self.GAP + shown * (self.ROW + self.GAP) + (self.MORE + self.GAP if rest else 0) + self.BTN
+            size = self._sizes[n] = QSize(self.WIDTH, h)
+        return size
+    def _key(self, block: dict) -> str:
+        ref = self.win.id_to_ref.get(block.get("id", ""))
+        return ref[0] if ref else self.view.model().fallback_key
+    def _layout(self, rect: QRect, block: dict) -> dict:
+        t = self.win.theme
+        fm_small = QFontMetrics(self._font(11, True))
+        fm_label = QFontMetrics(self._font(12, True))
+        key = self._key(block)
+        path_list = [p for p in (key or "").split("/") if p]
+        x0, y0 = rect.left() + self.PAD, rect.top() + self.PAD
+        right = rect.right() - self.PAD
+        buttons: list[tuple[QRect, str, Any, str, str]] = []
+        chips: list[tuple[QRect, str, str, str]] = []
+        bw, bh = self.HEAD_BTN
+        hy = y0 + (self.HEAD - bh) // 2
+        head = []
+        if any(p not in self.win.unlocked_sections for p in self.win._locked_prefixes(path_list)):
+            head.append(("unlock", "🔓", "Разблокировать раздел для показа данных"))
+        head += [("qr", "QR", "Показать QR"), ("share", "🔗", "Поделиться")]
+        for action, text, tip in head:
+            r = QRect(right - bw + 1, hy, bw, bh)
+            buttons.append((r, action, None, text, tip))
+            right -= bw + 6
+        att_n = self.win.attachments.count(block.get("id", ""))
+        if att_n > 0:
+            text = f"📎 {att_n}"
+            w = fm_small.horizontalAdvance(text) + 12
+            chips.append((QRect(right - w + 1, y0 + 2, w, 22), text, t["attach_badge_bg"], t["attach_badge_fg"]))
+            right -= w + 6
+        color = self.win.get_section_color(path_list)
+        cat = fm_small.elidedText(block.get("category", ""), Qt.TextElideMode.ElideRight, 110)
+        if cat:
+            w = fm_small.horizontalAdvance(cat) + 16
+            chips.append((QRect(right - w + 1, y0 + 2, w, 22), cat, color, self.win._contrast_text_for(color)))
+            right -= w + 6
+        title = QRect(x0, y0, max(right - x0, 10), self.HEAD)
+        can_show = self.win.can_show_block_data(block)
+        fields = []
+        y = y0 + self.HEAD + self.GAP
+        shown, rest = self._rows(block)
+        for k, vv in list((block.get("fields") or {}).items())[:shown]:
+            label = str(k if k is not None else "").rstrip(":") + ":"
+            lw = min(fm_label.horizontalAdvance(label), 90) + 6
+            lr = QRect(x0, y, lw, self.ROW)
+            bx = rect.right() - self.PAD
+            copy_r = QRect(bx - 27, y + 3, 28, self.ROW - 6)
+            buttons.append((copy_r, "copy", k, "🗐", "Копировать"))
+            bx -= 28 + 4
+            plain = self.win.value_plain(block, k, vv) if can_show else None
+            if plain and (is_url(plain) or is_email_addr(plain)):
+                buttons.append((QRect(bx - 27, y + 3, 28, self.ROW - 6), "go", plain, "↗", "Открыть ссылку"))
+                bx -= 28 + 4
+            fields.append((lr, label, QRect(lr.right() + 1, y, max(bx - lr.right(), 20), self.ROW), plain if can_show else mask_text("")))
+            y += self.ROW + self.GAP
+        more = None
+        if rest:
+            more = (QRect(x0, y, rect.right() - self.PAD - x0, self.MORE), f"… и ещё {rest} полей")
+        by = rect.bottom() - self.PAD - self.BTN + 1
+        bx = x0
+        for action, text, tip in self.BOTTOM:
+            buttons.append((QRect(bx, by, 40, self.BTN), action, None, text, tip))
+            bx += 46
+        buttons.append((QRect(rect.right() - self.PAD - 39, by, 40, self.BTN), "delete", None, "🗑️", "Удалить блок"))
+        return {"title": title, "chips": chips, "buttons": buttons, "fields": fields, "more": more, "key": key}
+    def _hit(self, rect: QRect, block: dict, pos) -> tuple[str, Any, str] | None:
+        for r, action, arg, _, tip in self._layout(rect, block)["buttons"]:
+            if r.contains(pos):
+                return action, arg, tip
+        return None
+    def paint(self, painter: QPainter, option, index):
+        block = index.data(BlockCardModel.BlockRole)
+        if not block:
+            return
+        t = self.win.theme
+        r = int(t.get("btn_radius", 10))
+        rect = option.rect
+        lay = self._layout(rect, block)
+        hover = self._hover[1] if self._hover and self._hover[0] == index.row() else None
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing, True)
+        state = option.state
+        if state & QStyle.StateFlag.State_Selected:
+            pen = QPen(option.palette.highlight().color(), 2)
+        else:
+            pen = QPen(QColor(17, 24, 39, 31 if state & QStyle.StateFlag.State_MouseOver else 15), 1)
+        painter.setPen(pen)
+        painter.setBrush(QColor(t["card_bg"]))
+        painter.drawRoundedRect(QtCore.QRectF(rect).adjusted(0.5, 0.5, -0.5, -0.5), 14, 14)
+        painter.setFont(self._font(16, True))
+        painter.setPen(QColor(t["block_title_fg"]))
+        fm = painter.fontMetrics()
+        painter.drawText(lay["title"], Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+                         fm.elidedText(block.get("title", ""), Qt.TextElideMode.ElideRight, lay["title"].width()))
+        painter.setFont(self._font(11, True))
+        for cr, text, bg, fg in lay["chips"]:
+            painter.setPen(Qt.PenStyle.NoPen)
+            painter.setBrush(QColor(bg))
+            painter.drawRoundedRect(cr, 10, 10)
+            painter.setPen(QColor(fg))
+            painter.drawText(cr, Qt.AlignmentFlag.AlignCenter, text)
+        for lr, label, vr, value in lay["fields"]:
+            painter.setFont(self._font(12, True))
+            painter.setPen(QColor(t["field_label_fg"]))
+            painter.drawText(lr, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+                             painter.fontMetrics().elidedText(label, Qt.TextElideMode.ElideRight, lr.width() - 2))
+            painter.setPen(QColor("#ECECEE"))
+            painter.setBrush(QColor("#FAFAFB"))
+            painter.drawRoundedRect(vr.adjusted(0, 1, 0, -1), 8, 8)
+            painter.setFont(self._font(13))
+            painter.setPen(QColor(t["field_text_fg"]))
+            text_r = vr.adjusted(8, 0, -8, 0)
+            painter.drawText(text_r, Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter,
+                             painter.fontMetrics().elidedText(str(value or ""), Qt.TextElideMode.ElideRight, text_r.width()))
+        if lay["more"]:
+            painter.setFont(self._font(12))
+            painter.setPen(QColor("#666666"))
+            painter.drawText(lay["more"][0], Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignVCenter, lay["more"][1])
+        painter.setFont(self._font(13))
+        for br, action, _, text, _ in lay["buttons"]:
+            painter.setPen(QColor("#E6E7EA"))
+            painter.setBrush(QColor("#F7F8FA") if hover is not None and br.contains(hover) else Qt.GlobalColor.transparent)
+            painter.drawRoundedRect(br, int(r * 0.7), int(r * 0.7))
+            icon = self._icons.get(action)
+            if icon is not None:
+                icon.paint(painter, br.adjusted(5, 4, -5, -4))
+            else:
+                painter.setPen(QColor("#1F2937"))
+                painter.drawText(br, Qt.AlignmentFlag.AlignCenter, text)
+        painter.restore()
+    def editorEvent(self, event, model, option, index) -> bool:
+        block = index.data(BlockCardModel.BlockRole)
+        if not block:
+            return False
+        et = event.type()
+        if et == QEvent.Type.MouseMove:
+            pos = event.position().toPoint()
+            self._hover = (index.row(), pos)
+            hit = self._hit(option.rect, block, pos)
+            self.view.viewport().setCursor(Qt.CursorShape.PointingHandCursor if hit else Qt.CursorShape.ArrowCursor)
+            self.view.viewport().update(option.rect)
+            return False
+        if et in (QEvent.Type.MouseButtonPress, QEvent.Type.MouseButtonRelease, QEvent.Type.MouseButtonDblClick):
+            if event.button() != Qt.MouseButton.LeftButton:
+                return False
+            hit = self._hit(option.rect, block, event.position().toPoint())
+            if hit is None:
+                return False
+            if et == QEvent.Type.MouseButtonRelease:
+                action, arg, _ = hit
+                QTimer.singleShot(0, lambda: self.win.card_action(block, action, arg))
+            return True
+        return False
+    def helpEvent(self, event, view, option, index) -> bool:
+        block = index.data(BlockCardModel.BlockRole)
+        if block and event.type() == QEvent.Type.ToolTip:
+            hit = self._hit(option.rect, block, event.pos())
+            if hit is not None:
+                QToolTip.showText(event.globalPos(), hit[2], view)
+                return True
+            QToolTip.hideText()
+            return True
+        return super().helpEvent(event, view, option, index)
 class PasswordToolsDialog(QDialog):
     def __init__(self, win):
         super().__init__(win)
@@ -1415,7 +3823,7 @@ class BlockEditorDialog(QDialog):
         self.notes_edit.setPlaceholderText("Свободные заметки по блоку…")
         if self._can_show():
             try:
-                self.notes_edit.setPlainText(decrypt_value(self.block.get("notes", ""), self.win.fernet))
+                self.notes_edit.setPlainText(decrypt_value(self.block.get("notes", ""), self.win.fernet, self.block.get("sealed")))
             except Exception:
                 self.notes_edit.setPlainText("")
             self.notes_edit.setReadOnly(False)
@@ -1437,10 +3845,13 @@ class BlockEditorDialog(QDialog):
     def commit_edited_fields(self):
         if not self._can_show():
             return
+        fields_plain, notes_plain = block_plain(self.block, self.win.fernet)
         for k, le in self.field_edits.items():
+            if k in fields_plain and fields_plain[k] == le.text():
+                continue
             self.block["fields"][k] = encrypt_value(le.text(), self.win.fernet)
         try:
-            if hasattr(self, "notes_edit"):
+            if hasattr(self, "notes_edit") and self.notes_edit.toPlainText() != notes_plain:
                 self.block["notes"] = encrypt_value(self.notes_edit.toPlainText(), self.win.fernet)
         except Exception:
             pass
@@ -1472,7 +3883,7 @@ class BlockEditorDialog(QDialog):
             lab.setAlignment(Qt.AlignmentFlag.AlignRight | Qt.AlignmentFlag.AlignVCenter)
             row.addWidget(lab)
             if self._can_show():
-                val = decrypt_value(v, self.win.fernet)
+                val = decrypt_value(v, self.win.fernet, self.block.get("sealed"))
                 le = QLineEdit(val)
             else:
                 le = QLineEdit(mask_text(""))
@@ -1480,7 +3891,7 @@ class BlockEditorDialog(QDialog):
             le.setStyleSheet(f"color:{self.win.theme.get('field_text_fg', '#000')};")
             row.addWidget(le)
             if self._can_show():
-                try_val = decrypt_value(v, self.win.fernet)
+                try_val = decrypt_value(v, self.win.fernet, self.block.get("sealed"))
                 if try_val and (is_url(try_val) or is_email_addr(try_val)):
                     btn_go = QPushButton("↗")
                     btn_go.setFixedWidth(28); btn_go.setProperty("minsize", "compact")
@@ -1492,28 +3903,28 @@ class BlockEditorDialog(QDialog):
             self.fields_layout.addLayout(row)
             self.field_edits[k] = le
     def att_dir(self):
-        bid = self.block.get("id","")
-        d = os.path.join(ATTACH_DIR, bid)
+        d = self.win.attachments.block_dir(self.block.get("id",""))
         os.makedirs(d, exist_ok=True)
         return d
     def populate_attachments(self):
         self.lst_att.clear()
-        d = self.att_dir()
-        for fn in sorted(os.listdir(d)):
-            if fn.endswith(".meta.json"): continue
-            self.lst_att.addItem(fn)
+        for e in self.win.attachments.entries(self.block.get("id", "")):
+            it = QListWidgetItem(e["name"])
+            it.setData(Qt.ItemDataRole.UserRole, e["id"])
+            it.setToolTip(f"{max(1, int(e.get('size') or 0) // 1024)} КБ, {e.get('mime', '')}\n{e.get('added', '')}")
+            self.lst_att.addItem(it)
     def _show_preview(self):
         it = self.lst_att.currentItem()
         if not it:
             self.preview_stack.setCurrentIndex(0)
             return
-        fn = it.text()
+        fn = it.data(Qt.ItemDataRole.UserRole)
         src = os.path.join(self.att_dir(), fn)
         try:
-            with open(src, "rb") as f:
-                enc = f.read()
-            data = self.win.fernet.decrypt(enc)
+            data = read_attachment_bytes(src, self.win.fernet, ATTACH_PREVIEW_MAX)
         except Exception:
+            data = None
+        if data is None:
             self.preview_stack.setCurrentIndex(0)
             return
         pm = QPixmap()
@@ -1532,62 +3943,53 @@ class BlockEditorDialog(QDialog):
             except Exception:
                 pass
         self.preview_stack.setCurrentIndex(0)
+    def _attachment_progress(self, progress: Callable[[str, int, int], None], stage: str) -> Callable[[int, int], None]:
+        return lambda done, total: progress(stage, done // 1024, max(total, 1) // 1024)
     def add_attachment(self):
         path, _ = QFileDialog.getOpenFileName(self, "Добавить файл", "", "All Files (*)")
         if not path:
             return
-        try:
-            with open(path, "rb") as f:
-                data = f.read()
-            enc = self.win.fernet.encrypt(data)
-            base = os.path.basename(path)
-            ts   = datetime.now().strftime("%Y%m%d-%H%M%S")
-            anon = secrets.token_hex(12)
-            out  = os.path.join(self.att_dir(), f"{ts}_{anon}.bin")
-            with open(out, "wb") as w:
-                w.write(enc)
-            meta = {"orig_name": base, "size": len(data), "added": datetime.utcnow().isoformat()+"Z"}
-            secure_write_json(out + ".meta.json", meta, self.win.fernet)
+        base = os.path.basename(path)
+        ts   = datetime.now().strftime("%Y%m%d-%H%M%S")
+        anon = secrets.token_hex(12)
+        out  = os.path.join(self.att_dir(), f"{ts}_{anon}.bin")
+        ring = self.win.fernet
+        def work(progress):
+            digest = hashlib.sha256()
+            size = encrypt_attachment_file(path, out, ring, self._attachment_progress(progress, f"{base}, КБ"), digest)
+            meta = {"orig_name": base, "size": size, "sha256": digest.hexdigest(), "added": datetime.utcnow().isoformat()+"Z"}
+            secure_write_json(out + ".meta.json", meta, ring)
+            return meta
+        def done(meta):
+            self.win.attachments.add(self.block.get("id", ""), AttachmentCatalog.make_entry(os.path.basename(out), meta))
             self.populate_attachments()
-            attachments_count_invalidate(self.block.get("id", ""))
             self.win.schedule_render()
             audit_write("attachment_add", {"block_id": self.block.get("id",""), "file": os.path.basename(out)})
-        except Exception as e:
-            QMessageBox.warning(self, "Вложения", f"Ошибка: {e}")
+        run_progress_task(self, "Шифрование вложения", work, done)
     def save_attachment_as(self):
         it = self.lst_att.currentItem()
         if not it:
             return
-        fn = it.text()
+        fn = it.data(Qt.ItemDataRole.UserRole)
         src = os.path.join(self.att_dir(), fn)
-        try:
-            with open(src, "rb") as f:
-                enc = f.read()
-            data = self.win.fernet.decrypt(enc)
-            suggested = fn.replace(".bin", "")
-            mpath = src + ".meta.json"
-            if os.path.exists(mpath):
-                try:
-                    mj = secure_read_json(mpath, self.win.fernet, {})
-                    orig = (mj.get("orig_name") or "").strip()
-                    if orig:
-                        suggested = orig
-                except Exception:
-                    pass
-            save, _ = QFileDialog.getSaveFileName(self, "Сохранить как", suggested)
-            if not save:
-                return
-            with open(save, "wb") as w:
-                w.write(data)
-            audit_write("attachment_save_as", {"block_id": self.block.get("id",""), "file": fn, "target": save})
-        except Exception as e:
-            QMessageBox.warning(self, "Вложения", f"Ошибка: {e}")
+        suggested = it.text() or fn.replace(".bin", "")
+        save, _ = QFileDialog.getSaveFileName(self, "Сохранить как", suggested)
+        if not save:
+            return
+        ring = self.win.fernet
+        def work(progress):
+            try:
+                return decrypt_attachment_file(src, save, ring, self._attachment_progress(progress, f"{os.path.basename(save)}, КБ"))
+            except InvalidToken:
+                raise RuntimeError("Файл повреждён или зашифрован другим ключом.")
+        run_progress_task(self, "Расшифровка вложения", work,
+                          lambda _: audit_write("attachment_save_as", {"block_id": self.block.get("id",""), "file": fn, "target": save}))
     def delete_attachment(self):
         it = self.lst_att.currentItem()
         if not it: 
             return
-        fn = it.text()
-        if not custom_question(self, "Удалить вложение?", f"Удалить «{fn}»?"):
+        fn = it.data(Qt.ItemDataRole.UserRole)
+        if not custom_question(self, "Удалить вложение?", f"Удалить «{it.text()}»?"):
             return
         try:
             d = self.att_dir()
@@ -1595,8 +3997,8 @@ class BlockEditorDialog(QDialog):
             m = os.path.join(d, fn + ".meta.json")
             if os.path.exists(m):
                 os.remove(m)
+            self.win.attachments.remove(self.block.get("id", ""), fn)
             self.populate_attachments()
-            attachments_count_invalidate(self.block.get("id", ""))
             self.win.schedule_render()
             audit_write("attachment_delete", {"block_id": self.block.get("id",""), "file": fn})
         except Exception as e:
@@ -1607,35 +4009,37 @@ class BlockEditorDialog(QDialog):
             QMessageBox.information(self, "Вложения", "Выберите один или несколько файлов.")
             return []
         out_dir = self.win.make_temp_share_dir(self.block.get("id", "files"))
-        saved: list[str] = []
+        plan: list[tuple[str, str]] = []
         for it in items:
-            fn = it.text()
+            fn = it.data(Qt.ItemDataRole.UserRole)
             src = os.path.join(self.att_dir(), fn)
-            try:
-                with open(src, "rb") as f:
-                    enc = f.read()
-                data = self.win.fernet.decrypt(enc)
-                meta_name = None
-                mpath = src + ".meta.json"
-                if os.path.exists(mpath):
-                    try:
-                        mj = secure_read_json(mpath, self.win.fernet, {})
-                        meta_name = (mj.get("orig_name") or "").strip() or None
-                    except Exception:
-                        pass
-                base = meta_name or fn.replace(".bin", "")
-                dst = os.path.join(out_dir, base)
-                root, ext = os.path.splitext(dst)
-                k = 1
-                while os.path.exists(dst):
-                    dst = f"{root} ({k}){ext}"
-                    k += 1
-                with open(dst, "wb") as w:
-                    w.write(data)
-                saved.append(dst)
-            except Exception as e:
-                QMessageBox.warning(self, "Вложения", f"Не удалось подготовить «{fn}»: {e}")
-        if open_folder:
+            base = it.text() or fn.replace(".bin", "")
+            dst = os.path.join(out_dir, base)
+            root, ext = os.path.splitext(dst)
+            k = 1
+            while os.path.exists(dst) or any(d == dst for _, d in plan):
+                dst = f"{root} ({k}){ext}"
+                k += 1
+            plan.append((src, dst))
+        ring = self.win.fernet
+        def work(progress):
+            saved: list[str] = []
+            failed: list[str] = []
+            for src, dst in plan:
+                try:
+                    decrypt_attachment_file(src, dst, ring, self._attachment_progress(progress, f"{os.path.basename(dst)}, КБ"))
+                    saved.append(dst)
+                except Exception as e:
+                    failed.append(f"«{os.path.basename(src)}»: {e or type(e).__name__}")
+            return saved, failed
+        result: dict[str, Any] = {"saved": []}
+        def done(res):
+            result["saved"], failed = res
+            if failed:
+                QMessageBox.warning(self, "Вложения", "Не удалось подготовить:\n" + "\n".join(failed))
+        run_progress_task(self, "Подготовка вложений", work, done)
+        saved = result["saved"]
+        if open_folder and saved:
             try:
                 QDesktopServices.openUrl(QUrl.fromLocalFile(out_dir))
             except Exception:
@@ -1684,7 +4088,7 @@ class BlockEditorDialog(QDialog):
         self.win.on_block_changed(self.block, meta={"autosave_before_delete_field": True})
         if not custom_question(self, "Удалить поле?", f"Поле «{key}» будет удалено безвозвратно. Продолжить?"):
             return
-        prev = decrypt_value(self.block["fields"][key], self.win.fernet) if self._can_show() else ""
+        prev = decrypt_value(self.block["fields"][key], self.win.fernet, self.block.get("sealed")) if self._can_show() else ""
         del self.block["fields"][key]
         self.win.on_block_changed(self.block, meta={"delete_field": key, "prev": prev})
 
@@ -1703,8 +4107,8 @@ class BlockEditorDialog(QDialog):
                 self.win.clip_timer.start(self.win.CLIPBOARD_SEC * 1000)
                 return
         for k, v in (self.block.get("fields") or {}).items():
-            lines.append(f"{k}: {decrypt_value(v, self.win.fernet)}")
-        notes_plain = decrypt_value(self.block.get("notes", ""), self.win.fernet)
+            lines.append(f"{k}: {self.win.value_plain(self.block, k, v)}")
+        notes_plain = self.win.value_plain(self.block, None, self.block.get("notes", ""))
         if (notes_plain or "").strip():
             lines.append("Заметки:")
             lines.append(notes_plain)
@@ -1728,22 +4132,25 @@ class BlockEditorDialog(QDialog):
             j.setdefault("fields", {})
             j.setdefault("notes", "")
             fields = {}
+            sealed = j.get("sealed") if isinstance(j.get("sealed"), str) else self.block.get("sealed")
+            def normalize(v) -> str:
+                if value_is_current(v, self.win.fernet, sealed):
+                    return v
+                plain, ok = self.win._try_decrypt_once(v, sealed)
+                return encrypt_value(plain if ok else (str(v) if v is not None else ""), self.win.fernet)
             for k, v in (j.get("fields") or {}).items():
-                plain, ok = self.win._try_decrypt_once(v)
-                if ok:
-                    fields[k] = encrypt_value(plain, self.win.fernet)
-                else:
-                    fields[k] = encrypt_value(str(v) if v is not None else "", self.win.fernet)
+                fields[k] = normalize(v)
             j["fields"] = fields
-            n_plain, okn = self.win._try_decrypt_once(j.get("notes", ""))
-            j["notes"] = encrypt_value(n_plain if okn else str(j.get("notes","") or ""), self.win.fernet)
+            j["notes"] = normalize(j.get("notes", "") or "")
+            if isinstance(sealed, str):
+                j["sealed"] = sealed
             self.block.clear()
             self.block.update(j)
             self.win.on_block_changed(self.block, meta={"apply_json": True})
             self.rebuild_fields()
             try:
                 if hasattr(self, "notes_edit"):
-                    self.notes_edit.setPlainText(decrypt_value(self.block.get("notes",""), self.win.fernet))
+                    self.notes_edit.setPlainText(decrypt_value(self.block.get("notes",""), self.win.fernet, self.block.get("sealed")))
             except Exception:
                 pass
             self.refresh_json_view()
@@ -1752,7 +4159,7 @@ class BlockEditorDialog(QDialog):
             custom_error(self, "JSON", f"Ошибка: {e}")
 class MainWindow(QMainWindow):
     CLIPBOARD_SEC = 30
-    def __init__(self, master_pass: str):
+    def __init__(self, master_pass: str, fernet: Fernet | None = None):
         super().__init__()
         self.setWindowTitle(APP_TITLE)
         if os.path.exists(ICON_PATH):
@@ -1763,18 +4170,33 @@ class MainWindow(QMainWindow):
         except Exception:
             pass
         self.master = master_pass
+        if fernet is None:
+            fernet = unlock_master(master_pass) if os.path.exists(MASTER_FILE) else create_auth_file(master_pass)
+        self.fernet = fernet
         self.key_salt, self.auth_salt = self.ensure_salts()
-        self.fernet = make_fernet(self.master, self.key_salt,
-                                kdf_name=self.kdf_name, params=self.kdf_params)
+        self.store = BlockStore(RECORDS_DIR, CATALOG_FILE, self.fernet)
+        self.journal = VaultJournal(JOURNAL_FILE, self.fernet, {"tree": TREE_FILE, "meta": META_FILE})
+        self.attachments = AttachmentCatalog(ATTACH_CATALOG_FILE, ATTACH_DIR, self.fernet)
+        self._journal_worker = None
+        self._rekey_worker = None
+        self._index_worker = None
+        self._attach_worker = None
+        self._index_builder: IndexBuilder | None = None
+        self._index_build_worker = None
+        self.plain_cache = PlainCache(PLAIN_CACHE_ITEMS, PLAIN_CACHE_BYTES)
+        self.compact_journal()
         self.meta = self.load_meta()
         self.theme = default_theme()
         self.data_tree = self.load_tree()
-        self.blocks_data = self.load_blocks()
+        self.tree_index = TreePathIndex(self.data_tree)
+        self.blocks_data = SectionIndex(self.load_blocks())
         self._temp_share_dirs: set[str] = set()
         self.trash = self.load_trash()
         self.id_to_ref = {}
-        self.index = IndexDB(INDEX_DB, self.fernet, autosave=False)
-        self.rebuild_index()
+        self.index = open_index_db(INDEX_DB, self.fernet, autosave=False)
+        self.load_index()
+        self.attachments.load()
+        self.reconcile_attachments_async()
         self.current_path: List[str] = []
         self.show_data = False
         self.unlocked_sections: set[str] = set()
@@ -1798,15 +4220,15 @@ class MainWindow(QMainWindow):
         self.render_tree()
         self.schedule_render()
         self.init_tray()
-        self.ensure_verifier_current()
+        if self.fernet.rekey_pending:
+            QTimer.singleShot(1500, self.start_background_rekey)
         try:
             want = KDF_DEFAULTS
-            if (getattr(self, "kdf_name", "argon2id") == "argon2id" and
-                (self.kdf_params.get("t") != want["t"] or
-                self.kdf_params.get("m") != want["m"] or
-                self.kdf_params.get("p") != want["p"])):
+            if getattr(self, "kdf_name", "argon2id") == "argon2id" and kdf_below_floor(self.kdf_params):
                 if custom_question(self, "Параметры KDF",
-                                f"Обновить Argon2id до t={want['t']}, m={want['m']//1024} MiB, p={want['p']}?"):
+                                f"Текущие параметры Argon2id ниже минимально допустимых.\n"
+                                f"Обновить до t={want['t']}, m={want['m']//1024} MiB, p={want['p']}?\n"
+                                f"(Подобрать параметры под это устройство: «Настройки → Калибровка KDF».)"):
                     self.migrate_kdf_params(want, "argon2id")
         except Exception:
             pass
@@ -1833,75 +4255,31 @@ class MainWindow(QMainWindow):
         except Exception:
             pass
     def ensure_salts(self):
-        if os.path.exists(MASTER_FILE):
-            with open(MASTER_FILE, "r", encoding="utf-8") as f:
-                j = json.load(f)
-            key_salt = base64.b64decode(j["key_salt"])
-            auth_salt = base64.b64decode(j["auth_salt"])
-            self.kdf_name = j.get("kdf", "argon2id" if HAS_ARGON2 else "pbkdf2")
-            self.kdf_params = j.get("kdf_params") or KDF_DEFAULTS
-            if "kdf_params" not in j:
-                write_auth_file(key_salt, auth_salt, j.get("verifier", ""),
-                                self.kdf_name, self.kdf_params)
-            return key_salt, auth_salt
-        key_salt = rand_bytes(SALT_LEN)
-        auth_salt = rand_bytes(SALT_LEN)
-        self.kdf_name = "argon2id" if HAS_ARGON2 else "pbkdf2"
-        self.kdf_params = KDF_DEFAULTS
-        ver = hash_for_auth(self.master, auth_salt,
-                            prefer_argon=(self.kdf_name == "argon2id"),
-                            params=self.kdf_params)
-        write_auth_file(key_salt, auth_salt, ver, self.kdf_name, self.kdf_params)
+        with open(MASTER_FILE, "r", encoding="utf-8") as f:
+            j = json.load(f)
+        key_salt = base64.b64decode(j["key_salt"])
+        auth_salt = base64.b64decode(j["auth_salt"])
+        self.kdf_name = j.get("kdf", "argon2id" if HAS_ARGON2 else "pbkdf2")
+        self.kdf_params = j.get("kdf_params") or KDF_DEFAULTS
+        if "kdf_params" not in j:
+            j["kdf_params"] = self.kdf_params
+            atomic_write_json(MASTER_FILE, j)
         return key_salt, auth_salt
     def _locked_prefixes(self, path_list: list[str]) -> list[str]:
-        res: list[str] = []
-        cur: list[str] = []
-        for name in path_list:
-            cur.append(name)
-            n = self._node_by_path(cur)
-            if n and n.get("lock"):
-                res.append("/".join(cur))
-        return res
+        return self.tree_index.locked_prefixes(path_list)
     def ensure_chain_unlocked(self, path_list: list[str]) -> bool:
-        for i in range(1, len(path_list) + 1):
-            pref = path_list[:i]
-            key = "/".join(pref)
-            n = self._node_by_path(pref)
-            if n and n.get("lock") and key not in self.unlocked_sections:
-                if not self._verify_section_password(pref):
+        for key in self._locked_prefixes(path_list):
+            if key not in self.unlocked_sections:
+                if not self._verify_section_password(key.split("/")):
                     return False
         return True
-    def ensure_verifier_current(self):
-        try:
-            with open(MASTER_FILE, "r", encoding="utf-8") as f:
-                j = json.load(f)
-            key_salt = base64.b64decode(j["key_salt"])
-            auth_salt = base64.b64decode(j["auth_salt"])
-            kdf_name = j.get("kdf", getattr(self, "kdf_name", "argon2id" if HAS_ARGON2 else "pbkdf2"))
-            kdf_params = j.get("kdf_params") or getattr(self, "kdf_params", KDF_DEFAULTS)
-            calc = hash_for_auth(self.master, auth_salt,
-                                prefer_argon=(kdf_name == "argon2id"),
-                                params=kdf_params)
-            init_ver = hash_for_auth("init", auth_salt,
-                                    prefer_argon=(kdf_name == "argon2id"),
-                                    params=kdf_params)
-            if j.get("verifier") in (None, "", init_ver) or "kdf_params" not in j or j.get("kdf") != kdf_name:
-                write_auth_file(key_salt, auth_salt, calc, kdf_name, kdf_params)
-        except Exception:
-            pass
     def verify_master_prompt(self, caption="Подтверждение", label="Введите мастер-пароль для подтверждения:") -> bool:
         pwd = self.ask_password(caption, label)
         if pwd is None:
             return False
         try:
-            with open(MASTER_FILE, "r", encoding="utf-8") as f:
-                j = json.load(f)
-            auth_salt = base64.b64decode(j["auth_salt"])
-            kdf = j.get("kdf", "argon2id")
-            params = j.get("kdf_params") or KDF_DEFAULTS
-            calc = hash_for_auth(pwd, auth_salt, prefer_argon=(kdf=="argon2id"), params=params)
-            if calc == j.get("verifier"):
-                return True
+            unlock_master(pwd)
+            return True
         except Exception:
             pass
         custom_error(self, "Ошибка", "Неверный мастер-пароль.")
@@ -1924,102 +4302,298 @@ class MainWindow(QMainWindow):
     def save_meta(self):
         self.meta["theme"] = self.theme
         self.meta["version"] = CURRENT_VERSION
-        secure_write_json(META_FILE, self.meta, self.fernet)
+        self._journal_append({"t": "meta", "data": self.meta})
     def load_tree(self):
         obj = secure_read_json(TREE_FILE, self.fernet, [])
         return obj if isinstance(obj, list) else []
     def save_tree(self):
-        secure_write_json(TREE_FILE, self.data_tree, self.fernet)
+        self._journal_append({"t": "tree", "data": self.data_tree})
     def load_blocks(self):
-        blocks = secure_read_json(BLOCKS_FILE, self.fernet, {})
+        blocks = self.store.load(BLOCKS_FILE)
         if not isinstance(blocks, dict):
             blocks = {}
-        changed = False
+        if int(self.meta.get("vault_format", 1) or 1) >= VAULT_FORMAT:
+            return blocks
+        self.migrate_vault_format(blocks)
+        return blocks
+    def migrate_vault_format(self, blocks: dict) -> None:
+        def normalize(v, sealed) -> str:
+            if v is None:
+                return encrypt_value("", self.fernet)
+            if not isinstance(v, str):
+                v = str(v)
+            if value_envelope(v, sealed) is not None:
+                return v
+            return encrypt_value(v, self.fernet)
         for key, arr in list(blocks.items()):
             if not isinstance(arr, list):
                 continue
+            want_cat = key.split("/")[-1] if key else ""
             for b in arr:
-                if "id" not in b:
-                    b["id"] = secrets.token_hex(12); changed = True
-                b.setdefault("fields", {})
-                n0 = b.get("notes", "")
-                plain_notes, okn = self._try_decrypt_once(n0)
-                enc_notes = encrypt_value(plain_notes, self.fernet)
-                if n0 != enc_notes:
-                    b["notes"] = enc_notes
-                    changed = True
-                want_cat = key.split("/")[-1] if key else ""
-                if b.get("category") != want_cat:
-                    b["category"] = want_cat
-                    changed = True
-                for kf, vf in list(b["fields"].items()):
-                    plain, ok = self._try_decrypt_once(vf)
-                    if ok:
-                        enc = encrypt_value(plain, self.fernet)
-                        if enc != vf:
-                            b["fields"][kf] = enc
-                            changed = True
-                if "notes" not in b:
-                    b["notes"] = ""
-                    changed = True
-                else:
-                    nval = b.get("notes", "")
-                    if nval is None:
-                        b["notes"] = ""
-                        changed = True
-                    else:
-                        plain, ok = self._try_decrypt_once(nval)
-                        if ok:
-                            enc = encrypt_value(plain, self.fernet)
-                            if enc != nval:
-                                b["notes"] = enc
-                                changed = True
-                        else:
-                            if not (isinstance(nval, str) and nval.startswith("gAAAA")):
-                                enc = encrypt_value(str(nval), self.fernet)
-                                if enc != nval:
-                                    b["notes"] = enc
-                                    changed = True
-
-        if changed:
-            secure_write_json(BLOCKS_FILE, blocks, self.fernet)
-        return blocks
-    def save_blocks(self):
-        secure_write_json(BLOCKS_FILE, self.blocks_data, self.fernet)
+                if not isinstance(b.get("fields"), dict):
+                    b["fields"] = {}
+                if _sealed_blob_of(b, self.fernet) is None:
+                    for kf, vf in list(b["fields"].items()):
+                        b["fields"][kf] = normalize(vf, b.get("sealed"))
+                    b["notes"] = normalize(b.get("notes", ""), b.get("sealed"))
+                    seal_block(b, self.fernet)
+                b["category"] = want_cat
+        self.store.save(blocks)
+        self.meta["vault_format"] = VAULT_FORMAT
+        self._journal_append({"t": "meta", "data": self.meta})
+        mark_auth_vault_format(VAULT_FORMAT)
+        audit_write("vault_format_migrated", {"format": VAULT_FORMAT})
+    def save_blocks(self, changed: Iterable[str] | None = None):
+        entry = self.store.stage(self.blocks_data, changed)
+        if entry:
+            self._journal_append(entry)
+    def _journal_append(self, entry: dict) -> None:
+        self.journal.append(entry)
+        if self.journal.size() >= JOURNAL_COMPACT_BYTES:
+            self.compact_journal_async()
+    def compact_journal_async(self) -> None:
+        if self._journal_worker is not None and self._journal_worker.isRunning():
+            return
+        if not self.journal.rotate():
+            return
+        th = WorkerThread(lambda: self.journal.compact_rotated(self.store))
+        th.fail.connect(lambda msg: audit_write("journal_compact_failed", {"error": msg}))
+        self._journal_worker = th
+        th.start()
+    def compact_journal(self) -> None:
+        self.journal.compact(self.store)
+        try:
+            os.remove(BLOCKS_FILE + ".migrated")
+        except OSError:
+            pass
+    def write_checkpoint(self) -> None:
+        self.compact_journal()
+        self.meta["theme"] = self.theme
+        self.meta["version"] = CURRENT_VERSION
+        self.store.save(self.blocks_data)
+        secure_write_json(TREE_FILE, self.data_tree, self.fernet)
+        secure_write_json(META_FILE, self.meta, self.fernet)
     def load_trash(self):
         obj = secure_read_json(TRASH_FILE, self.fernet, [])
         return obj if isinstance(obj, list) else []
     def save_trash(self):
         secure_write_json(TRASH_FILE, self.trash, self.fernet)
-    def rebuild_index(self):
-        self.index.clear()
+    def rebuild_refs(self):
         self.id_to_ref.clear()
         for key, arr in self.blocks_data.items():
             for b in arr:
                 self.id_to_ref[b["id"]] = (key, b)
+    def load_index(self):
+        if self.index.generation and self.index.generation == self.store.generation():
+            self.rebuild_refs()
+            self.merge_index_async()
+            return
+        fps = self.store.fingerprints()
+        src = self.index.sources
+        gone = [bid for bid in self.index.ids() if bid not in fps]
+        stale = [bid for bid, fp in fps.items() if not fp or src.get(bid) != fp]
+        if not src or (len(stale) + len(gone)) * 2 > max(len(fps), 1):
+            self.rebuild_index()
+            return
+        self.rebuild_refs()
+        for bid in gone:
+            self.index.delete(bid)
+        self.index_blocks([self.id_to_ref[bid][1] for bid in stale if bid in self.id_to_ref])
+    def rebuild_index(self, keep_current: bool = False):
+        self.rebuild_refs()
+        blocks = [b for arr in self.blocks_data.values() for b in arr]
+        self.cancel_index_build()
+        if len(blocks) < INDEX_SYNC_BLOCKS:
+            self.index.clear()
+            for b in blocks:
+                self.update_index_for_block(b)
+            self.save_index()
+            return
+        if not keep_current:
+            self.index.clear()
+        fresh = open_index_db(INDEX_DB, self.fernet, autosave=False, load=False)
+        self.start_index_build(IndexBuilder(blocks, self.index_text, fresh))
+    def index_blocks(self, blocks: list[dict]):
+        if self._index_builder is not None:
+            self._index_builder.dirty.update(str(b["id"]) for b in blocks)
+            return
+        if len(blocks) < INDEX_SYNC_BLOCKS:
+            for b in blocks:
                 self.update_index_for_block(b)
+            self.save_index()
+            return
+        self.start_index_build(IndexBuilder(blocks, self.index_text))
+    def start_index_build(self, job: IndexBuilder):
+        self._index_builder = job
+        th = ProgressWorkerThread(job.run)
+        th.progress.connect(lambda stage, n, total: self.statusBar().showMessage(
+            f"Индексация для поиска: {job.percent()}% ({n}/{total})…", 5000))
+        th.ok.connect(lambda res: self._index_build_finished(job, res))
+        th.fail.connect(lambda msg: self._index_build_finished(job, None, msg))
+        self._index_build_worker = th
+        th.start()
+    def cancel_index_build(self):
+        job, th = self._index_builder, self._index_build_worker
+        self._index_builder = None
+        if job is not None:
+            job.cancelled.set()
+        if th is not None:
+            th.wait()
+    def _index_build_finished(self, job: IndexBuilder, res, error: str | None = None):
+        if job is not self._index_builder:
+            return
+        self._index_builder = None
+        if res is None:
+            audit_write("index_build_failed", {"error": error or "cancelled"})
+            self.statusBar().showMessage("Индексация прервана — выполните «Перестроить поисковый индекс».", 15000)
+            return
+        target = job.target if job.target is not None else self.index
+        for bid, txt, cols in job.results:
+            if bid not in job.dirty:
+                target.upsert(bid, txt, cols)
+        for bid in job.dirty:
+            ref = self.id_to_ref.get(bid)
+            if ref:
+                txt, cols = self.index_text(ref[1])
+                target.upsert(bid, txt, cols)
+            else:
+                target.delete(bid)
+        if target is not self.index:
+            target.fernet = self.fernet
+            old, self.index = self.index, target
+            try:
+                old.conn.close()
+            except Exception:
+                pass
+        self.save_index()
+        self.statusBar().showMessage("Поисковый индекс готов.", 5000)
+        if (self.search_input.text() or "").strip():
+            self.schedule_render()
+    def index_progress(self) -> int | None:
+        job = self._index_builder
+        return job.percent() if job is not None and job.target is not None else None
+    def search_block_ids(self, query: str) -> set[str]:
+        job = self._index_builder
+        if job is None or job.target is None or self.index.ids():
+            return set(self.index.search(query))
+        q = normalize_search_text((query or "").strip())
+        out: set[str] = set()
+        for bid, (_, b) in list(self.id_to_ref.items()):
+            try:
+                if q in normalize_search_text(self.index_text(b)[0]):
+                    out.add(bid)
+            except Exception:
+                pass
+        return out
+    def search_field_ids(self, query: str) -> set[str]:
+        job = self._index_builder
+        if job is None or job.target is None or self.index.ids():
+            return set(self.index.search_fields(query))
+        ql = (query or "").strip().lower()
+        return {
+            bid for bid, (_, b) in list(self.id_to_ref.items())
+            if any(ql in (k or "").lower() or ql in (self.value_plain(b, k, v) or "").lower()
+                   for k, v in (b.get("fields") or {}).items())
+        }
+    def rank_blocks(self, query: str, mode: str, blocks: list[dict], k: int) -> list[dict]:
+        by_id = {b.get("id"): b for b in blocks}
         try:
-            self.index.save()
+            ids = self.index.top_k(query, list(by_id), k, fields=mode != "Блоки")
         except Exception:
-            pass
+            return blocks[:k]
+        return [by_id[bid] for bid in ids if bid in by_id]
+    def rebuild_index_interactive(self):
+        if self._index_builder is not None and self._index_builder.target is not None:
+            custom_info(self, "Поисковый индекс", f"Индексация уже выполняется: {self._index_builder.percent()}%.")
+            return
+        if not custom_question(self, "Поисковый индекс",
+                               "Индекс обновляется автоматически. Полная перестройка расшифрует и заново "
+                               "проиндексирует все блоки — на большом хранилище это займёт время.\n\nПродолжить?"):
+            return
+        QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
+        try:
+            self.rebuild_index(keep_current=True)
+        finally:
+            QApplication.restoreOverrideCursor()
+        audit_write("index_rebuilt", {"blocks": len(self.id_to_ref)})
+        self.schedule_render()
+        if self._index_builder is None:
+            custom_info(self, "Поисковый индекс", f"Индекс перестроен: {len(self.id_to_ref)} блоков.")
+        else:
+            self.statusBar().showMessage("Индексация запущена в фоне, поиск пока работает по старому индексу.", 8000)
+    def save_index(self, full: bool = False):
+        if self._index_builder is not None and self._index_builder.target is not None:
+            return
+        try:
+            self.index.save(self.store.generation(), self.store.fingerprints(), full=full)
+        except Exception:
+            return
+        self.merge_index_async()
+    def merge_index_async(self):
+        if not self.index.needs_merge() or self._index_builder is not None:
+            return
+        if self._index_worker is not None and self._index_worker.isRunning():
+            return
+        th = WorkerThread(self.index.merge)
+        th.fail.connect(lambda msg: audit_write("index_merge_failed", {"error": msg}))
+        self._index_worker = th
+        th.start()
+    def reconcile_attachments_async(self):
+        if self._attach_worker is not None and self._attach_worker.isRunning():
+            return
+        th = WorkerThread(self.attachments.reconcile)
+        def done(res):
+            if any(res):
+                audit_write("attachments_reconciled", {"added": res[0], "removed": res[1]})
+                self.schedule_render()
+        th.ok.connect(done)
+        th.fail.connect(lambda msg: audit_write("attachments_reconcile_failed", {"error": msg}))
+        self._attach_worker = th
+        th.start()
     def update_index_for_block(self, block):
+        txt, cols = self.index_text(block)
+        self.index.upsert(block["id"], txt, cols)
+        if self._index_builder is not None:
+            self._index_builder.dirty.add(str(block["id"]))
+    def index_text(self, block) -> tuple[str, dict]:
         parts = [block.get("title", ""), block.get("category", "")]
-        for k, v in (block.get("fields", {}) or {}).items():
-            parts.append(k); parts.append(decrypt_value(v, self.fernet))
-        notes_plain = decrypt_value(block.get("notes", ""), self.fernet)
+        fields_plain, notes_plain = block_plain(block, self.fernet)
+        field_parts = []
+        for k, v in fields_plain.items():
+            field_parts.append(k); field_parts.append(v)
+        parts.extend(field_parts)
         if notes_plain:
             parts.append(notes_plain)
         txt = "\n".join(parts)
-        self.index.upsert(block["id"], txt)
+        cols = {"title": parts[0], "category": parts[1], "fields": "\n".join(field_parts), "notes": notes_plain or "",
+                "pairs": [[k, v] for k, v in fields_plain.items()], "updated": block.get("updated") or 0}
+        return txt, cols
     def remove_index_for_block(self, block):
         self.index.delete(block["id"])
-    def _try_decrypt_once(self, v: str) -> tuple[str, bool]:
+        if self._index_builder is not None:
+            self._index_builder.dirty.add(str(block["id"]))
+    def value_plain(self, block: dict, field: str | None, val) -> str:
+        sealed = block.get("sealed")
+        if not isinstance(val, str) or not val:
+            return decrypt_value(val, self.fernet, sealed)
+        key = (block.get("id", ""), field, val, sealed)
+        plain = self.plain_cache.get(key)
+        if plain is None:
+            plain = decrypt_value(val, self.fernet, sealed)
+            self.plain_cache.put(key, plain, len(plain))
+        return plain
+    def wipe_plain_cache(self) -> None:
+        self.plain_cache.clear()
+        _sealed_plain.clear()
+    def _try_decrypt_once(self, v: str, sealed: str | None = None) -> tuple[str, bool]:
         if v is None:
             return "", False
         if not isinstance(v, str):
             v = str(v)
+        if value_envelope(v, sealed) is None:
+            return v, False
         try:
-            return self.fernet.decrypt(v.encode("utf-8")).decode("utf-8"), True
+            return open_value(v, self.fernet, sealed), True
         except Exception:
             return v, False
     def build_menu(self):
@@ -2074,9 +4648,21 @@ class MainWindow(QMainWindow):
         a_tools.triggered.connect(self.open_password_tools)
         sett.addAction(a_tools)
         a_pwd = QAction("🗝️ Смена мастер‑пароля", self)
-        a_pwd.setToolTip("Пере‑шифровка всех данных новым мастер‑паролем")
+        a_pwd.setToolTip("Перешифровка ключа хранилища новым мастер‑паролем")
         a_pwd.triggered.connect(self.change_master_password)
         sett.addAction(a_pwd)
+        a_kdf = QAction("⏱️ Калибровка KDF", self)
+        a_kdf.setToolTip("Подобрать параметры Argon2id под это устройство")
+        a_kdf.triggered.connect(self.calibrate_kdf)
+        sett.addAction(a_kdf)
+        a_rekey = QAction("🔁 Полная перешифровка", self)
+        a_rekey.setToolTip("Создать новый ключ хранилища и перешифровать все данные и вложения")
+        a_rekey.triggered.connect(self.full_rekey)
+        sett.addAction(a_rekey)
+        a_reindex = QAction("🔎 Перестроить поисковый индекс", self)
+        a_reindex.setToolTip("Заново проиндексировать все блоки (обычно не требуется)")
+        a_reindex.triggered.connect(self.rebuild_index_interactive)
+        sett.addAction(a_reindex)
         sett.addSeparator()
         a_sf = QAction("🧠 Умные папки", self)
         a_sf.setToolTip("Управление умными папками")
@@ -2157,8 +4743,8 @@ class MainWindow(QMainWindow):
                 raise
     def import_paranoid_lpx1(self) -> None:
         path, _ = QFileDialog.getOpenFileName(
-            self, "Импорт (LPX1, параноидальный)", "",
-            "LPX1 (*.lpx);;Все файлы (*.*)"
+            self, "Импорт (LPX2/LPX1, параноидальный)", "",
+            "LPX (*.lpx);;Все файлы (*.*)"
         )
         if not path:
             return
@@ -2178,6 +4764,7 @@ class MainWindow(QMainWindow):
                 custom_info(self, "Импорт", "В файле нет данных."); 
                 return
             imported = 0
+            added_blocks: list[dict] = []
             created_paths: set[str] = set()
             for it in items:
                 try:
@@ -2205,7 +4792,7 @@ class MainWindow(QMainWindow):
                     }
                     self.blocks_data.setdefault(key, []).append(block)
                     self.id_to_ref[block["id"]] = (key, block)
-                    self.update_index_for_block(block)
+                    added_blocks.append(block)
                     imported += 1
                 except InvalidToken:
                     raise RuntimeError(
@@ -2216,7 +4803,8 @@ class MainWindow(QMainWindow):
             if created_paths:
                 self.save_tree()
                 self.render_tree()
-            self.save_blocks()
+            self.save_blocks([b["id"] for b in added_blocks])
+            self.index_blocks(added_blocks)
             self.schedule_render()
             custom_info(self, "Импорт", f"Готово. Импортировано блоков: {imported}.")
             audit_write("import_paranoid_lpx1", {
@@ -2225,7 +4813,7 @@ class MainWindow(QMainWindow):
                 "sections_touched": len(created_paths)
             })
         except InvalidToken:
-            custom_error(self, "Импорт", "Неверный пароль к LPX1 файлу.")
+            custom_error(self, "Импорт", "Неверный пароль к LPX файлу.")
         except RuntimeError as e:
             custom_error(self, "Импорт", str(e))
         except Exception as e:
@@ -2267,15 +4855,7 @@ class MainWindow(QMainWindow):
                         border-radius: {int(r*0.7)}px;
                     }}
 
-                    QFrame#BlockCard {{
-                        background: {t['card_bg']};
-                        border: 1px solid rgba(17, 24, 39, 0.06);
-                        border-radius: 14px;
-                    }}
-                    QFrame#BlockCard:hover {{
-                        border: 1px solid rgba(17, 24, 39, 0.12);
-                        background: #FFFFFF;
-                    }}
+                    QListView#cardView {{ background: {t['kanban_bg']}; border: none; }}
 
                 """)
             if hasattr(self, "btn_add_section"):
@@ -2301,6 +4881,7 @@ class MainWindow(QMainWindow):
         left = QWidget(); left.setObjectName("leftPane")
         ll = QVBoxLayout(left); ll.setContentsMargins(6,6,6,6)
         self.tree = SectionTree(self)
+        self.tree.count_for = lambda key: self.blocks_data.subtree_count(key)
         hdr = self.tree.header()
         hdr.setStretchLastSection(False)
         hdr.setSectionResizeMode(0, QHeaderView.ResizeMode.Interactive)
@@ -2358,6 +4939,33 @@ class MainWindow(QMainWindow):
         right.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Preferred)
         self.kanban_area.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         rl.addWidget(self.kanban_area)
+        self.board_info = QLabel(); self.board_info.setVisible(False)
+        rl.insertWidget(rl.indexOf(self.kanban_area), self.board_info)
+        self.card_view = QListView(); self.card_view.setObjectName("cardView")
+        card_delegate = BlockCardDelegate(self, self.card_view)
+        self.card_model = BlockCardModel(self, card_delegate.card_size)
+        self.card_view.setModel(self.card_model)
+        self.card_view.setItemDelegate(card_delegate)
+        self.card_view.setFlow(QListView.Flow.LeftToRight)
+        self.card_view.setWrapping(True)
+        self.card_view.setResizeMode(QListView.ResizeMode.Adjust)
+        self.card_view.setLayoutMode(QListView.LayoutMode.Batched)
+        self.card_view.setBatchSize(2000)
+        self.card_view.setSpacing(7)
+        self.card_view.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.card_view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.card_view.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.card_view.setDragEnabled(True)
+        self.card_view.setDragDropMode(QAbstractItemView.DragDropMode.DragOnly)
+        self.card_view.setDefaultDropAction(Qt.DropAction.MoveAction)
+        self.card_view.setMouseTracking(True)
+        self.card_view.doubleClicked.connect(lambda ix: self.card_action(self.card_model.block(ix.row()), "open"))
+        self.card_view.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
+        self.card_view.setVisible(False)
+        self._card_vpos = 0
+        self.card_view.verticalScrollBar().rangeChanged.connect(self._on_card_range)
+        self.card_view.verticalScrollBar().actionTriggered.connect(lambda _a: setattr(self, "_card_vpos", 0))
+        rl.addWidget(self.card_view)
         self.splitter.addWidget(right)
         self.splitter.setSizes([330, 1050])
         self.splitter.setChildrenCollapsible(False)
@@ -2452,11 +5060,7 @@ class MainWindow(QMainWindow):
         self.render_dashboard()
     def current_key(self): return "/".join(self.current_path)
     def get_section_color(self, path):
-        node = None; nodes = self.data_tree
-        for name in path:
-            node = next((n for n in nodes if n["name"] == name), None)
-            if node: nodes = node.get("children", [])
-            else: break
+        node = self.tree_index.node(path)
         return node.get("color", self.theme.get("tag_bg", "#f4e4ae")) if node else self.theme.get("tag_bg", "#f4e4ae")
     def get_all_paths(self):
         out=[]
@@ -2471,31 +5075,25 @@ class MainWindow(QMainWindow):
         if not section_path: return
         parts = section_path.split("/")
         nodes = self.data_tree
-        for name in parts:
-            found = next((n for n in nodes if n["name"] == name), None)
+        for i, name in enumerate(parts):
+            found = self.tree_index.node(parts[:i + 1])
             if not found:
                 found = {"name": name, "children": [], "color": self.theme.get("tag_bg","#f4e4ae")}
                 nodes.append(found)
+                self.tree_index.reindex(parts[:i + 1])
             nodes = found["children"]
     def find_node(self, path_list):
-        nodes = self.data_tree; parent = None
-        for name in path_list:
-            parent = next((n for n in nodes if n["name"] == name), None)
-            if not parent: return None, None
-            nodes = parent.get("children", [])
-        return parent, nodes
+        if not path_list: return None, self.data_tree
+        entry = self.tree_index.get(path_list)
+        if entry is None: return None, None
+        return entry.node, entry.node.get("children", [])
     def find_parent_and_index(self, path_list):
         if not path_list: return None, None, -1
-        nodes = self.data_tree
-        parent = None
-        for i, name in enumerate(path_list):
-            prev_nodes = nodes
-            node = next((n for n in nodes if n["name"] == name), None)
-            if node is None: return None, None, -1
-            if i == len(path_list)-1:
-                return prev_nodes, node, prev_nodes.index(node)
-            nodes = node.get("children", [])
-        return None, None, -1
+        entry = self.tree_index.get(path_list)
+        if entry is None: return None, None, -1
+        siblings = self.tree_index.siblings(entry)
+        idx = next((i for i, n in enumerate(siblings) if n is entry.node), -1)
+        return (siblings, entry.node, idx) if idx >= 0 else (None, None, -1)
     from typing import List, Optional, Tuple
     def _item_path(self, item: Optional[QTreeWidgetItem]) -> List[str]:
         path: List[str] = []
@@ -2697,11 +5295,7 @@ class MainWindow(QMainWindow):
             if not self.ensure_section_unlocked(path_list):
                 return ""
             key = "/".join(path_list)
-            texts = []
-            for k, arr in self.blocks_data.items():
-                if k == key or k.startswith(key + "/"):
-                    for b in arr:
-                        texts.append(self._format_block_share_text(b, reveal=True))
+            texts = [self._format_block_share_text(b, reveal=True) for b in self.blocks_data.subtree_blocks(key)]
             return "\n\n".join(texts) if texts else "(пусто)"
         a_tg = QAction("Telegram", self)
         if os.path.exists(p_tg): a_tg.setIcon(QIcon(p_tg))
@@ -2723,8 +5317,7 @@ class MainWindow(QMainWindow):
             path.insert(0, cur.text(0)); cur = cur.parent()
         return path
     def _node_by_path(self, path_list: list[str]) -> dict | None:
-        node, _ = self.find_node(path_list)
-        return node
+        return self.tree_index.node(path_list)
     def is_path_locked(self, path_list: list[str]) -> bool:
         n = self._node_by_path(path_list)
         return bool(n and n.get("lock"))
@@ -2745,6 +5338,7 @@ class MainWindow(QMainWindow):
                 "verifier": ver,
                 "kdf": "argon2id" if HAS_ARGON2 else "pbkdf2"
             }
+            self.tree_index.reindex(path_list)
             self.save_tree(); self.render_tree()
             custom_info(self, "Раздел", "Пароль установлен.")
     def clear_section_password(self, path_list: list[str]):
@@ -2755,6 +5349,7 @@ class MainWindow(QMainWindow):
         if not self._verify_section_password(path_list):
             return
         n.pop("lock", None)
+        self.tree_index.reindex(path_list)
         self.unlocked_sections.discard("/".join(path_list))
         self.save_tree(); self.render_tree()
         custom_info(self, "Раздел", "Пароль снят.")
@@ -2894,11 +5489,7 @@ class MainWindow(QMainWindow):
         if not self.ensure_section_unlocked(path_list):
             return
         key = "/".join(path_list)
-        texts = []
-        for k, arr in self.blocks_data.items():
-            if k == key or k.startswith(key + "/"):
-                for b in arr:
-                    texts.append(self._format_block_share_text(b))
+        texts = [self._format_block_share_text(b) for b in self.blocks_data.subtree_blocks(key)]
         payload = "\n\n".join(texts) if texts else "(пусто)"
         m = QMenu(self)
         ico_tg   = QIcon(resource_path("icons/telegram.png")) if os.path.exists(resource_path("icons/telegram.png")) else QIcon()
@@ -2920,13 +5511,11 @@ class MainWindow(QMainWindow):
             items.append({
                 "k": enc(k),
                 "t": enc(b.get("title","")),
-                "f": [[enc(name), enc(decrypt_value(val, self.fernet))] for name, val in (b.get("fields") or {}).items()]
+                "f": [[enc(name), enc(decrypt_value(val, self.fernet, b.get("sealed")))] for name, val in (b.get("fields") or {}).items()]
             })
         if scope_key:
-            pref = scope_key + "/" if scope_key else ""
-            for k, arr in self.blocks_data.items():
-                if k == scope_key or k.startswith(pref):
-                    for b in arr: push(k, b)
+            for k, arr in self.blocks_data.subtree_items(scope_key):
+                for b in arr: push(k, b)
         else:
             for k, arr in self.blocks_data.items():
                 for b in arr: push(k, b)
@@ -2934,7 +5523,7 @@ class MainWindow(QMainWindow):
         return json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
 
     def export_paranoid_lpx1(self):
-        pwd = self.ask_password("Экспорт (LPX1)", "Задайте пароль на экспорт:")
+        pwd = self.ask_password("Экспорт (LPX2)", "Задайте пароль на экспорт:")
         if pwd is None or len(pwd) < 4:
             custom_warning(self, "Экспорт", "Короткий пароль.")
             return
@@ -2942,8 +5531,8 @@ class MainWindow(QMainWindow):
         data = _lpx_encrypt_bytes(raw, pwd)
 
         path, _ = QFileDialog.getSaveFileName(
-            self, "Сохранить экспорт (LPX1, все разделы)",
-            "export_all.lpx", "LPX1 (*.lpx)"
+            self, "Сохранить экспорт (LPX2, все разделы)",
+            "export_all.lpx", "LPX2 (*.lpx)"
         )
         if not path:
             return
@@ -2955,24 +5544,29 @@ class MainWindow(QMainWindow):
         except Exception as e:
             custom_error(self, "Экспорт", f"Ошибка: {e}")
     def backup_data_lpx1(self):
-        pwd = self.ask_password("Бэкап (LPX1)", "Задайте пароль для шифрованного бэкапа:")
+        pwd = self.ask_password("Бэкап (LPX2)", "Задайте пароль для шифрованного бэкапа:")
         if pwd is None or len(pwd) < 4:
             custom_warning(self, "Бэкап", "Пароль не задан или короткий.")
             return
-        path, _ = QFileDialog.getSaveFileName(self, "Сохранить бэкап (LPX1)", "data_backup.lpx", "LPX1 (*.lpx)")
+        path, _ = QFileDialog.getSaveFileName(self, "Сохранить бэкап (LPX2)", "data_backup.lpx", "LPX2 (*.lpx)")
         if not path:
             return
+        self.compact_journal()
+        att_files = self.attachments.files()
         def _make_zip() -> bytes:
             buf = io.BytesIO()
             with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
-                for fn in (TREE_FILE, BLOCKS_FILE, TRASH_FILE, META_FILE, MASTER_FILE, INDEX_DB):
+                for fn in (TREE_FILE, BLOCKS_FILE, CATALOG_FILE, TRASH_FILE, META_FILE, MASTER_FILE, INDEX_DB, ATTACH_CATALOG_FILE):
                     if os.path.exists(fn):
                         z.write(fn, os.path.basename(fn))
-                for root, _, files in os.walk(ATTACH_DIR):
+                for root, _, files in os.walk(RECORDS_DIR):
                     for f in files:
                         fp = os.path.join(root, f)
                         arc = os.path.relpath(fp, DATA_DIR)
                         z.write(fp, arc)
+                for fp in att_files:
+                    if os.path.exists(fp):
+                        z.write(fp, os.path.relpath(fp, DATA_DIR))
             return buf.getvalue()
         def work():
             raw = _make_zip()
@@ -2985,16 +5579,20 @@ class MainWindow(QMainWindow):
             audit_write("backup_lpx1", {"file": p})
         run_long_task(self, "Бэкап", work, done)
     def _make_full_backup_zip_bytes(self) -> bytes:
+        self.compact_journal()
         buf = io.BytesIO()
         with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as z:
-            for fn in (TREE_FILE, BLOCKS_FILE, TRASH_FILE, META_FILE, MASTER_FILE, INDEX_DB):
+            for fn in (TREE_FILE, BLOCKS_FILE, CATALOG_FILE, TRASH_FILE, META_FILE, MASTER_FILE, INDEX_DB, ATTACH_CATALOG_FILE):
                 if os.path.exists(fn):
                     z.write(fn, os.path.basename(fn))
-            for root, _, files in os.walk(ATTACH_DIR):
+            for root, _, files in os.walk(RECORDS_DIR):
                 for f in files:
                     fp = os.path.join(root, f)
                     arc = os.path.relpath(fp, DATA_DIR)
                     z.write(fp, arc)
+            for fp in self.attachments.files():
+                if os.path.exists(fp):
+                    z.write(fp, os.path.relpath(fp, DATA_DIR))
         return buf.getvalue()
     def create_item(self):
         name, ok = QInputDialog.getText(self, "Новый раздел", "Название раздела:")
@@ -3002,6 +5600,7 @@ class MainWindow(QMainWindow):
         clean = name.replace("\ufeff", "").strip()
         if not clean: clean = "(без названия)"
         self.data_tree.append({"name": clean, "children": [], "color": self.theme.get("tag_bg", "#f4e4ae")})
+        self.tree_index.reindex([clean])
         self.save_tree(); self.render_tree(); self.schedule_render()
         audit_write("create_section", {"name": clean})
     def create_subsection_by_sel(self):
@@ -3032,6 +5631,7 @@ class MainWindow(QMainWindow):
             path.insert(0, cur.text(0)); cur = cur.parent()
         children = rec(self.data_tree, path)
         children.append({"name": clean, "children": [], "color": self.theme.get("tag_bg", "#f4e4ae")})
+        self.tree_index.reindex(path + [clean])
         self.save_tree(); self.render_tree(); self.schedule_render()
         audit_write("create_subsection", {"parent": "/".join(path), "name": clean})
     def rename_item(self, item):
@@ -3048,10 +5648,11 @@ class MainWindow(QMainWindow):
         parent_list, node, idx = self.find_parent_and_index(old_path)
         if node is None: return
         node["name"] = clean
+        self.tree_index.drop(old_path)
+        self.tree_index.reindex(old_path[:-1] + [clean])
         old_prefix = "/".join(old_path)
         new_prefix = "/".join(old_path[:-1] + [clean])
-        self._rename_blocks_prefix(old_prefix, new_prefix)
-        self.save_tree(); self.save_blocks()
+        self.save_section_move(*self._rename_blocks_prefix(old_prefix, new_prefix))
         self.render_tree(); self.schedule_render()
         audit_write("rename_section", {"from": old_prefix, "to": new_prefix})
     def delete_item_by_sel(self):
@@ -3075,7 +5676,7 @@ class MainWindow(QMainWindow):
                         nodes.pop(i); return True
                     return remove_from(n.get("children", []), names[1:])
             return False
-        affected_keys = [k for k in list(self.blocks_data.keys()) if k == key_prefix or k.startswith(key_prefix + "/")]
+        affected_keys = self.blocks_data.subtree_keys(key_prefix)
         for k in affected_keys:
             for b in self.blocks_data.get(k, []):
                 self.trash.append({"id": b["id"], "from_key": k, "block": b, "ts": datetime.utcnow().isoformat()+"Z"})
@@ -3083,7 +5684,8 @@ class MainWindow(QMainWindow):
             del self.blocks_data[k]
         self.save_trash()
         remove_from(self.data_tree, path)
-        self.save_tree(); self.save_blocks()
+        self.tree_index.drop(path)
+        self.save_tree(); self.save_blocks(())
         self.render_tree(); self.schedule_render()
         audit_write("delete_section", {"path": key_prefix, "moved_blocks": len(affected_keys)})
     def set_section_color(self, item):
@@ -3142,43 +5744,45 @@ class MainWindow(QMainWindow):
         children.append(node)
         old_prefix = "/".join(path_list)
         new_prefix = (new_parent_path + "/" if new_parent_path else "") + path_list[-1]
-        self._rename_blocks_prefix(old_prefix, new_prefix)
-        self.save_tree()
-        self.save_blocks()
+        self.tree_index.drop(path_list)
+        self.tree_index.reindex(new_prefix.split("/"))
+        self.save_section_move(*self._rename_blocks_prefix(old_prefix, new_prefix))
         self.render_tree()
         self.schedule_render()
         audit_write("move_section", {"from": old_prefix, "to": new_prefix})
-    def _rename_blocks_prefix(self, old_prefix, new_prefix):
-        updates = {}
-        for k in list(self.blocks_data.keys()):
-            if k == old_prefix or k.startswith(old_prefix + "/"):
-                suffix = k[len(old_prefix):]
-                if suffix.startswith("/"): suffix = suffix[1:]
-                newk = new_prefix + (("/" + suffix) if suffix else "")
-                updates[k] = newk
-        for k, nk in updates.items():
-            self.blocks_data.setdefault(nk, []).extend(self.blocks_data[k])
-            del self.blocks_data[k]
-        for k, arr in self.blocks_data.items():
-            for b in arr:
-                b["category"] = k.split("/")[-1] if k else b.get("category","")
+    def _rename_blocks_prefix(self, old_prefix, new_prefix) -> tuple[dict[str, str], list[str]]:
+        moves = self.blocks_data.move_subtree(old_prefix, new_prefix)
+        changed: list[str] = []
+        for k in dict.fromkeys(moves.values()):
+            for b in self.blocks_data.get(k, []):
+                old_cat = b.get("category", "")
+                b["category"] = k.split("/")[-1] if k else old_cat
                 self.id_to_ref[b["id"]] = (k, b)
-                self.update_index_for_block(b)
+                if b["category"] == old_cat:
+                    continue
+                changed.append(b["id"])
+                if not self.index.recategorize(b["id"], b.get("title", ""), old_cat, b["category"]):
+                    self.update_index_for_block(b)
+                elif self._index_builder is not None:
+                    self._index_builder.dirty.add(str(b["id"]))
+        return moves, changed
+    def save_section_move(self, moves: dict[str, str], changed: list[str]):
+        entry = self.store.stage_move(self.blocks_data, moves, changed)
+        entry["files"] = {"tree": self.data_tree}
+        self._journal_append(entry)
     def render_dashboard(self):
         if getattr(self, "_rendering", False):
             return
         self._rendering = True
         _vpos = 0
-        _hpos = 0
 
         try:
             try:
-                if hasattr(self, "kanban_area") and self.kanban_area is not None:
-                    _vpos = self.kanban_area.verticalScrollBar().value()
-                    _hpos = self.kanban_area.horizontalScrollBar().value()
+                _vpos = self.card_view.verticalScrollBar().value()
             except Exception:
                 _vpos = 0
-                _hpos = 0
+            self.card_model.set_blocks([])
+            self.board_info.setVisible(False)
             while True:
                 item = self.kanban_layout.takeAt(0)
                 if not item:
@@ -3220,52 +5824,27 @@ class MainWindow(QMainWindow):
                 key = self.current_key()
                 blocks: list[dict] = []
                 if key:
-                    pref = key + "/"
-                    for k in self.blocks_data.keys():
-                        if k == key or k.startswith(pref):
-                            blocks.extend(self.blocks_data.get(k, []))
+                    blocks = self.blocks_data.subtree_blocks(key)
                 search = (self.search_input.text() or "").strip()
                 mode = self.search_mode
                 if search:
-                    ids = set(self.index.search(search))
-                    if mode == "Блоки":
-                        blocks = [b for b in blocks if b.get("id") in ids]
-                    else:
-                        ql = search.lower()
-                        blocks = [
-                            b for b in blocks
-                            if any(
-                                ql in (k or "").lower()
-                                or ql in (decrypt_value(v, self.fernet) or "").lower()
-                                for k, v in (b.get("fields") or {}).items()
-                            )
-                        ]
+                    ids = self.search_block_ids(search) if mode == "Блоки" else self.search_field_ids(search)
+                    blocks = [b for b in blocks if b.get("id") in ids]
+                    pct = self.index_progress()
+                    if pct is not None:
+                        self.board_info.setText(f"Идёт индексация: {pct}%… Поиск может работать медленнее.")
+                        self.board_info.setVisible(True)
                 if self.btn_att_only.isChecked():
-                    blocks = [b for b in blocks if attachments_count(b.get("id", "")) > 0]
+                    blocks = [b for b in blocks if self.attachments.count(b.get("id", "")) > 0]
                 if not blocks:
                     self.kanban_layout.addWidget(QLabel("Нет данных"))
                     return
-                total = len(blocks)
-                truncated = False
-                if total > MAX_CARDS:
-                    blocks = blocks[:MAX_CARDS]
-                    truncated = True
-                for block in blocks:
-                    ref = self.id_to_ref.get(block.get("id", ""))
-                    blk_key = ref[0] if ref else key
-                    blk_path = [p for p in (blk_key or "").split("/") if p]
-                    blk_color = self.get_section_color(blk_path)
-                    self.kanban_layout.addWidget(self.make_block_card(block, blk_color))
-                if truncated:
-                    info = QLabel(f"Показаны первые {MAX_CARDS} из {total}. Уточните поиск.")
-                    self.kanban_layout.addWidget(info)
+                if search:
+                    blocks = self.rank_blocks(search, mode, blocks, len(blocks))
+                self.card_model.set_blocks(blocks, key)
             finally:
                 self.kanban_content.setUpdatesEnabled(True)
-                try:
-                    self.kanban_area.verticalScrollBar().setValue(_vpos)
-                    self.kanban_area.horizontalScrollBar().setValue(_hpos)
-                except Exception:
-                    pass
+                self.show_cards(_vpos)
         finally:
             self._rendering = False
     def render_smart_folder(self):
@@ -3278,48 +5857,71 @@ class MainWindow(QMainWindow):
         scope = (sf.get("scope") or "").strip()
         mode  = sf.get("mode", "Поля")
         if scope and scope != "ALL":
-            keys = [k for k in self.blocks_data.keys() if k == scope or k.startswith(scope + "/")]
+            keys = self.blocks_data.subtree_keys(scope)
         else:
             keys = list(self.blocks_data.keys())
         blocks: list[dict] = []
         if query:
-            ids = set(self.index.search(query))
-            ql = query.lower()
+            ids = self.search_block_ids(query) if mode == "Блоки" else self.search_field_ids(query)
             for k in keys:
-                for b in self.blocks_data.get(k, []):
-                    if mode == "Блоки":
-                        if b.get("id") in ids:
-                            blocks.append(b)
-                    else:
-                        fs = b.get("fields") or {}
-                        if any(
-                            (ql in (name or "").lower()) or (ql in (decrypt_value(val, self.fernet) or "").lower())
-                            for name, val in fs.items()
-                        ):
-                            blocks.append(b)
+                blocks.extend(b for b in self.blocks_data.get(k, []) if b.get("id") in ids)
         else:
             for k in keys:
                 blocks.extend(self.blocks_data.get(k, []))
 
         if self.btn_att_only.isChecked():
-            blocks = [b for b in blocks if attachments_count(b.get("id", "")) > 0]
+            blocks = [b for b in blocks if self.attachments.count(b.get("id", "")) > 0]
 
         if not blocks:
             self.kanban_layout.addWidget(QLabel("Нет результатов"))
             return
-        total = len(blocks)
-        truncated = False
-        if total > MAX_CARDS:
-            blocks = blocks[:MAX_CARDS]
-            truncated = True
-        for b in blocks:
-            ref = self.id_to_ref.get(b.get("id", ""))
-            blk_key = ref[0] if ref else ""
-            blk_path = [p for p in (blk_key or "").split("/") if p]
-            blk_color = self.get_section_color(blk_path)
-            self.kanban_layout.addWidget(self.make_block_card(b, blk_color))
-        if truncated:
-            self.kanban_layout.addWidget(QLabel(f"Показаны первые {MAX_CARDS} из {total}. Уточните поиск."))
+        if query:
+            blocks = self.rank_blocks(query, mode, blocks, len(blocks))
+        self.card_model.set_blocks(blocks)
+    def show_cards(self, vpos: int = 0):
+        has_cards = self.card_model.rowCount() > 0
+        self.kanban_area.setVisible(not has_cards)
+        self.card_view.setVisible(has_cards)
+        self._card_vpos = vpos if has_cards else 0
+    def _on_card_range(self, _min: int, maximum: int):
+        if self._card_vpos and maximum >= self._card_vpos:
+            self.card_view.verticalScrollBar().setValue(self._card_vpos)
+            self._card_vpos = 0
+    def card_action(self, block: dict | None, action: str, arg=None):
+        if not block:
+            return
+        if action == "share":
+            self.share_block(block)
+        elif action == "qr":
+            self.show_block_qr(block)
+        elif action == "unlock":
+            ref = self.id_to_ref.get(block.get("id", ""))
+            path_list = [p for p in (ref[0] if ref else self.card_model.fallback_key).split("/") if p]
+            if self.ensure_section_unlocked(path_list):
+                self.schedule_render()
+        elif action == "go":
+            QDesktopServices.openUrl(to_qurl_from_text(arg))
+        elif action == "copy":
+            ref = self.id_to_ref.get(block.get("id", ""))
+            path_list = [p for p in (ref[0] if ref else self.card_model.fallback_key).split("/") if p]
+            if not self.ensure_chain_unlocked(path_list):
+                return
+            try:
+                plain = self.value_plain(block, arg, (block.get("fields") or {}).get(arg, ""))
+            except Exception:
+                plain = ""
+            QApplication.clipboard().setText(str(plain))
+            self.clip_timer.start(self.CLIPBOARD_SEC * 1000)
+        elif action == "open":
+            self.safe_open_block_editor(block)
+        elif action == "move":
+            self.move_block_dialog(block)
+        elif action == "files":
+            self.open_attachments(block)
+        elif action == "notes":
+            self.open_notes(block)
+        elif action == "delete":
+            self.delete_block_soft(block)
     def open_attachments(self, block):
         ref = self.id_to_ref.get(block.get("id","")); key = ref[0] if ref else ""
         path_list = [p for p in key.split("/") if p]
@@ -3334,9 +5936,9 @@ class MainWindow(QMainWindow):
         category = block.get("category", "") or ""
         lines = [f"{title} ({category})" if category else title]
         for k, v in (block.get("fields") or {}).items():
-            plain = decrypt_value(v, self.fernet)
+            plain = self.value_plain(block, k, v)
             lines.append(f"{k}: {plain}")
-        notes_plain = decrypt_value(block.get("notes", ""), self.fernet)
+        notes_plain = self.value_plain(block, None, block.get("notes", ""))
         if (notes_plain or "").strip():
             lines.append("Заметки:")
             lines.append(notes_plain)
@@ -3351,178 +5953,11 @@ class MainWindow(QMainWindow):
             BlockEditorDialog(self, block, open_tab="notes").exec()
         except Exception as e:
             custom_warning(self, "Заметки", f"Ошибка: {e}")
-    def make_block_card(self, block: dict, color: str):
-        t = self.theme
-        r = int(t.get("btn_radius", 10))
-        card = QFrame()
-        card.setObjectName("BlockCard")
-        card.setAttribute(Qt.WidgetAttribute.WA_Hover, True)
-        card.setFixedWidth(300)
-        from PySide6.QtWidgets import QSizePolicy
-        card.setSizePolicy(QSizePolicy.Fixed, QSizePolicy.Preferred)
-        vb = QVBoxLayout(card)
-        vb.setContentsMargins(12, 12, 12, 12)
-        vb.setSpacing(8)
-        top = QHBoxLayout()
-        title = QLabel(block.get("title", ""))
-        title.setStyleSheet(
-             f"font-weight:700; font-size:16px; letter-spacing:0.2px; color:{t['block_title_fg']};"
-        )
-        title.setWordWrap(True)
-        top.addWidget(title)
-        top_right_layout = QHBoxLayout()
-        top_right_layout.setSpacing(6)
-        tag = QLabel(block.get("category", ""))
-        tag_fg = self._contrast_text_for(color)
-        tag.setStyleSheet(
-            f"background:{color}; color:{tag_fg}; "
-            "font-size:11px; font-weight:600; "
-            "border-radius:10px; padding:4px 8px; min-height:18px; max-height:18px;"
-        )
-        top_right_layout.addWidget(tag)
-        att_n = attachments_count(block.get("id", ""))
-        if att_n > 0:
-            att_lbl = QLabel(f"📎 {att_n}")
-            att_lbl.setToolTip(f"Вложений: {att_n}")
-            att_lbl.setStyleSheet(
-                f"background:{t['attach_badge_bg']}; color:{t['attach_badge_fg']}; "
-                "font-size:11px; border-radius:7px; padding:5px; min-height:18px; max-height:18px;"
-            )
-            top_right_layout.addWidget(att_lbl)
-        btn_share = QPushButton()
-        share_ico = resource_path("icons/share.png")
-        if os.path.exists(share_ico):
-            btn_share.setIcon(QIcon(share_ico))
-            btn_share.setIconSize(QtCore.QSize(16, 16))
-        else:
-            btn_share.setText("🔗")
-        btn_share.setProperty("minsize", "compact")
-        btn_share.setToolTip("Поделиться")
-        btn_share.clicked.connect(lambda _, b=block: self.share_block(b))
-        top_right_layout.addWidget(btn_share)
-        try:
-            btn_qr = QPushButton()
-            qr_ico = resource_path("icons/qr.png")
-            if os.path.exists(qr_ico):
-                btn_qr.setIcon(QIcon(qr_ico))
-                btn_qr.setIconSize(QtCore.QSize(16, 16))
-            else:
-                btn_qr.setText("QR")
-            btn_qr.setProperty("minsize", "compact")
-            btn_qr.setToolTip("Показать QR")
-            btn_qr.clicked.connect(lambda _, b=block: self.show_block_qr(b))
-            top_right_layout.addWidget(btn_qr)
-        except Exception:
-            pass
-        ref = self.id_to_ref.get(block.get("id", ""))
-        key = ref[0] if ref else ""
-        path_list = [p for p in (key or "").split("/") if p]
-        locked_prefixes = self._locked_prefixes(path_list)
-        if any(p not in self.unlocked_sections for p in locked_prefixes):
-            btn_unlock = QPushButton("🔓")
-            btn_unlock.setProperty("minsize", "compact")
-            btn_unlock.setToolTip("Разблокировать раздел для показа данных")
-            def _do_unlock():
-                if self.ensure_section_unlocked(path_list):
-                    self.schedule_render()
-            btn_unlock.clicked.connect(_do_unlock)
-            top_right_layout.addWidget(btn_unlock)
-        top.addLayout(top_right_layout)
-        vb.addLayout(top)
-        fields = (block.get("fields") or {})
-        can_show = self.can_show_block_data(block)
-        items = list(fields.items())
-        limit = CARD_FIELDS_LIMIT if isinstance(CARD_FIELDS_LIMIT, int) and CARD_FIELDS_LIMIT > 0 else 6
-        shown_cnt = 0
-        for (k, vv) in items[:limit]:
-            row = QHBoxLayout()
-            lab = QLabel(str(k if k is not None else "").rstrip(":") + ":")
-            lab.setStyleSheet(
-                f"font-size:12px; font-weight:600; margin-right:6px; min-width:50px; color:{t['field_label_fg']};"
-            )
-            row.addWidget(lab)
-            if can_show:
-                val_plain = decrypt_value(vv, self.fernet)
-                txt = val_plain
-            else:
-                val_plain = None
-                txt = mask_text("")
-            edit = QLineEdit(txt)
-            edit.setReadOnly(True)
-            edit.setStyleSheet(
-                "QLineEdit {"
-                "  background:#FAFAFB; border:1px solid #ECECEE; border-radius:8px;"
-                "  padding:6px 8px; font-size:13px;"
-                f"  color:{t['field_text_fg']};"
-                "}"
-            )
-            row.addWidget(edit)
-            if can_show and val_plain and (is_url(val_plain) or is_email_addr(val_plain)):
-                btn_go = QPushButton("↗")
-                btn_go.setFixedWidth(28)
-                btn_go.setProperty("minsize", "compact")
-                btn_go.clicked.connect(lambda _=False, url=val_plain: QDesktopServices.openUrl(to_qurl_from_text(url)))
-                row.addWidget(btn_go)
-            btn_copy = QPushButton("🗐")
-            btn_copy.setFixedWidth(28)
-            btn_copy.setProperty("minsize", "compact")
-            def _copy_now(_checked=False, enc_val=vv, pl=tuple(path_list)):
-                if not self.ensure_chain_unlocked(list(pl)):
-                    return
-                try:
-                    plain = decrypt_value(enc_val, self.fernet)
-                except Exception:
-                    plain = ""
-                QApplication.clipboard().setText(str(plain))
-                self.clip_timer.start(self.CLIPBOARD_SEC * 1000)
-            btn_copy.clicked.connect(_copy_now)
-            row.addWidget(btn_copy)
-            vb.addLayout(row)
-            shown_cnt += 1
-        rest = max(0, len(items) - shown_cnt)
-        if rest > 0:
-            more = QLabel(f"… и ещё {rest} полей")
-            more.setStyleSheet("font-size:12px; color:#666; margin-top:4px;")
-            vb.addWidget(more)
-        rowb = QHBoxLayout()
-        def _btn_grey(text: str, tooltip: str, handler):
-            b = QPushButton(text)
-            b.setToolTip(tooltip)
-            b.setStyleSheet(
-                "padding:6px 10px; font-size:13px;"
-                "background:transparent; color:#1F2937;"
-                "border:1px solid #E6E7EA; border-radius:%dpx;"
-                "QPushButton:hover { background:#F7F8FA; }" % r
-            )
-            b.clicked.connect(handler)
-            return b
-        b_open  = _btn_grey("🔍", "Открыть блок",       lambda _, b=block: self.safe_open_block_editor(b))
-        b_move  = _btn_grey("↔️", "Переместить блок",   lambda _, b=block: self.move_block_dialog(b))
-        b_files = _btn_grey("📁", "Открыть вложения",   lambda _, b=block: self.open_attachments(b))
-        b_notes = _btn_grey("📝", "Открыть заметки",    lambda _, b=block: self.open_notes(b))
-        b_del   = _btn_grey("🗑️", "Удалить блок",       lambda _, b=block: self.delete_block_soft(b))
-        rowb.addWidget(b_open)
-        rowb.addWidget(b_move)
-        rowb.addWidget(b_files)
-        rowb.addWidget(b_notes)
-        rowb.addStretch(1)
-        rowb.addWidget(b_del)
-        vb.addLayout(rowb)
-        def _drag_start(event, bid=block["id"]):
-            if event.button() != Qt.MouseButton.LeftButton:
-                return
-            mime = QtCore.QMimeData()
-            mime.setData("application/x-linkpass-block-id", bid.encode("utf-8"))
-            drag = QDrag(self)
-            drag.setMimeData(mime)
-            drag.exec(Qt.DropAction.MoveAction)
-        card.mousePressEvent = _drag_start
-        return card
     def _format_block_share_text(self, block, reveal: bool = False) -> str:
         parts = [f"🔐 {block.get('title','')} ({block.get('category','')})"]
         can_show = reveal or self.can_show_block_data(block)
         for k, v in (block.get("fields") or {}).items():
-            val = decrypt_value(v, self.fernet) if can_show else "[скрыто]"
+            val = self.value_plain(block, k, v) if can_show else "[скрыто]"
             parts.append(f"{k}: {val}")
         return "\n".join(parts)
     def _guess_telegram_exe(self) -> str | None:
@@ -3740,7 +6175,7 @@ class MainWindow(QMainWindow):
             self.id_to_ref[bid] = (target_path, block)
             self.update_index_for_block(block)
             audit_write("move_block", {"block_id": bid, "from": from_key, "to": target_path})
-        self.save_blocks()
+        self.save_blocks(block_ids)
         self.schedule_render()
     def add_block(self):
         key = self.current_key()
@@ -3770,7 +6205,7 @@ class MainWindow(QMainWindow):
         self.blocks_data.setdefault(key, []).append(block)
         self.id_to_ref[block["id"]] = (key, block)
         self.update_index_for_block(block)
-        self.save_blocks()
+        self.save_blocks([block["id"]])
         self.schedule_render()
         audit_write("add_block", {"key": key, "block_id": block["id"], "title": block["title"]})
     def move_block_dialog(self, block):
@@ -3788,7 +6223,7 @@ class MainWindow(QMainWindow):
         block["category"] = target.split("/")[-1] if target else block.get("category", "")
         self.id_to_ref[block["id"]] = (target, block)
         self.update_index_for_block(block)
-        self.save_blocks()
+        self.save_blocks([block["id"]])
         self.schedule_render()
         audit_write("move_block", {"block_id": block["id"], "from": old_key, "to": target})
     def delete_block_soft(self, block):
@@ -3808,7 +6243,7 @@ class MainWindow(QMainWindow):
             "ts": datetime.utcnow().isoformat() + "Z"
         })
         self.remove_index_for_block(block)
-        self.save_blocks()
+        self.save_blocks(())
         self.save_trash()
         self.schedule_render()
         audit_write("trash_move", {"block_id": block["id"], "from": key})
@@ -3839,7 +6274,7 @@ class MainWindow(QMainWindow):
         self.id_to_ref[b["id"]] = (key, b)
         self.update_index_for_block(b)
         self.trash.remove(it)
-        self.save_blocks()
+        self.save_blocks([b["id"]])
         self.save_trash()
         self.current_path = [p for p in key.split("/") if p]
         self.schedule_render()
@@ -3859,14 +6294,15 @@ class MainWindow(QMainWindow):
         custom_info(self, "Корзина", f"Удалено: {cnt}")
         audit_write("trash_clear", {"count": cnt})
     def on_block_changed(self, block, meta=None):
+        sealed = block.get("sealed")
         for k, v in list(block.get("fields", {}).items()):
-            plain, ok = self._try_decrypt_once(v)
+            if value_is_current(v, self.fernet, sealed):
+                continue
+            plain, ok = self._try_decrypt_once(v, sealed)
             if ok:
                 block["fields"][k] = encrypt_value(plain, self.fernet)
-            else:
-                block["fields"][k] = v
         self.update_index_for_block(block)
-        self.save_blocks()
+        self.save_blocks([block["id"]])
         audit_write("block_changed", {"block_id": block["id"], **(meta or {})})
     def toggle_data(self):
         want = self.btn_toggle_data.isChecked()
@@ -3990,109 +6426,216 @@ class MainWindow(QMainWindow):
             custom_warning(self, "Пароль", "Пароли не совпадают.")
             return
         try:
-            old_fernet = self.fernet
             new_key_salt = rand_bytes(16)
             new_auth_salt = rand_bytes(16)
-            new_fernet = make_fernet(p1, new_key_salt,
-                         kdf_name=self.kdf_name, params=self.kdf_params)
-            for arr in self.blocks_data.values():
-                for b in arr:
-                    for kf, vf in list(b.get("fields", {}).items()):
-                        plain = decrypt_value(vf, old_fernet)
-                        b["fields"][kf] = new_fernet.encrypt(plain.encode("utf-8")).decode("utf-8")
-            for bid in os.listdir(ATTACH_DIR):
-                d = os.path.join(ATTACH_DIR, bid)
-                if not os.path.isdir(d):
-                    continue
-                for fn in os.listdir(d):
-                    fp = os.path.join(d, fn)
-                    if fn.endswith(".meta.json"):
-                        try:
-                            mj = secure_read_json(fp, old_fernet, {})
-                            secure_write_json(fp, mj, new_fernet)
-                        except Exception:
-                            pass
-                        continue
-                    try:
-                        with open(fp, "rb") as f:
-                            enc = f.read()
-                        data = old_fernet.decrypt(enc)
-                        new_enc = new_fernet.encrypt(data)
-                        with open(fp, "wb") as w:
-                            w.write(new_enc)
-                    except Exception:
-                        pass
+            secret = derive_key(p1, new_key_salt, prefer_argon=(self.kdf_name == "argon2id"), params=self.kdf_params)
+            ring = self.fernet.with_kek(kek_from_secret(secret))
+            write_auth_file(new_key_salt, new_auth_salt, auth_verifier(secret, new_auth_salt),
+                            self.kdf_name, self.kdf_params, keyring=ring)
             self.master = p1
             self.key_salt, self.auth_salt = new_key_salt, new_auth_salt
-            self.fernet = new_fernet
-            write_auth_file(new_key_salt, new_auth_salt,
-                hash_for_auth(p1, new_auth_salt,
-                              prefer_argon=(self.kdf_name == "argon2id"),
-                              params=self.kdf_params),
-                self.kdf_name, self.kdf_params)
-            self.ensure_verifier_current()
-            self.save_blocks()
-            self.save_tree()
-            self.save_meta()
-            self.save_trash()
-            custom_info(self, "Пароль", "Мастер-пароль изменён. Все данные пере-шифрованы.")
-            audit_write("master_changed", {})
+            self._set_keyring(ring)
+            self.wipe_plain_cache()
+            audit_write("master_changed", {"rekey": ring.rekey_pending})
         except Exception as e:
             custom_error(self, "Ошибка", f"Не удалось изменить пароль:\n{e}\n\n{traceback.format_exc()}")
+            return
+        if not ring.rekey_pending:
+            custom_info(self, "Пароль", "Мастер-пароль изменён. Ключ данных перезаписан под новым паролем.")
+            return
+        custom_info(self, "Пароль", "Мастер-пароль изменён. Ключ данных этого хранилища получен из прежнего пароля, "
+                                    "поэтому сейчас данные будут перешифрованы новым случайным ключом.\n"
+                                    "До завершения перешифровки данные остаются доступны со старым паролем.")
+        self.run_rekey(interactive=True)
+    def calibrate_kdf(self) -> None:
+        if not HAS_ARGON2:
+            custom_warning(self, "KDF", "Argon2 недоступен: установите пакет argon2-cffi.")
+            return
+        target, ok = QInputDialog.getInt(self, "Калибровка KDF", "Целевое время разблокировки, мс:",
+                                         KDF_TARGET_MS, 100, 10000, 100)
+        if not ok:
+            return
+        def done(res: dict):
+            new_params = {k: int(res[k]) for k in ("t", "m", "p")}
+            if not custom_question(self, "Калибровка KDF",
+                                   f"Текущие: t={self.kdf_params.get('t')}, m={int(self.kdf_params.get('m', 0))//1024} MiB, p={self.kdf_params.get('p')}\n"
+                                   f"Подобрано: t={new_params['t']}, m={new_params['m']//1024} MiB, p={new_params['p']} "
+                                   f"(≈{res.get('ms')} мс)\n\nПрименить новые параметры?"):
+                return
+            self.migrate_kdf_params(new_params, "argon2id")
+        run_long_task(self, "Калибровка KDF", lambda: calibrate_kdf_params(target), done)
     def migrate_kdf_params(self, new_params: dict, kdf_name: str = "argon2id") -> None:
         if not self.verify_master_prompt("Подтверждение", "Введите мастер‑пароль для смены параметров KDF:"):
             return
         QApplication.setOverrideCursor(Qt.CursorShape.WaitCursor)
         try:
-            old_fernet = self.fernet
-            new_fernet = make_fernet(self.master, self.key_salt, kdf_name=kdf_name, params=new_params)
-            for arr in self.blocks_data.values():
-                for b in arr:
-                    for kf, vf in list(b.get("fields", {}).items()):
-                        plain = decrypt_value(vf, old_fernet)
-                        b["fields"][kf] = new_fernet.encrypt(plain.encode("utf-8")).decode("utf-8")
-                    nplain = decrypt_value(b.get("notes", ""), old_fernet)
-                    b["notes"] = new_fernet.encrypt(nplain.encode("utf-8")).decode("utf-8")
-            for bid in os.listdir(ATTACH_DIR):
-                d = os.path.join(ATTACH_DIR, bid)
-                if not os.path.isdir(d): 
-                    continue
-                for fn in os.listdir(d):
-                    fp = os.path.join(d, fn)
-                    if fn.endswith(".meta.json"):
-                        try:
-                            mj = secure_read_json(fp, old_fernet, {})
-                            secure_write_json(fp, mj, new_fernet)
-                        except Exception:
-                            pass
-                        continue
-                    try:
-                        with open(fp, "rb") as f:
-                            enc = f.read()
-                        data = old_fernet.decrypt(enc)
-                        new_enc = new_fernet.encrypt(data)
-                        with open(fp, "wb") as w:
-                            w.write(new_enc)
-                    except Exception:
-                        pass
-            self.fernet = new_fernet
+            secret = derive_key(self.master, self.key_salt, prefer_argon=(kdf_name == "argon2id"), params=new_params)
+            ring = self.fernet.with_kek(kek_from_secret(secret))
             self.kdf_name = kdf_name
             self.kdf_params = dict(new_params)
             write_auth_file(
                 self.key_salt, self.auth_salt,
-                hash_for_auth(self.master, self.auth_salt, prefer_argon=(kdf_name == "argon2id"), params=self.kdf_params),
-                self.kdf_name, self.kdf_params
+                auth_verifier(secret, self.auth_salt),
+                self.kdf_name, self.kdf_params, keyring=ring
             )
-            self.ensure_verifier_current()
-            self.save_blocks(); self.save_tree(); self.save_meta(); self.save_trash()
-            try:
-                self.index.fernet = new_fernet
-                self.index.save()
-            except Exception:
-                pass
+            self._set_keyring(ring)
             custom_info(self, "KDF", "Параметры KDF обновлены.")
         finally:
             QApplication.restoreOverrideCursor()
+    def _set_keyring(self, ring: VaultKeyring) -> None:
+        self.fernet = ring
+        self.store.fernet = ring
+        self.journal.fernet = ring
+        self.index.fernet = ring
+        self.attachments.fernet = ring
+    def start_background_rekey(self) -> None:
+        self.run_rekey(interactive=False)
+    def full_rekey(self) -> None:
+        if self._rekey_worker is not None and self._rekey_worker.isRunning():
+            custom_info(self, "Перешифровка", "Перешифровка уже выполняется в фоне.")
+            return
+        if not self.verify_master_prompt("Подтверждение", "Введите мастер‑пароль для полной перешифровки:"):
+            return
+        if not custom_question(self, "Полная перешифровка",
+                               "Будет создан новый ключ хранилища, и все данные и вложения будут перешифрованы.\n"
+                               "Если вы подозреваете утечку мастер‑пароля, после этого смените и его.\n\nПродолжить?"):
+            return
+        self.run_rekey(interactive=True)
+    def _rekey_file_jobs(self) -> list[tuple[str, bytes | None]]:
+        jobs: list[tuple[str, bytes | None]] = []
+        for root, _, files in os.walk(ATTACH_DIR):
+            for fn in files:
+                fp = os.path.join(root, fn)
+                if fn.endswith(".meta.json"):
+                    jobs.append((fp, SECURE_JSON_PREFIX))
+                elif fn.endswith(".bin"):
+                    jobs.append((fp, None))
+        st = os.path.join(DATA_DIR, "_share_text")
+        if os.path.isdir(st):
+            for fn in os.listdir(st):
+                jobs.append((os.path.join(st, fn), SECURE_JSON_PREFIX))
+        for root, _, files in os.walk(RECORDS_DIR):
+            for fn in files:
+                if fn.endswith(".rec"):
+                    jobs.append((os.path.join(root, fn), RekeyEngine.RECORD))
+        return jobs
+    def _rekey_container_jobs(self) -> list[tuple[str, bytes]]:
+        jobs = [(p, SECURE_JSON_PREFIX) for p in (CATALOG_FILE, TREE_FILE, META_FILE, TRASH_FILE, INDEX_DB, ATTACH_CATALOG_FILE)]
+        jobs += [(p, SECURE_JSON_PREFIX) for p in self.index.segment_paths()]
+        return jobs
+    def run_rekey(self, interactive: bool = False) -> None:
+        if self._rekey_worker is not None and self._rekey_worker.isRunning():
+            return
+        self.compact_journal()
+        ring = self.fernet
+        if ring.dek_next is None:
+            ring = VaultKeyring(ring.dek, rand_bytes(32), ring.origin, ring.kek)
+            commit_keyring(ring)
+            self._set_keyring(ring)
+        engine = RekeyEngine(ring)
+        items: list[tuple[dict, str, str]] = []
+        labels: list[str] = []
+        def collect(b: dict):
+            bid = b.get("id", "")
+            for k, v in (b.get("fields") or {}).items():
+                if value_envelope(v) is not None:
+                    items.append((b["fields"], k, v))
+                    labels.append(f"{bid}:{k}")
+            if value_envelope(b.get("notes")) is not None:
+                items.append((b, "notes", b["notes"]))
+                labels.append(f"{bid}:notes")
+            if isinstance(b.get("sealed"), str):
+                items.append((b, "sealed", f"{SEALED_VALUE_PREFIX}s:{b['sealed']}"))
+                labels.append(f"{bid}:{', '.join(b.get('fields') or {}) or 'notes'}")
+        for arr in self.blocks_data.values():
+            for b in arr:
+                collect(b)
+        for it in self.trash:
+            if isinstance(it.get("block"), dict):
+                collect(it["block"])
+        for t in self.meta.get("export_tasks", []) or []:
+            if isinstance(t, dict) and t.get("enc_pwd_enc"):
+                items.append((t, "enc_pwd_enc", t["enc_pwd_enc"]))
+                labels.append(f"export_task:{t.get('name', '')}:enc_pwd_enc")
+        tokens = [v for _, _, v in items]
+        file_jobs = self._rekey_file_jobs()
+        def report(title: str, text: str):
+            if interactive:
+                custom_warning(self, title, text)
+            else:
+                self.statusBar().showMessage(text.splitlines()[0], 15000)
+            audit_write("vault_rekey_failed", {"error": text})
+        def spawn(fn, on_ok):
+            if interactive:
+                run_progress_task(self, "Перешифровка хранилища", fn, on_ok, engine.cancelled.set)
+                return
+            if self._rekey_worker is not None:
+                self._rekey_worker.wait()
+            th = ProgressWorkerThread(fn)
+            th.progress.connect(lambda stage, n, total: self.statusBar().showMessage(
+                f"Перешифровка хранилища — {stage}: {n}/{total}", 5000))
+            th.ok.connect(on_ok)
+            th.fail.connect(lambda msg: report("Перешифровка", msg))
+            self._rekey_worker = th
+            th.start()
+        def rotate(progress):
+            out = engine.rotate_tokens(tokens, progress)
+            with self.journal.compaction_lock:
+                engine.rotate_files(file_jobs, progress)
+            return out
+        def rotated(out):
+            if self.fernet.dek_next != ring.dek_next:
+                return
+            engine.unreadable.extend(label for label, new in zip(labels, out) if new is None)
+            try:
+                for (c, k, old), new in zip(items, out):
+                    if k == "sealed":
+                        old, new = old.split(":", 2)[2], (new.split(":", 2)[2] if new else None)
+                    if new is not None and c.get(k) == old:
+                        c[k] = new
+                self.store.rekey(self.fernet, self.blocks_data)
+                self.write_checkpoint()
+                self.attachments.save()
+                self.save_trash()
+                self.save_index(full=True)
+            except Exception as e:
+                report("Перешифровка", f"Не удалось записать данные под новым ключом: {e}")
+                return
+            bad = set(engine.unreadable)
+            jobs = [j for j in self._rekey_container_jobs() + file_jobs if os.path.relpath(j[0], DATA_DIR) not in bad]
+            spawn(lambda progress: engine.verify_files(jobs, progress), verified)
+        def verified(_):
+            if self.fernet.dek_next != ring.dek_next:
+                return
+            if engine.errors:
+                report("Перешифровка",
+                       f"Перешифровка не завершена: ошибок {len(engine.errors)}. Старый ключ сохранён, "
+                       f"повторите операцию позже.\n\n" + "\n".join(engine.errors[:20]))
+                return
+            if engine.unreadable:
+                lost = (f"Не удалось прочитать ни старым, ни новым ключом: {len(engine.unreadable)}\n"
+                        + "\n".join(engine.unreadable[:20]))
+                if not interactive:
+                    report("Перешифровка", f"Перешифровка не завершена: есть нечитаемые данные. Старый ключ сохранён.\n\n{lost}")
+                    return
+                if not custom_question(self, "Перешифровка",
+                                       f"{lost}\n\nПосле смены ключа эти данные будет невозможно восстановить. "
+                                       "Всё равно завершить перешифровку?"):
+                    audit_write("vault_rekey_declined", {"unreadable": len(engine.unreadable)})
+                    return
+            final = VaultKeyring(ring.dek_next, None, "random", self.fernet.kek)
+            commit_keyring(final)
+            self._set_keyring(final)
+            engine.clear_checkpoint()
+            audit_write("vault_rekeyed", {"items": len(items), "files": len(file_jobs), "unreadable": len(engine.unreadable)})
+            msg = "Хранилище перешифровано новым ключом."
+            if engine.unreadable:
+                msg += f"\nНе удалось прочитать (пропущены): {len(engine.unreadable)}\n" + "\n".join(engine.unreadable[:20])
+            if interactive:
+                custom_info(self, "Перешифровка", msg)
+            else:
+                self.statusBar().showMessage(msg.splitlines()[0], 15000)
+        spawn(rotate, rotated)
     def export_section(self, item):
         path = []
         cur = item
@@ -4113,14 +6656,12 @@ class MainWindow(QMainWindow):
                 "Название блока": b.get("title", "")
             }
             for kf, vf in b.get("fields", {}).items():
-                row[kf] = decrypt_value(vf, self.fernet)
+                row[kf] = decrypt_value(vf, self.fernet, b.get("sealed"))
                 all_fieldnames.add(kf)
             rows.append(row)
-        pref = key + "/" if key else ""
-        for k, arr in self.blocks_data.items():
-            if k == key or k.startswith(pref):
-                for b in arr:
-                    push_block(k, b)
+        for k, arr in (self.blocks_data.subtree_items(key) if key else list(self.blocks_data.items())):
+            for b in arr:
+                push_block(k, b)
         cols = ["Раздел", "Подраздел", "Подподраздел", "Название блока"] + sorted(all_fieldnames)
         self._export_rows(rows, cols, title="Экспорт раздела")
         audit_write("export_section", {"key": key, "rows": len(rows)})
@@ -4136,7 +6677,7 @@ class MainWindow(QMainWindow):
                 "Название блока": b.get("title", "")
             }
             for kf, vf in b.get("fields", {}).items():
-                row[kf] = decrypt_value(vf, self.fernet)
+                row[kf] = decrypt_value(vf, self.fernet, b.get("sealed"))
                 all_fieldnames.add(kf)
             rows.append(row)
         for k, arr in self.blocks_data.items():
@@ -4300,11 +6841,13 @@ class MainWindow(QMainWindow):
             elif path.endswith(".json"):
                 with open(path, "r", encoding="utf-8") as f:
                     loaded = json.load(f)
-                def encrypt_or_passthrough(val):
-                    plain, ok = self._try_decrypt_once(val)
+                def encrypt_or_passthrough(val, plain: str, ok: bool):
                     if ok:
-                        return encrypt_value(self._norm_cell(plain), self.fernet)
-                    if isinstance(val, str) and val.startswith("gAAAA"):
+                        norm = self._norm_cell(plain)
+                        if norm == plain and value_is_current(val, self.fernet):
+                            return val
+                        return encrypt_value(norm, self.fernet)
+                    if value_envelope(val) is not None:
                         return val
                     return encrypt_value(self._norm_cell(str(val)), self.fernet)
                 if isinstance(loaded, dict):
@@ -4322,9 +6865,10 @@ class MainWindow(QMainWindow):
                             cat = self._norm_cell(b.get("category", "")) or (key.split("/")[-1] if key and key != "_" else "")
                             fields = {}
                             for fk, fv in (b.get("fields", {}) or {}).items():
-                                nv = self._norm_cell(self._try_decrypt_once(fv)[0] if isinstance(fv, str) else str(fv))
+                                plain, ok = self._try_decrypt_once(fv, b.get("sealed")) if isinstance(fv, str) else (str(fv), False)
+                                nv = self._norm_cell(plain)
                                 if nv != "":
-                                    fields[fk] = encrypt_or_passthrough(fv)
+                                    fields[fk] = encrypt_or_passthrough(fv, plain, ok)
                             block = {"id": bid, "title": title_val, "category": cat, "fields": fields, "icon": ""}
                             if fields or title_val or cat:
                                 new_blocks.setdefault(key, []).append(block)
@@ -4488,10 +7032,10 @@ class MainWindow(QMainWindow):
             self.blocks_data.setdefault(k, []).extend(arr)
             for b in arr:
                 self.id_to_ref[b["id"]] = (k, b)
-                self.update_index_for_block(b)
             added += len(arr)
         self.save_tree()
-        self.save_blocks()
+        self.save_blocks([b["id"] for arr in new_blocks.values() for b in arr])
+        self.index_blocks([b for arr in new_blocks.values() for b in arr])
         self.render_tree()
         self.schedule_render()
         audit_write("import", {"file": path, "sections": len(new_blocks), "blocks": added})
@@ -4518,7 +7062,11 @@ class MainWindow(QMainWindow):
             try:
                 if not custom_question(self, "Восстановление", "Перезаписать текущие данные из бэкапа?\n(будет создана копия текущего состояния)"):
                     shutil.rmtree(tmpdir, ignore_errors=True); return
+                if self._rekey_worker is not None:
+                    self._rekey_worker.wait()
+                self.compact_journal()
                 self._copy_restored(tmpdir)
+                self.journal.discard()
                 shutil.rmtree(tmpdir, ignore_errors=True)
                 self._reload_all_from_disk_after_restore()
                 restored_blocks = 0
@@ -4535,56 +7083,59 @@ class MainWindow(QMainWindow):
     def _copy_restored(self, srcdir):
         bdir = os.path.join(DATA_DIR, "_backup_before_restore_" + datetime.now().strftime("%Y%m%d-%H%M%S"))
         os.makedirs(bdir, exist_ok=True)
-        for fn in (TREE_FILE, BLOCKS_FILE, TRASH_FILE, META_FILE, MASTER_FILE, INDEX_DB):
+        for fn in (TREE_FILE, BLOCKS_FILE, CATALOG_FILE, TRASH_FILE, META_FILE, MASTER_FILE, INDEX_DB, ATTACH_CATALOG_FILE):
             if os.path.exists(fn):
                 shutil.copy2(fn, os.path.join(bdir, os.path.basename(fn)))
         if os.path.isdir(ATTACH_DIR):
             shutil.copytree(ATTACH_DIR, os.path.join(bdir, "attachments"), dirs_exist_ok=True)
-        for base in ("tree.json", "blocks.json", "trash.json", "meta.json", "auth.json", "index.db"):
+        if os.path.isdir(RECORDS_DIR):
+            shutil.copytree(RECORDS_DIR, os.path.join(bdir, "records"), dirs_exist_ok=True)
+        for base in ("tree.json", "blocks.json", "catalog.json", "trash.json", "meta.json", "auth.json", "index.db", "attachments.json"):
             fp = os.path.join(srcdir, base)
             if os.path.exists(fp):
                 shutil.copy2(fp, os.path.join(DATA_DIR, base))
+        src_rec = os.path.join(srcdir, "records")
+        has_cat = os.path.exists(os.path.join(srcdir, "catalog.json"))
+        has_legacy = os.path.exists(os.path.join(srcdir, "blocks.json"))
+        if has_cat or has_legacy:
+            shutil.rmtree(RECORDS_DIR, ignore_errors=True)
+            if has_cat and os.path.isdir(src_rec):
+                shutil.copytree(src_rec, RECORDS_DIR, dirs_exist_ok=True)
+            os.makedirs(RECORDS_DIR, exist_ok=True)
+            for fn, keep in ((CATALOG_FILE, has_cat), (BLOCKS_FILE, has_legacy)):
+                if not keep and os.path.exists(fn):
+                    os.remove(fn)
         src_att = os.path.join(srcdir, "attachments")
         if os.path.isdir(src_att):
             shutil.copytree(src_att, ATTACH_DIR, dirs_exist_ok=True)
     def _reload_all_from_disk_after_restore(self) -> None:
         try:
             if os.path.exists(MASTER_FILE):
-                with open(MASTER_FILE, "r", encoding="utf-8") as f:
-                    j = json.load(f)
-                new_key_salt = base64.b64decode(j.get("key_salt", "")) if j.get("key_salt") else self.key_salt
-                new_auth_salt = base64.b64decode(j.get("auth_salt", "")) if j.get("auth_salt") else self.auth_salt
-                kdf = j.get("kdf", "argon2id")
-                params = j.get("kdf_params") or KDF_DEFAULTS
-                verifier = j.get("verifier", "")
-                calc = hash_for_auth(self.master, new_auth_salt,
-                                    prefer_argon=(kdf == "argon2id"), params=params)
-                if verifier and calc != verifier:
+                try:
+                    self.fernet = unlock_master(self.master)
+                except WrongMasterPasswordError:
                     pwd = self.ask_password("Мастер-пароль бэкапа",
                                             "После восстановления бэкапа мастер-пароль изменился.\n"
                                             "Введите пароль, с которым создавался бэкап:")
-                    if pwd:
-                        calc2 = hash_for_auth(pwd, new_auth_salt,
-                                            prefer_argon=(kdf == "argon2id"), params=params)
-                        if calc2 == verifier:
-                            self.master = pwd
-                            self.key_salt, self.auth_salt = new_key_salt, new_auth_salt
-                            self.kdf_name, self.kdf_params = kdf, params
-                            self.fernet = make_fernet(self.master, self.key_salt,
-                                                    kdf_name=self.kdf_name, params=self.kdf_params)
-                        else:
-                            custom_warning(self, "Бэкап", "Пароль не подошёл. Данные будут загружены без расшифровки.")
-                else:
-                    self.key_salt, self.auth_salt = new_key_salt, new_auth_salt
-                    self.kdf_name, self.kdf_params = kdf, params
-                    self.fernet = make_fernet(self.master, self.key_salt,
-                                            kdf_name=self.kdf_name, params=self.kdf_params)
+                    try:
+                        self.fernet = unlock_master(pwd or "")
+                        self.master = pwd
+                    except WrongMasterPasswordError:
+                        custom_warning(self, "Бэкап", "Пароль не подошёл. Данные будут загружены без расшифровки.")
+                self.key_salt, self.auth_salt = self.ensure_salts()
         except Exception as e:
             custom_warning(self, "Бэкап", f"Не удалось применить мастер-ключ из бэкапа: {e}")
         prev_path = list(self.current_path)
+        self.store = BlockStore(RECORDS_DIR, CATALOG_FILE, self.fernet)
+        self.journal = VaultJournal(JOURNAL_FILE, self.fernet, {"tree": TREE_FILE, "meta": META_FILE})
+        self.index.fernet = self.fernet
+        self.attachments.fernet = self.fernet
+        self.attachments.load()
+        self.reconcile_attachments_async()
         self.meta = self.load_meta()
         self.data_tree = self.load_tree()
-        self.blocks_data = self.load_blocks()
+        self.tree_index.rebuild(self.data_tree)
+        self.blocks_data = SectionIndex(self.load_blocks())
         self.trash = self.load_trash()
         self.run_startup_migrations()
         self.rebuild_index()
@@ -4592,6 +7143,8 @@ class MainWindow(QMainWindow):
         if prev_path:
             self._select_path_in_tree(prev_path)
         self.schedule_render()
+        if self.fernet.rekey_pending:
+            QTimer.singleShot(1500, self.start_background_rekey)
         audit_write("hot_reload_after_restore", {"sections": len(self.get_all_paths())})
     def show_export_tasks(self):
         ExportTasksManager(self).exec()
@@ -4757,7 +7310,7 @@ class MainWindow(QMainWindow):
         f = Fernet(base64.urlsafe_b64encode(key))
         return f.decrypt(enc) 
     def decrypt_export_file_dialog(self):
-        path, _ = QFileDialog.getOpenFileName(self, "Расшифровать экспорт (LPX1/LPEX1)", "", "LPX/LPEX (*.lpx *.lpex);;All Files (*)")
+        path, _ = QFileDialog.getOpenFileName(self, "Расшифровать экспорт (LPX2/LPX1/LPEX1)", "", "LPX/LPEX (*.lpx *.lpex);;All Files (*)")
         if not path:
             return
         pwd = self.ask_password("Пароль экспорта", "Введите пароль для расшифровки:")
@@ -4822,6 +7375,7 @@ class MainWindow(QMainWindow):
         except Exception:
             pass
         QApplication.clipboard().clear()
+        self.wipe_plain_cache()
         try:
             for p in list(self._temp_share_dirs):
                 shutil.rmtree(p, ignore_errors=True)
@@ -4859,7 +7413,18 @@ class MainWindow(QMainWindow):
             except Exception:
                 pass
             try:
-                self.index.save()
+                for th in (self._journal_worker, self._rekey_worker, self._index_worker, self._attach_worker):
+                    if th is not None:
+                        th.wait()
+            except Exception:
+                pass
+            try:
+                building = self._index_builder is not None
+                self.cancel_index_build()
+                if building:
+                    self.index.save()
+                else:
+                    self.index.save(self.store.generation(), self.store.fingerprints())
             except Exception:
                 pass
             try:
@@ -4872,6 +7437,7 @@ class MainWindow(QMainWindow):
                     self._temp_share_dirs.discard(p)
             except Exception:
                 pass
+            self.wipe_plain_cache()
         finally:
             super().closeEvent(e)
 def custom_info(parent, title, text):
@@ -5185,7 +7751,7 @@ class RecycleBinDialog(QDialog):
         self.win.id_to_ref[b["id"]] = (key, b)
         self.win.update_index_for_block(b)
         del self.win.trash[r]
-        self.win.save_blocks()
+        self.win.save_blocks([b["id"]])
         self.win.save_trash()
         self.populate()
         self.win.current_path = [p for p in key.split("/") if p]
@@ -5422,7 +7988,7 @@ class ExportTaskEditDialog(QDialog):
         form.addWidget(QLabel("Каждые (мин):"), rowi, 0); form.addWidget(self.e_every, rowi, 1); rowi += 1
         form.addWidget(QLabel("Время (ежедневно):"), rowi, 0); form.addWidget(self.e_time, rowi, 1); rowi += 1
         form.addWidget(QLabel("Папка для бэкапов:"), rowi, 0); form.addWidget(self.e_path, rowi, 1); form.addWidget(b_browse, rowi, 2); rowi += 1
-        form.addWidget(QLabel("Пароль (LPX1):"), rowi, 0); form.addWidget(self.e_pwd, rowi, 1, 1, 2); rowi += 1
+        form.addWidget(QLabel("Пароль (LPX2):"), rowi, 0); form.addWidget(self.e_pwd, rowi, 1, 1, 2); rowi += 1
         lay.addLayout(form)
         btns = QHBoxLayout()
         ok = QPushButton("Сохранить"); ok.clicked.connect(self.accept)
@@ -5477,7 +8043,7 @@ def ask_master_password() -> str | None:
     return dlg.value() if dlg.exec() == QDialog.DialogCode.Accepted else None
 def _vault_exists() -> bool:
     try:
-        if any(os.path.exists(p) for p in (TREE_FILE, BLOCKS_FILE, META_FILE, TRASH_FILE, INDEX_DB)):
+        if any(os.path.exists(p) for p in (TREE_FILE, BLOCKS_FILE, CATALOG_FILE, JOURNAL_FILE, META_FILE, TRASH_FILE, INDEX_DB, ATTACH_CATALOG_FILE)):
             return True
         if os.path.isdir(ATTACH_DIR):
             with os.scandir(ATTACH_DIR) as it:
@@ -5498,7 +8064,7 @@ def main():
             return 0
         master = dlg.value()
         try:
-            win = MainWindow(master)
+            win = MainWindow(master, create_auth_file(master))
         except Exception as e:
             try:
                 custom_error(None, "Ошибка запуска", f"Не удалось инициализировать приложение:\n{e}")
@@ -5513,20 +8079,7 @@ def main():
                 return 0
             master = dlg.value()
             try:
-                with open(MASTER_FILE, "r", encoding="utf-8") as f:
-                    j = json.load(f)
-                auth_salt = base64.b64decode(j.get("auth_salt", "") or b"")
-                kdf_name  = j.get("kdf", "argon2id")
-                kdf_params = j.get("kdf_params") or KDF_DEFAULTS
-                calc = hash_for_auth(master, auth_salt, prefer_argon=(kdf_name == "argon2id"), params=kdf_params)
-                if calc != j.get("verifier"):
-                    custom_error(None, "Мастер‑пароль", "Неверный мастер‑пароль. Попробуйте ещё раз.")
-                    continue
-            except Exception:
-                pass
-
-            try:
-                win = MainWindow(master)
+                win = MainWindow(master, unlock_master(master))
                 break
             except WrongMasterPasswordError:
                 try:
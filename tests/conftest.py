@@ -0,0 +1,22 @@
+import os
+import sys
+import tempfile
+
+os.environ["HOME"] = tempfile.mkdtemp(prefix="linkpass-tests-")
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import pytest
+
+import LinkPass
+
+
+@pytest.fixture
+def ring():
+    LinkPass._sealed_plain.clear()
+    return LinkPass.VaultKeyring(os.urandom(32))
+
+
+@pytest.fixture
+def store(tmp_path, ring):
+    return LinkPass.BlockStore(str(tmp_path / "records"), str(tmp_path / "catalog.json"), ring)
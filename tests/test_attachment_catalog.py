@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+from LinkPass import AttachmentCatalog, VaultKeyring, encrypt_attachment_file, secure_write_json
+
+
+@pytest.fixture
+def catalog(tmp_path, ring):
+    return AttachmentCatalog(str(tmp_path / "attachments.json"), str(tmp_path / "att"), ring)
+
+
+def _attach(catalog, ring, bid, fid, data, meta=None, meta_ring=None):
+    os.makedirs(catalog.block_dir(bid), exist_ok=True)
+    src = os.path.join(os.path.dirname(catalog.root), fid + ".src")
+    with open(src, "wb") as f:
+        f.write(data)
+    dst = os.path.join(catalog.block_dir(bid), fid)
+    encrypt_attachment_file(src, dst, ring)
+    if meta is not None:
+        secure_write_json(dst + ".meta.json", meta, meta_ring or ring)
+
+
+def test_reconcile_indexes_files_with_meta(catalog, ring):
+    _attach(catalog, ring, "b1", "f1", b"hello", {"orig_name": "h.txt", "size": 5})
+    assert catalog.reconcile() == (1, 0)
+    e = catalog.entry("b1", "f1")
+    assert e["name"] == "h.txt" and e["size"] == 5 and e["mime"] == "text/plain"
+    assert catalog.count("b1") == 1 and catalog.entries("b1") == [e]
+
+
+def test_meta_under_other_key_falls_back_to_empty(catalog, ring):
+    other = VaultKeyring(os.urandom(32))
+    _attach(catalog, ring, "b1", "f1", b"abc", {"orig_name": "secret.pdf"}, meta_ring=other)
+    _attach(catalog, ring, "b2", "f2", b"hello", {"orig_name": "ok.txt"})
+    assert catalog.reconcile() == (2, 0)
+    assert catalog.entry("b1", "f1")["name"] == "f1"
+    assert catalog.entry("b1", "f1")["size"] == 3
+    assert catalog.entry("b2", "f2")["name"] == "ok.txt"
+
+
+def test_failed_scan_resets_touched(catalog, ring, monkeypatch):
+    _attach(catalog, ring, "b1", "f1", b"abc", {"orig_name": "a.txt"})
+    def boom(*a, **kw):
+        raise RuntimeError("scan failed")
+    monkeypatch.setattr(catalog, "_scan_block", boom)
+    with pytest.raises(RuntimeError):
+        catalog.reconcile()
+    assert catalog._touched is None
+    monkeypatch.undo()
+    assert catalog.reconcile() == (1, 0)
+    assert catalog.count("b1") == 1
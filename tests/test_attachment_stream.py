@@ -0,0 +1,103 @@
+import os
+
+import pytest
+from cryptography.fernet import InvalidToken
+
+import LinkPass
+from LinkPass import AttachmentStream, VaultKeyring, decrypt_attachment_file, encrypt_attachment_file, iter_attachment_plain
+
+SEG = 64
+REC = AttachmentStream.NONCE + SEG + AttachmentStream.TAG
+
+
+@pytest.fixture
+def ring(monkeypatch):
+    monkeypatch.setattr(LinkPass, "ATTACH_SEGMENT", SEG)
+    return VaultKeyring(os.urandom(32))
+
+
+def _encrypt(tmp_path, ring, data):
+    src, dst = tmp_path / "plain", tmp_path / "enc.bin"
+    src.write_bytes(data)
+    encrypt_attachment_file(str(src), str(dst), ring)
+    return dst
+
+
+def _read(path, ring):
+    return b"".join(iter_attachment_plain(str(path), ring))
+
+
+def _set_total(path, total):
+    raw = bytearray(path.read_bytes())
+    head = AttachmentStream.HEAD
+    magic, alg, seg, _, salt, kid = head.unpack(raw[:head.size])
+    raw[:head.size] = head.pack(magic, alg, seg, total, salt, kid)
+    path.write_bytes(bytes(raw))
+
+
+@pytest.mark.parametrize("size", [0, 1, SEG, SEG + 1, 3 * SEG])
+def test_roundtrip(tmp_path, ring, size):
+    data = os.urandom(size)
+    enc = _encrypt(tmp_path, ring, data)
+    assert _read(enc, ring) == data
+    n = max(1, -(-size // SEG))
+    assert len(enc.read_bytes()) == AttachmentStream.HEAD.size + n * (AttachmentStream.NONCE + AttachmentStream.TAG) + size
+    out = tmp_path / "out"
+    assert decrypt_attachment_file(str(enc), str(out), ring) == size and out.read_bytes() == data
+
+
+def test_truncated_segment_fails(tmp_path, ring):
+    enc = _encrypt(tmp_path, ring, os.urandom(3 * SEG))
+    enc.write_bytes(enc.read_bytes()[:-10])
+    with pytest.raises(InvalidToken):
+        _read(enc, ring)
+
+
+def test_dropping_whole_segments_fails_even_with_fixed_total(tmp_path, ring):
+    enc = _encrypt(tmp_path, ring, os.urandom(3 * SEG))
+    enc.write_bytes(enc.read_bytes()[:AttachmentStream.HEAD.size + 2 * REC])
+    with pytest.raises(InvalidToken):
+        _read(enc, ring)
+    _set_total(enc, 2 * SEG)
+    with pytest.raises(InvalidToken):
+        _read(enc, ring)
+
+
+def test_final_flag_and_order_are_authenticated(tmp_path, ring):
+    enc = _encrypt(tmp_path, ring, os.urandom(2 * SEG + 5))
+    raw = enc.read_bytes()
+    h = AttachmentStream.HEAD.size
+    segs = [raw[h:h + REC], raw[h + REC:h + 2 * REC], raw[h + 2 * REC:]]
+    enc.write_bytes(raw[:h] + segs[1] + segs[0] + segs[2])
+    with pytest.raises(InvalidToken):
+        _read(enc, ring)
+    enc.write_bytes(raw[:h] + segs[0] + segs[2])
+    _set_total(enc, SEG + 5)
+    with pytest.raises(InvalidToken):
+        _read(enc, ring)
+
+
+def test_trailing_bytes_fail(tmp_path, ring):
+    enc = _encrypt(tmp_path, ring, b"hello")
+    enc.write_bytes(enc.read_bytes() + b"\0")
+    with pytest.raises(InvalidToken):
+        _read(enc, ring)
+
+
+def test_empty_file_needs_its_final_segment(tmp_path, ring):
+    enc = _encrypt(tmp_path, ring, b"")
+    assert _read(enc, ring) == b""
+    enc.write_bytes(enc.read_bytes()[:AttachmentStream.HEAD.size])
+    with pytest.raises(InvalidToken):
+        _read(enc, ring)
+
+
+def test_foreign_key_is_rejected(tmp_path, ring):
+    enc = _encrypt(tmp_path, ring, b"data")
+    with pytest.raises(InvalidToken):
+        _read(enc, VaultKeyring(os.urandom(32)))
+    raw = bytearray(enc.read_bytes())
+    raw[-1] ^= 1
+    enc.write_bytes(bytes(raw))
+    with pytest.raises(InvalidToken):
+        _read(enc, ring)
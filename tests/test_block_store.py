@@ -0,0 +1,30 @@
+from LinkPass import encrypt_value
+
+
+def _vault(ring, n=5):
+    return {"A": [{"id": f"b{i}", "title": f"t{i}", "fields": {"login": encrypt_value(f"user{i}", ring)}}
+                  for i in range(n)]}
+
+
+def test_stage_touches_only_changed_ids(store, ring, monkeypatch):
+    blocks = _vault(ring)
+    store.save(blocks)
+    blocks["A"][1]["title"] = "edited"
+    blocks["A"][2]["title"] = "edited too"
+    hashed = []
+    orig = store._fingerprint
+    monkeypatch.setattr(store, "_fingerprint", lambda b: hashed.append(b["id"]) or orig(b))
+    entry = store.stage(blocks, ["b1"])
+    assert set(entry["put"]) == {"b1"}
+    assert set(hashed) == {"b1"}
+
+
+def test_stage_with_no_ids_still_sees_new_and_deleted(store, ring):
+    blocks = _vault(ring)
+    store.save(blocks)
+    gone = blocks["A"].pop(0)
+    blocks["B"] = [{"id": "new", "title": "n", "fields": {}}]
+    entry = store.stage(blocks, ())
+    assert set(entry["put"]) == {"new"}
+    assert entry["del"] == [gone["id"]]
+    assert store._cat == {"A": ["b1", "b2", "b3", "b4"], "B": ["new"]}
@@ -0,0 +1,75 @@
+import pytest
+
+from LinkPass import FtsIndexDB, IndexDB, fts5_sqlite
+
+pytestmark = pytest.mark.skipif(fts5_sqlite() is None, reason="SQLite without FTS5 trigram")
+
+
+def _cols(title, category="", pairs=(), notes="", updated=0):
+    fields = "\n".join(f"{n}\n{v}" for n, v in pairs)
+    return ("\n".join([title, category, fields, notes]),
+            {"title": title, "category": category, "fields": fields, "notes": notes,
+             "pairs": [list(p) for p in pairs], "updated": updated})
+
+
+@pytest.fixture
+def fts(tmp_path, ring):
+    idx = FtsIndexDB(str(tmp_path / "index.db"), ring)
+    idx.upsert("mail", *_cols("Почта", "Личное", [("Логин", "ivan@mail.ru"), ("Пароль", "qwerty")]))
+    idx.upsert("bank", *_cols("Сбербанк", "Финансы", [("Номер карты", "4276 0000")], notes="банк в Москве"))
+    idx.upsert("note", *_cols("Заметка", "Личное", notes="пароль от почты у Ивана"))
+    return idx
+
+
+def test_substring_and_short_queries(fts):
+    assert fts.search("банк") == ["bank"]
+    assert set(fts.search("ПОЧТ")) == {"mail", "note"}
+    assert fts.search("42") == ["bank"]
+    assert fts.search("zzz") == []
+    assert set(fts.search("")) == {"mail", "bank", "note"}
+
+
+def test_title_hits_rank_above_notes(fts):
+    assert fts.search("почт") == ["mail", "note"]
+
+
+def test_column_filters(fts):
+    assert set(fts.search("category:личное")) == {"mail", "note"}
+    assert fts.search("заметки:ивана") == ["note"]
+    assert fts.search("title:почта пароль") == ["mail"]
+    assert fts.search("title:почта ивана") == []
+    assert fts.search("категория:финансы банк") == ["bank"]
+
+
+def test_field_queries(fts):
+    assert fts.has_field("логин") and not fts.has_field("pin")
+    assert fts.search_fields("логин=ivan") == ["mail"]
+    assert fts.search_fields("пароль=") == ["mail"]
+    assert fts.search_fields("4276") == ["bank"]
+
+
+def test_delete_and_recategorize(fts):
+    fts.delete("note")
+    assert fts.search("заметка") == []
+    assert fts.recategorize("mail", "Почта", "Личное", "Работа")
+    assert fts.search("category:работа") == ["mail"]
+    assert not fts.recategorize("mail", "Почта", "Личное", "Дом")
+
+
+def test_base_and_delta_survive_reload(fts, ring):
+    fts.save(full=True)
+    fts.upsert("new", *_cols("Новый", pairs=[("PIN", "1234")]))
+    fts.delete("bank")
+    fts.save()
+    assert len(fts.segment_paths()) == 1
+    fresh = FtsIndexDB(fts.path, ring)
+    assert set(fresh.ids()) == {"mail", "note", "new"}
+    assert fresh.search("новый") == ["new"] and fresh.search_fields("pin=1234") == ["new"]
+
+
+def test_legacy_dict_index_is_imported(tmp_path, ring):
+    old = IndexDB(str(tmp_path / "index.db"), ring)
+    old.upsert("x", "старый индекс")
+    old.save(full=True)
+    fresh = FtsIndexDB(old.path, ring)
+    assert fresh.search("индекс") == ["x"]
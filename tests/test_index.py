@@ -0,0 +1,110 @@
+import pytest
+
+import LinkPass
+from LinkPass import IndexDB, TokenIndexBackend, TrigramIndexBackend
+
+
+@pytest.fixture
+def index(tmp_path, ring):
+    idx = IndexDB(str(tmp_path / "index.lpi"), ring)
+    for i in range(40):
+        idx.upsert(f"b{i}", f"block {i}")
+    idx.save(full=True)
+    return idx
+
+
+def _reload(index, ring):
+    return IndexDB(index.path, ring)
+
+
+def test_delta_roundtrip(index, ring):
+    index.upsert("b1", "renamed")
+    index.save()
+    assert len(index.segment_paths()) == 1
+    assert _reload(index, ring).search("renamed") == ["b1"]
+
+
+def _boom(*a, **kw):
+    raise OSError(28, "No space left on device")
+
+
+def test_failed_write_keeps_pending(index, ring, monkeypatch):
+    index.upsert("b1", "renamed")
+    seq = index._seq
+    monkeypatch.setattr(LinkPass, "secure_write_json", _boom)
+    with pytest.raises(OSError):
+        index.save()
+    assert "b1" in index._pending and index._seq == seq
+    assert index.segment_paths() == []
+    monkeypatch.undo()
+    index.save()
+    assert index._pending == {}
+    assert _reload(index, ring).search("renamed") == ["b1"]
+
+
+def test_failed_base_write_keeps_base(index, ring, monkeypatch):
+    base = index._base_id
+    index.upsert("b2", "changed")
+    monkeypatch.setattr(LinkPass, "secure_write_bytes", _boom)
+    with pytest.raises(OSError):
+        index.save(full=True)
+    assert index._base_id == base and "b2" in index._pending
+
+
+def test_single_token_matches_inside_words():
+    be = TokenIndexBackend()
+    be.add("a", "github login")
+    be.add("b", "gitlab")
+    assert be.candidates("git") == {"a", "b"}
+    assert be.candidates("hub") == {"a"}
+    assert be.candidates("ogi") == {"a"}
+    assert be.candidates("xyz") == set()
+    be.add("c", "hubspot")
+    be.remove("a", "github login")
+    assert be.candidates("hub") == {"c"}
+
+
+def test_suffix_list_is_kept_up_to_date_on_edits():
+    be = TokenIndexBackend()
+    be.add("a", "alpha beta")
+    assert be.candidates("ph") == {"a"}
+    suffixes = be._suffixes
+    be.add("b", "gamma alpha")
+    be.retag("a", "alpha beta", "alpha delta")
+    assert be._suffixes is suffixes
+    assert suffixes == sorted((t[i:], t) for t in be._postings for i in range(len(t)))
+    assert be.candidates("et") == set()
+    assert be.candidates("elt") == {"a"}
+    assert be.candidates("amm") == {"b"}
+
+
+def test_trigram_retag_drops_old_grams_and_counts_dead_docs():
+    be = TrigramIndexBackend()
+    be.add("a", "mail\nwork")
+    be.add("b", "mail\nhome")
+    be.retag("a", "mail\nwork", "mail\nhome")
+    assert be.candidates("work") == set()
+    assert be.candidates("home") == {"a", "b"}
+    assert be._dead == 1
+    be._dead = 2000
+    be._docs.extend([None] * 10)
+    assert be.needs_compaction()
+
+
+def test_recategorize_on_trigram_index_forgets_old_category(index, ring, monkeypatch):
+    monkeypatch.setattr(LinkPass, "TRIGRAM_MIN_BLOCKS", 10)
+    idx = IndexDB(index.path, ring)
+    idx._reindex()
+    assert idx.backend_name == TrigramIndexBackend.NAME
+    idx.upsert("b1", "title\nold\nrest")
+    assert idx.recategorize("b1", "title", "old", "new")
+    assert idx.search("old") == [] and idx.search("new") == ["b1"]
+    assert "b1" not in idx._backend.candidates("old")
+
+
+def test_segmented_index_requires_storage_hooks():
+    class Partial(LinkPass.SegmentedIndex):
+        def _count(self):
+            return 0
+    with pytest.raises(TypeError):
+        Partial()
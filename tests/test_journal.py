@@ -0,0 +1,92 @@
+import os
+import struct
+
+import pytest
+
+from LinkPass import VaultJournal, secure_read_json
+
+
+@pytest.fixture
+def journal(tmp_path, ring):
+    j = VaultJournal(str(tmp_path / "journal.lpj"), ring, {"meta": str(tmp_path / "meta.json")})
+    for i in range(1, 4):
+        j.append({"t": "meta", "data": {"n": i}})
+    return j
+
+
+def _frames(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    bounds, pos = [], 0
+    while pos < len(data):
+        bounds.append(pos)
+        pos += 6 + struct.unpack(">I", data[pos + 2:pos + 6])[0]
+    return data, bounds
+
+
+def _write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def _replayed(journal, store):
+    journal.compact(store)
+    return secure_read_json(journal.files["meta"], journal.fernet, None), os.path.exists(journal.path + ".bad")
+
+
+def test_clean_journal_replays_everything(journal, store):
+    entries, clean = journal.read(journal.path)
+    assert clean and [e["data"]["n"] for e in entries] == [1, 2, 3]
+    assert _replayed(journal, store) == ({"n": 3}, False)
+
+
+def test_truncated_at_frame_boundary_is_clean(journal, store):
+    data, bounds = _frames(journal.path)
+    _write(journal.path, data[:bounds[2]])
+    entries, clean = journal.read(journal.path)
+    assert clean and len(entries) == 2
+    assert _replayed(journal, store) == ({"n": 2}, False)
+
+
+def test_garbage_at_frame_boundary_is_quarantined(journal, store):
+    data, bounds = _frames(journal.path)
+    _write(journal.path, data[:bounds[1]] + b"\0garbage" + data[bounds[1]:])
+    entries, clean = journal.read(journal.path)
+    assert not clean and len(entries) == 1
+    assert _replayed(journal, store) == ({"n": 1}, True)
+
+
+def test_truncated_length_header_is_quarantined(journal, store):
+    data, bounds = _frames(journal.path)
+    _write(journal.path, data[:bounds[2] + 4])
+    entries, clean = journal.read(journal.path)
+    assert not clean and len(entries) == 2
+    assert _replayed(journal, store) == ({"n": 2}, True)
+
+
+def test_torn_last_frame_is_quarantined(journal, store):
+    data, bounds = _frames(journal.path)
+    _write(journal.path, data[:(bounds[2] + len(data)) // 2])
+    entries, clean = journal.read(journal.path)
+    assert not clean and len(entries) == 2
+    assert _replayed(journal, store) == ({"n": 2}, True)
+
+
+def test_corrupt_middle_frame_stops_replay(journal, store):
+    data, bounds = _frames(journal.path)
+    bad = bytearray(data)
+    bad[bounds[1] + 20] ^= 0xFF
+    _write(journal.path, bytes(bad))
+    entries, clean = journal.read(journal.path)
+    assert not clean and len(entries) == 1
+    assert _replayed(journal, store) == ({"n": 1}, True)
+
+
+def test_corrupt_first_frame_does_not_lock_the_vault(journal, store):
+    data, _ = _frames(journal.path)
+    bad = bytearray(data)
+    bad[20] ^= 0xFF
+    _write(journal.path, bytes(bad))
+    assert journal.read(journal.path) == ([], False)
+    assert _replayed(journal, store) == (None, True)
+    assert not os.path.exists(journal.path) and not os.path.exists(journal.rotated)
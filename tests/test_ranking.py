@@ -0,0 +1,56 @@
+import time
+
+import pytest
+
+from LinkPass import FtsIndexDB, IndexDB, fts5_sqlite, search_score
+
+BACKENDS = [IndexDB] + ([FtsIndexDB] if fts5_sqlite() is not None else [])
+
+
+def _put(idx, bid, title, pairs=(), notes="", updated=0):
+    fields = "\n".join(f"{n}\n{v}" for n, v in pairs)
+    idx.upsert(bid, "\n".join([title, "", fields, notes]),
+               {"title": title, "category": "", "fields": fields, "notes": notes,
+                "pairs": [list(p) for p in pairs], "updated": updated})
+
+
+@pytest.fixture(params=BACKENDS, ids=lambda c: c.__name__)
+def idx(request, tmp_path, ring):
+    idx = request.param(str(tmp_path / "index.db"), ring)
+    _put(idx, "notes", "Разное", notes="почта")
+    _put(idx, "value", "Сервис", [("Адрес", "почта.рф")])
+    _put(idx, "name", "Сервис 2", [("Почта", "x")])
+    _put(idx, "partial", "Почта России")
+    _put(idx, "exact", "Почта")
+    return idx
+
+
+def test_title_beats_fields_beats_notes(idx):
+    ids = ["notes", "value", "name", "partial", "exact"]
+    assert idx.top_k("почта", ids, 5) == ["exact", "partial", "name", "value", "notes"]
+    assert idx.top_k("почта", ids, 2) == ["exact", "partial"]
+
+
+def test_recent_edits_break_ties(idx):
+    now = time.time()
+    _put(idx, "old", "Почта", updated=now - 365 * 86400)
+    _put(idx, "new", "Почта", updated=now - 60)
+    assert idx.top_k("почта", ["old", "exact", "new"], 3) == ["new", "old", "exact"]
+
+
+def test_equal_scores_keep_input_order(idx):
+    _put(idx, "twin", "Почта")
+    assert idx.top_k("почта", ["twin", "exact"], 2) == ["twin", "exact"]
+    assert idx.top_k("почта", ["exact", "twin"], 2) == ["exact", "twin"]
+
+
+def test_field_mode_scores_only_the_named_field(idx):
+    _put(idx, "both", "Аккаунт", [("Почта", "a"), ("Адрес", "почта")])
+    ids = ["value", "both"]
+    assert idx.top_k("адрес=почта", ids, 2, fields=True) == ["both", "value"]
+    assert search_score("почта", "адрес", "", [["почта", "a"]], "", 0, 0) == 0.0
+    assert search_score("почта", "адрес", "", [["адрес", "почта"]], "", 0, 0) == 4.0
+
+
+def test_unknown_ids_score_zero(idx):
+    assert idx.top_k("почта", ["missing", "exact"], 2) == ["exact", "missing"]
@@ -0,0 +1,132 @@
+import base64
+import json
+import os
+import time
+
+import pytest
+
+import LinkPass
+from LinkPass import (SECURE_JSON_PREFIX, SEALED_VALUE_PREFIX, RekeyEngine, VaultKeyring, encrypt_value,
+                      secure_decode, secure_write_json)
+
+
+@pytest.fixture
+def rings():
+    LinkPass._sealed_plain.clear()
+    old = VaultKeyring(os.urandom(32))
+    return old, VaultKeyring(old.dek, os.urandom(32))
+
+
+def _engine(ring, tmp_path):
+    return RekeyEngine(ring, str(tmp_path / "rekey.json"), workers=2)
+
+
+def _files(tmp_path, ring, n=5):
+    jobs = []
+    for i in range(n):
+        p = str(tmp_path / f"f{i}.json")
+        secure_write_json(p, {"n": i}, ring)
+        jobs.append((p, SECURE_JSON_PREFIX))
+    return jobs
+
+
+def _read(path, ring):
+    with open(path, "rb") as f:
+        return json.loads(secure_decode(f.read(), ring))
+
+
+def test_rotate_and_verify(rings, tmp_path):
+    old, ring = rings
+    jobs = _files(tmp_path, old)
+    engine = _engine(ring, tmp_path)
+    tokens = [encrypt_value("secret", old)]
+    new = engine.rotate_tokens(tokens)
+    engine.rotate_files(jobs)
+    engine.verify_files(jobs)
+    target = VaultKeyring(ring.dek_next)
+    assert engine.errors == [] and engine.unreadable == []
+    assert LinkPass.decrypt_value(new[0], target) == "secret"
+    assert [_read(p, target)["n"] for p, _ in jobs] == list(range(5))
+
+
+def test_resume_skips_files_done_by_the_same_run(rings, tmp_path):
+    old, ring = rings
+    jobs = _files(tmp_path, old)
+    first = _engine(ring, tmp_path)
+    first.rotate_files(jobs[:2])
+    with open(jobs[0][0], "rb") as f:
+        done = f.read()
+    resumed = _engine(ring, tmp_path)
+    assert len(resumed._done) == 2
+    resumed.rotate_files(jobs)
+    with open(jobs[0][0], "rb") as f:
+        assert f.read() == done
+    other = _engine(VaultKeyring(old.dek, os.urandom(32)), tmp_path)
+    assert other._done == set()
+
+
+def test_verify_reports_files_left_under_the_old_key(rings, tmp_path):
+    old, ring = rings
+    jobs = _files(tmp_path, old)
+    engine = _engine(ring, tmp_path)
+    engine.rotate_files(jobs[1:])
+    engine.verify_files(jobs)
+    assert len(engine.errors) == 1 and "f0.json" in engine.errors[0]
+
+
+def test_unreadable_tokens_and_files_are_listed(rings, tmp_path):
+    old, ring = rings
+    foreign = VaultKeyring(os.urandom(32))
+    (tmp_path / "other").mkdir()
+    jobs = _files(tmp_path, old, 2) + _files(tmp_path / "other", foreign, 1)
+    engine = _engine(ring, tmp_path)
+    out = engine.rotate_tokens([encrypt_value("a", old), encrypt_value("b", foreign)])
+    engine.rotate_files(jobs)
+    assert out[0] is not None and out[1] is None
+    assert engine.unreadable == [os.path.relpath(jobs[2][0], LinkPass.DATA_DIR)]
+
+
+def test_record_jobs_rotate_the_inner_sealed_blob(rings, tmp_path, store):
+    old, ring = rings
+    store.fernet = old
+    blocks = {"A": [{"id": "x", "title": "t", "fields": {"P": encrypt_value("pw", old)}}]}
+    store.save(blocks)
+    b = blocks["A"][0]
+    engine = _engine(ring, tmp_path)
+    new_blob = engine.rotate_tokens([f"{SEALED_VALUE_PREFIX}s:{b['sealed']}"])[0].split(":", 2)[2]
+    engine.rotate_files([(store.record_path("x"), RekeyEngine.RECORD)])
+    rec = _read(store.record_path("x"), VaultKeyring(ring.dek_next))
+    assert rec["sealed"] == new_blob
+    raw = VaultKeyring(ring.dek_next).unseal(base64.urlsafe_b64decode(new_blob), SEALED_VALUE_PREFIX.encode("ascii"))
+    assert json.loads(raw)["f"] == ["pw"]
+
+
+@pytest.fixture
+def window(monkeypatch):
+    from PySide6.QtWidgets import QApplication
+    app = QApplication.instance() or QApplication([])
+    for name in ("custom_info", "custom_warning", "custom_error"):
+        monkeypatch.setattr(LinkPass, name, lambda *a, **k: None)
+    monkeypatch.setattr(LinkPass, "custom_question", lambda *a, **k: True)
+    ring = LinkPass.create_auth_file("pw123456")
+    w = LinkPass.MainWindow("pw123456", ring)
+    yield app, w
+    w.close()
+
+
+def test_background_rekey_holds_commit_on_unreadable_values(window):
+    app, w = window
+    foreign = VaultKeyring(os.urandom(32))
+    b = {"id": "z", "title": "t", "category": "A", "fields": {"Q": encrypt_value("lost", foreign)}, "icon": ""}
+    w.blocks_data.setdefault("A", []).append(b)
+    w.id_to_ref["z"] = ("A", b)
+    dek = w.fernet.dek
+    w.run_rekey(interactive=False)
+    deadline = time.time() + 30
+    while "не завершена" not in w.statusBar().currentMessage() and time.time() < deadline:
+        app.processEvents()
+        time.sleep(0.01)
+    assert "нечитаемые" in w.statusBar().currentMessage()
+    assert w.fernet.dek == dek and w.fernet.dek_next is not None
+    with open(LinkPass.MASTER_FILE, "r", encoding="utf-8") as f:
+        assert "dek_next" in json.load(f)
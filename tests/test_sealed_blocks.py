@@ -0,0 +1,65 @@
+import base64
+import json
+
+from LinkPass import (SEALED_VALUE_PREFIX, BlockStore, _sealed_plain, block_plain, encrypt_value,
+                      secure_read_json)
+
+
+def _payload(store, ring, bid):
+    rec = secure_read_json(store.record_path(bid), ring, None)
+    raw = ring.unseal(base64.urlsafe_b64decode(rec["sealed"]), SEALED_VALUE_PREFIX.encode("ascii"))
+    return rec, json.loads(raw.decode("utf-8"))
+
+
+def _vault(ring):
+    return {"A": [{"id": "x", "title": "mail", "fields": {"login": encrypt_value("ivan", ring),
+                                                           "pin": encrypt_value("secret-pin", ring)},
+                   "notes": encrypt_value("hello", ring)}]}
+
+
+def _reload(store, ring):
+    _sealed_plain.clear()
+    fresh = BlockStore(store.root, store.catalog_path, ring)
+    return fresh.load()["A"][0]
+
+
+def test_field_values_reference_one_blob(store, ring):
+    blocks = _vault(ring)
+    store.save(blocks)
+    b = blocks["A"][0]
+    assert b["fields"] == {"login": f"{SEALED_VALUE_PREFIX}0", "pin": f"{SEALED_VALUE_PREFIX}1"}
+    assert b["notes"] == f"{SEALED_VALUE_PREFIX}n"
+    rec, plain = _payload(store, ring, "x")
+    assert rec["fields"] == ["login", "pin"] and rec["sealed"] == b["sealed"]
+    assert plain == {"k": ["login", "pin"], "f": ["ivan", "secret-pin"], "n": "hello"}
+
+
+def test_deleting_last_field_reseals_without_old_value(store, ring):
+    blocks = _vault(ring)
+    store.save(blocks)
+    del blocks["A"][0]["fields"]["pin"]
+    store.save(blocks)
+    _, plain = _payload(store, ring, "x")
+    assert "secret-pin" not in json.dumps(plain)
+    assert block_plain(_reload(store, ring), ring) == ({"login": "ivan"}, "hello")
+
+
+def test_renaming_field_reseals(store, ring):
+    blocks = _vault(ring)
+    store.save(blocks)
+    b = blocks["A"][0]
+    b["fields"] = {("user" if k == "login" else k): v for k, v in b["fields"].items()}
+    store.save(blocks)
+    _, plain = _payload(store, ring, "x")
+    assert plain["k"] == ["user", "pin"]
+    assert block_plain(_reload(store, ring), ring) == ({"user": "ivan", "pin": "secret-pin"}, "hello")
+
+
+def test_legacy_embedded_blob_values_still_open(store, ring):
+    blocks = _vault(ring)
+    store.save(blocks)
+    b = blocks["A"][0]
+    legacy = {"id": "y", "title": "old", "fields": {k: f"{v}:{b['sealed']}" for k, v in b["fields"].items()},
+              "notes": f"{b['notes']}:{b['sealed']}"}
+    _sealed_plain.clear()
+    assert block_plain(legacy, ring) == ({"login": "ivan", "pin": "secret-pin"}, "hello")
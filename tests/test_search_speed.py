@@ -0,0 +1,46 @@
+import os
+import random
+import statistics
+import time
+
+import pytest
+
+from LinkPass import IndexDB, TrigramIndexBackend
+
+BLOCKS = 100_000
+
+pytestmark = pytest.mark.skipif(not os.environ.get("LINKPASS_BENCH"), reason="set LINKPASS_BENCH=1 to run")
+
+
+@pytest.fixture(scope="module")
+def big_index(tmp_path_factory):
+    rnd = random.Random(1)
+    abc = "абвгдежзиклмнопрстуфхabcdefghijklmnop0123"
+    words = ["".join(rnd.choice(abc) for _ in range(rnd.randint(3, 9))) for _ in range(30000)]
+    idx = IndexDB(str(tmp_path_factory.mktemp("bench") / "index.lpi"), None, load=False)
+    idx._data = {f"b{i}": " ".join(rnd.choice(words) for _ in range(12)) for i in range(BLOCKS)}
+    idx._reindex()
+    return idx, [w[1:5] for w in rnd.sample(words, 300)]
+
+
+def _timings(idx, queries):
+    out = []
+    for q in queries:
+        t = time.perf_counter()
+        idx.search(q)
+        out.append((time.perf_counter() - t) * 1000)
+    return sorted(out)
+
+
+def test_trigram_lookup_under_10ms(big_index):
+    idx, queries = big_index
+    assert idx.backend_name == TrigramIndexBackend.NAME
+    ms = _timings(idx, [q for q in queries if len(q) >= 3])
+    print(f"\n{BLOCKS} blocks, >=3 chars: median {statistics.median(ms):.2f} ms, max {ms[-1]:.2f} ms")
+    assert statistics.median(ms) < 10
+
+
+def test_short_queries_scan_linearly(big_index):
+    idx, queries = big_index
+    ms = _timings(idx, [q for q in queries if len(q) < 3])
+    print(f"\n{BLOCKS} blocks, <3 chars (linear scan): median {statistics.median(ms):.2f} ms")
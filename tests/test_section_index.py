@@ -0,0 +1,75 @@
+from LinkPass import SectionIndex
+
+
+def _blocks(n, tag="b"):
+    return [{"id": f"{tag}{i}"} for i in range(n)]
+
+
+def _counts(idx, *keys):
+    return [idx.subtree_count(k) for k in keys]
+
+
+def test_counts_follow_list_mutations():
+    idx = SectionIndex({"A": _blocks(2), "A/B": _blocks(3), "A/B/C": _blocks(1)})
+    assert _counts(idx, "A", "A/B", "A/B/C") == [6, 4, 1]
+    arr = idx["A/B"]
+    arr.append({"id": "x"})
+    arr.extend(_blocks(2, "y"))
+    assert _counts(idx, "A", "A/B") == [9, 7]
+    arr.remove(arr[0])
+    arr.pop()
+    del arr[0:2]
+    assert _counts(idx, "A", "A/B", "A/B/C") == [5, 3, 1]
+    arr[0:1] = _blocks(3, "z")
+    assert _counts(idx, "A", "A/B") == [7, 5]
+    arr.clear()
+    assert _counts(idx, "A", "A/B", "A/B/C") == [3, 1, 1]
+
+
+def test_setitem_and_delete_update_ancestors():
+    idx = SectionIndex({"A/B": _blocks(3)})
+    assert idx.subtree_count("A") == 3
+    idx["A/B"] = _blocks(1)
+    assert idx.subtree_count("A") == 1
+    idx.setdefault("A", []).append({"id": "a"})
+    assert idx.subtree_count("A") == 2
+    del idx["A/B"]
+    assert _counts(idx, "A", "A/B") == [1, 0]
+    idx.pop("A")
+    assert idx.subtree_count("A") == 0
+    assert idx._root.children == {} and idx._root.count == 0
+
+
+def test_detached_list_stops_counting():
+    idx = SectionIndex({"A": _blocks(2)})
+    old = idx.pop("A")
+    old.append({"id": "late"})
+    idx["A"] = _blocks(1)
+    old.append({"id": "later"})
+    assert idx.subtree_count("A") == 1
+
+
+def test_move_subtree_moves_counts():
+    idx = SectionIndex({"A": _blocks(1), "A/B": _blocks(2), "A/B/C": _blocks(3), "D": _blocks(1)})
+    updates = idx.move_subtree("A/B", "D/B")
+    assert updates == {"A/B": "D/B", "A/B/C": "D/B/C"}
+    assert _counts(idx, "A", "A/B", "D", "D/B", "D/B/C") == [1, 0, 6, 5, 3]
+    assert "B" not in idx._node("A").children
+    idx["D/B"].append({"id": "x"})
+    assert _counts(idx, "D", "D/B") == [7, 6]
+
+
+def test_move_subtree_merges_into_existing_key():
+    idx = SectionIndex({"A/B": _blocks(2, "a"), "D/B": _blocks(1, "d")})
+    idx.move_subtree("A", "D")
+    assert [b["id"] for b in idx["D/B"]] == ["d0", "a0", "a1"]
+    assert _counts(idx, "A", "D", "D/B") == [0, 3, 3]
+    assert "A" not in idx and "A" not in idx._root.children
+
+
+def test_clear_resets_counts():
+    idx = SectionIndex({"A/B": _blocks(2)})
+    arr = idx["A/B"]
+    idx.clear()
+    arr.append({"id": "x"})
+    assert idx.subtree_count("A") == 0 and idx._root.count == 0
@@ -0,0 +1,101 @@
+import os
+
+import pytest
+
+from LinkPass import BlockStore, SectionIndex, VaultJournal
+
+
+@pytest.fixture
+def vault(tmp_path, store, ring):
+    blocks = SectionIndex({
+        "A": [{"id": "a1", "title": "a", "category": "A", "fields": {}}],
+        "A/B": [{"id": "b1", "title": "b", "category": "B", "fields": {}},
+                {"id": "b2", "title": "bb", "category": "B", "fields": {}}],
+        "A/B/C": [{"id": "c1", "title": "c", "category": "C", "fields": {}}],
+        "D": [{"id": "d1", "title": "d", "category": "D", "fields": {}}],
+    })
+    store.save(blocks)
+    journal = VaultJournal(str(tmp_path / "journal.lpj"), ring, {"tree": str(tmp_path / "tree.json")})
+    return blocks, journal
+
+
+def _move(store, blocks, old, new):
+    moves = blocks.move_subtree(old, new)
+    changed = []
+    for k in dict.fromkeys(moves.values()):
+        for b in blocks.get(k, []):
+            cat = k.split("/")[-1]
+            if b["category"] != cat:
+                b["category"] = cat
+                changed.append(b["id"])
+    return store.stage_move(blocks, moves, changed)
+
+
+def _reload(store, ring):
+    fresh = BlockStore(store.root, store.catalog_path, ring)
+    blocks = fresh.load()
+    return {k: [(b["id"], b["category"]) for b in arr] for k, arr in blocks.items()}
+
+
+def test_rename_replays_layout_and_categories(vault, store, ring):
+    blocks, journal = vault
+    entry = _move(store, blocks, "A/B", "A/X")
+    assert set(entry["put"]) == {"b1", "b2"} and entry["moves"] == {"A/B": "A/X", "A/B/C": "A/X/C"}
+    journal.append(entry)
+    journal.compact(store)
+    assert _reload(store, ring) == {
+        "A": [("a1", "A")],
+        "A/X": [("b1", "X"), ("b2", "X")],
+        "A/X/C": [("c1", "C")],
+        "D": [("d1", "D")],
+    }
+
+
+def test_move_into_existing_section_keeps_order(vault, store, ring):
+    blocks, journal = vault
+    blocks.setdefault("D/B", []).append({"id": "e1", "title": "e", "category": "B", "fields": {}})
+    journal.append(store.stage(blocks, ["e1"]))
+    journal.append(_move(store, blocks, "A/B", "D/B"))
+    journal.compact(store)
+    assert _reload(store, ring)["D/B"] == [("e1", "B"), ("b1", "B"), ("b2", "B")]
+    assert store._cat == {k: [b["id"] for b in arr] for k, arr in blocks.items()}
+
+
+def test_move_without_changed_blocks_still_moves_records(vault, store, ring):
+    blocks, journal = vault
+    entry = _move(store, blocks, "A", "Z/A")
+    assert entry["put"] == {}
+    journal.append(entry)
+    journal.compact(store)
+    assert _reload(store, ring) == {
+        "Z/A": [("a1", "A")],
+        "Z/A/B": [("b1", "B"), ("b2", "B")],
+        "Z/A/B/C": [("c1", "C")],
+        "D": [("d1", "D")],
+    }
+
+
+def test_move_then_edit_replays_in_order(vault, store, ring):
+    blocks, journal = vault
+    journal.append(_move(store, blocks, "A/B", "D/B"))
+    blocks["D/B"][0]["title"] = "edited"
+    blocks["D/B"].pop()
+    edit = store.stage(blocks, ["b1"])
+    assert "sections" not in edit and edit["del"] == ["b2"]
+    journal.append(edit)
+    VaultJournal(journal.path, ring, journal.files).compact(store)
+    assert _reload(store, ring) == {
+        "A": [("a1", "A")],
+        "D": [("d1", "D")],
+        "D/B": [("b1", "B")],
+        "D/B/C": [("c1", "C")],
+    }
+    assert not os.path.exists(store.record_path("b2"))
+    fresh = BlockStore(store.root, store.catalog_path, ring)
+    assert fresh.load()["D/B"][0]["title"] == "edited"
+
+
+def test_stage_after_move_sees_no_layout_change(vault, store):
+    blocks, journal = vault
+    journal.append(_move(store, blocks, "A/B", "D/X"))
+    assert store.stage(blocks, ()) is None
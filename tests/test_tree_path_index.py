@@ -0,0 +1,94 @@
+from LinkPass import TreePathEntry, TreePathIndex
+
+
+def _node(name, *children, lock=False):
+    n = {"name": name, "children": list(children)}
+    if lock:
+        n["lock"] = True
+    return n
+
+
+def _tree():
+    return [
+        _node("A", _node("B", _node("C")), _node("D")),
+        _node("S", _node("T"), lock=True),
+    ]
+
+
+def _keys(idx):
+    return sorted(idx._map)
+
+
+def test_rebuild_tracks_nodes_parents_and_locks():
+    tree = _tree()
+    idx = TreePathIndex(tree)
+    assert _keys(idx) == ["A", "A/B", "A/B/C", "A/D", "S", "S/T"]
+    assert idx.node(["A", "B", "C"]) is tree[0]["children"][0]["children"][0]
+    assert idx.siblings(idx.get(["A"])) is tree
+    assert idx.siblings(idx.get(["A", "D"])) is tree[0]["children"]
+    assert idx.locked_prefixes(["S", "T", "missing"]) == ["S"]
+    assert idx.locked_prefixes(["A", "B"]) == []
+
+
+def test_rename_drops_old_subtree_and_indexes_new_one():
+    tree = _tree()
+    idx = TreePathIndex(tree)
+    b = idx.node(["A", "B"])
+    b["name"] = "X"
+    idx.drop(["A", "B"])
+    idx.reindex(["A", "X"])
+    assert _keys(idx) == ["A", "A/D", "A/X", "A/X/C", "S", "S/T"]
+    assert idx.node(["A", "X"]) is b
+    assert idx.get(["A", "X", "C"]).parent is b
+
+
+def test_move_under_locked_parent_inherits_lock():
+    tree = _tree()
+    idx = TreePathIndex(tree)
+    a = tree[0]
+    b = a["children"].pop(0)
+    tree[1]["children"].append(b)
+    idx.drop(["A", "B"])
+    idx.reindex(["S", "B"])
+    assert _keys(idx) == ["A", "A/D", "S", "S/B", "S/B/C", "S/T"]
+    assert idx.get(["S", "B", "C"]).locks == ("S",)
+    assert idx.siblings(idx.get(["S", "B"])) is tree[1]["children"]
+
+
+def test_move_to_top_level():
+    tree = _tree()
+    idx = TreePathIndex(tree)
+    d = tree[0]["children"].pop(1)
+    tree.append(d)
+    idx.drop(["A", "D"])
+    idx.reindex(["D"])
+    assert idx.get(["D"]).parent is None
+    assert idx.siblings(idx.get(["D"])) is tree
+    assert idx.get(["A", "D"]) is None
+
+
+def test_drop_keeps_entries_owned_by_other_nodes():
+    tree = _tree()
+    idx = TreePathIndex(tree)
+    new_c = _node("C")
+    idx._map["A/B/C"] = TreePathEntry(new_c, None, ())
+    idx.drop(["A", "B"])
+    assert idx.get(["A", "B"]) is None
+    assert idx.node(["A", "B", "C"]) is new_c
+
+
+def test_reindex_with_missing_parent_climbs_up():
+    tree = _tree()
+    idx = TreePathIndex(tree)
+    tree.append(_node("N", _node("M", _node("L"))))
+    idx.reindex(["N", "M", "L"])
+    assert {"N", "N/M", "N/M/L"} <= set(idx._map)
+    assert idx.get(["N", "M", "L"]).parent is tree[-1]["children"][0]
+
+
+def test_reindex_after_delete_removes_keys():
+    tree = _tree()
+    idx = TreePathIndex(tree)
+    del tree[0]["children"][0]
+    idx.reindex(["A", "B"])
+    assert _keys(idx) == ["A", "A/D", "S", "S/T"]